@@ -0,0 +1,213 @@
+from dataclasses import dataclass
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from feed_tables import StopArrivals
+from gtfs_data import fmt_times, service_time_to_datetime
+
+# Same rules as get_stop_schedule_context / determine_status_color.
+STALE_PAST_CUTOFF_SEC = 30 * 60
+MAX_DEVIATION_ANCHOR_SEC = 60 * 60
+
+# (status, color) by status code
+STATUSES = (
+    ("Early", "Blue"),
+    ("On Time", "Green"),
+    ("Late", "Orange"),
+    ("Very Late", "Red"),
+    ("Off Schedule", "Black"),
+)
+ON_TIME = 1
+OFF_SCHEDULE = 4
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _naive_seconds(dt):
+    return (dt - _EPOCH).total_seconds()
+
+
+def local_seconds(timestamps):
+    """
+    datetime.fromtimestamp(ts) for an array of Unix times, as naive local
+    seconds since 1970 — the arithmetic the per-stop code does with naive
+    datetimes, including across a DST change.
+    """
+    ts = np.asarray(timestamps, dtype=np.int64)
+    if not len(ts):
+        return ts.astype(np.float64)
+    lo, hi = int(ts.min()), int(ts.max())
+    offset = _naive_seconds(datetime.fromtimestamp(lo)) - lo
+    if _naive_seconds(datetime.fromtimestamp(hi)) - hi == offset:
+        return ts + offset
+    return np.array([_naive_seconds(datetime.fromtimestamp(t)) for t in ts.tolist()])
+
+
+def status_codes(delta):
+    """determine_status_color over an array of deltas (seconds), as STATUSES codes."""
+    return np.select([delta < -60, delta <= 120, delta <= 300], [0, 1, 2], default=3).astype(np.int8)
+
+
+@dataclass(frozen=True)
+class ScheduleMatch:
+    """
+    get_stop_schedule_context for many (stop_id, route_id, eta) at once.
+
+      scheduled_sec       – int64 current slot, -1 when the stop/route has none
+      delta               – float64, as get_stop_schedule_context returns it
+                            (0 for no slot or a stale slot, inf when off schedule)
+      past, current, next – formatted slots around the current one, or None
+      status              – int8 index into STATUSES
+      exact               – True where delta is a real deviation, i.e. what
+                            endpoints report as delta_sec (0 elsewhere)
+    """
+    scheduled_sec: np.ndarray
+    delta: np.ndarray
+    past: np.ndarray
+    current: np.ndarray
+    next: np.ndarray
+    status: np.ndarray
+    exact: np.ndarray
+
+    def context(self, i):
+        """(scheduled_sec, context dict, delta) of entry `i`, like get_stop_schedule_context."""
+        scheduled = int(self.scheduled_sec[i])
+        context = {"past": self.past[i], "current": self.current[i], "next": self.next[i]}
+        delta = float(self.delta[i])
+        if not (self.exact[i] or np.isinf(delta)):
+            delta = 0           # no slot, or a stale one
+        return (None if scheduled < 0 else scheduled), context, delta
+
+    def status_color(self, i):
+        return STATUSES[self.status[i]]
+
+    def delta_sec(self, i):
+        """Reported deviation: the delta when it is a real one, else 0."""
+        return float(self.delta[i]) if self.exact[i] else 0
+
+
+def match_schedule(flat_index, stop_ids, route_ids, eta_ts, now):
+    """
+    Matches every (stop_id, route_id, predicted Unix time) against a
+    FlatScheduleIndex in one pass, anchored on `now` (a naive local
+    datetime): the current slot is the first one at or after now, or the
+    last one of the day.
+    """
+    n = len(stop_ids)
+    midnight = service_time_to_datetime(now.date(), 0)
+    now_sec = (now - midnight).total_seconds()
+
+    key = flat_index.key_ids_for(stop_ids, route_ids)
+    has_slot = key >= 0
+    k = np.maximum(key, 0)
+    starts = flat_index.starts
+    start, end = starts[k], starts[np.minimum(k + 1, len(starts) - 1)]
+    # rows without a slot read position 0 below and are masked out
+    times = flat_index.times if len(flat_index.times) else np.zeros(1, dtype=np.int64)
+
+    # key k's run is [start, end) of the globally sorted composite keys
+    pos = np.searchsorted(flat_index.sort_keys, k * flat_index.KEY_STRIDE + now_sec, side="left")
+    cur = np.maximum(np.minimum(pos, end - 1), 0)
+    scheduled = np.where(has_slot, times[cur], -1)
+
+    delta = local_seconds(eta_ts) - _naive_seconds(midnight) - scheduled
+    stale = has_slot & (now_sec - scheduled > STALE_PAST_CUTOFF_SEC)
+    delta = np.where(has_slot & ~stale, delta, 0.0)
+    off = np.abs(delta) > MAX_DEVIATION_ANCHOR_SEC
+    delta = np.where(off, np.inf, delta)
+
+    none = np.full(n, None, dtype=object)
+    current = np.where(has_slot, fmt_times(times[cur]), none)
+    past = np.where(has_slot & (cur > start), fmt_times(times[np.maximum(cur - 1, 0)]), none)
+    following = np.where(
+        has_slot & (cur < end - 1), fmt_times(times[np.minimum(cur + 1, len(times) - 1)]), none
+    )
+
+    status = np.where(has_slot & ~off, status_codes(delta), OFF_SCHEDULE).astype(np.int8)
+    return ScheduleMatch(
+        scheduled_sec=scheduled,
+        delta=delta,
+        past=past,
+        current=current,
+        next=following,
+        status=status,
+        exact=has_slot & ~stale & ~off,
+    )
+
+
+class AdherenceTable:
+    """
+    Every predicted (trip, stop) arrival of one realtime snapshot — the
+    rows of snapshot.stop_arrivals — matched against
+    today's timetable in one vectorised pass.
+
+      stop_rows      – {stop_id: (start, end)}; a stop's rows keep the order
+                       of snapshot.stop_arrivals
+      stop_ids, trip_ids, route_ids, vehicle_labels – per row
+      arrival_ts     – int64 predicted arrival (Unix time) per row
+      match          – ScheduleMatch per row
+      now            – the clock reading the match is anchored on
+    """
+
+    def __init__(self, snapshot, flat_index, now):
+        self.now = now
+        arrivals = snapshot.stop_arrivals
+        if arrivals is None:
+            arrivals = StopArrivals.empty()
+        self.stop_rows = arrivals.stop_rows()
+        stop_ids = np.repeat(arrivals.stop_ids, np.diff(arrivals.starts)).tolist()
+        self.stop_ids = stop_ids
+        self.trip_ids = arrivals.trip_ids.tolist()
+        self.route_ids = arrivals.route_ids.tolist()
+        self.vehicle_labels = arrivals.vehicle_labels.tolist()
+        self.arrival_ts = np.asarray(arrivals.arrival_ts, dtype=np.int64)
+        self.match = match_schedule(flat_index, stop_ids, self.route_ids, self.arrival_ts, now)
+
+    def __len__(self):
+        return len(self.trip_ids)
+
+    def next_stop_rows(self):
+        """Row of each trip's next predicted stop (its first arrival at or after now)."""
+        upcoming = np.flatnonzero(self.arrival_ts >= int(self.now.timestamp()))
+        if not len(upcoming):
+            return upcoming
+        trips, _ = pd.factorize(np.asarray(self.trip_ids, dtype=object)[upcoming])
+        order = np.lexsort((self.arrival_ts[upcoming], trips))
+        first = np.concatenate([[True], trips[order][1:] != trips[order][:-1]])
+        return upcoming[order[first]]
+
+    def summary(self, routes=None):
+        """
+        Network-wide schedule adherence, each trip counted once at its next
+        predicted stop: counts per status, the on-time share of trips with
+        a usable schedule match, the median deviation, and the same per
+        route.  `routes` ({route_id: route info}) supplies route names.
+        """
+        rows = self.next_stop_rows()
+        status = self.match.status[rows]
+        exact = self.match.exact[rows]
+        delta = self.match.delta[rows]
+        route_ids = np.asarray(self.route_ids, dtype=object)[rows]
+
+        def describe(mask):
+            counts = np.bincount(status[mask], minlength=len(STATUSES))
+            matched = int(counts.sum() - counts[OFF_SCHEDULE])
+            deltas = delta[mask & exact]
+            return {
+                "trips": int(mask.sum()),
+                "statuses": {name: int(n) for (name, _), n in zip(STATUSES, counts)},
+                "on_time_pct": round(100.0 * counts[ON_TIME] / matched, 1) if matched else None,
+                "median_delta_sec": float(np.median(deltas)) if len(deltas) else None,
+            }
+
+        by_route = []
+        for route_id in sorted(set(route_ids.tolist())):
+            info = (routes or {}).get(route_id) or {}
+            by_route.append({
+                "route_id": route_id,
+                "route_name": info.get("long_name") or info.get("short_name") or "Unknown Route",
+                **describe(route_ids == route_id),
+            })
+        return {**describe(np.ones(len(rows), dtype=bool)), "routes": by_route}
@@ -0,0 +1,86 @@
+import os
+import threading
+import time as _time
+from datetime import datetime
+
+import httpx
+
+# Transit "now" used for schedule matching and ETAs.  Real time unless:
+#   PASSIOGO_CLOCK_START – ISO datetime or Unix time the clock starts at
+#   PASSIOGO_CLOCK_SPEED – virtual seconds per real second (default 1)
+#   PASSIOGO_CLOCK_URL   – replay server /clock endpoint to follow instead
+CLOCK_START = os.environ.get("PASSIOGO_CLOCK_START")
+CLOCK_SPEED = float(os.environ.get("PASSIOGO_CLOCK_SPEED", "1"))
+CLOCK_URL = os.environ.get("PASSIOGO_CLOCK_URL")
+
+_anchor = None          # (virtual Unix time, time.monotonic() at that moment, speed); None = real time
+_lock = threading.Lock()
+
+
+def set_clock(start_ts, speed=1.0):
+    """Run the clock from Unix time `start_ts`, advancing `speed` seconds per real second."""
+    global _anchor
+    with _lock:
+        _anchor = (float(start_ts), _time.monotonic(), float(speed))
+
+
+def reset_clock():
+    """Back to real time."""
+    global _anchor
+    with _lock:
+        _anchor = None
+
+
+def is_virtual():
+    return _anchor is not None
+
+
+def time():
+    """Current Unix time on the transit clock."""
+    anchor = _anchor
+    if anchor is None:
+        return _time.time()
+    start_ts, started, speed = anchor
+    return start_ts + (_time.monotonic() - started) * speed
+
+
+def now():
+    """Current local datetime on the transit clock."""
+    return datetime.fromtimestamp(time())
+
+
+def today():
+    return now().date()
+
+
+def _parse_start(value):
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def sync_from(url):
+    """Follow a replay server: read {"now": ts, "speed": s} from its /clock endpoint."""
+    response = httpx.get(url, timeout=5)
+    response.raise_for_status()
+    state = response.json()
+    set_clock(state["now"], state.get("speed", 1.0))
+    return state
+
+
+def configure():
+    """Apply PASSIOGO_CLOCK_URL / PASSIOGO_CLOCK_START / PASSIOGO_CLOCK_SPEED (called at startup)."""
+    if CLOCK_URL:
+        try:
+            state = sync_from(CLOCK_URL)
+            print(f"[INFO] clock following {CLOCK_URL}: {now():%Y-%m-%d %H:%M:%S} at {state.get('speed', 1.0):g}x", flush=True)
+            return
+        except (httpx.HTTPError, ValueError, KeyError) as e:
+            print(f"[WARN] could not read clock from {CLOCK_URL}: {e}", flush=True)
+    if CLOCK_START:
+        set_clock(_parse_start(CLOCK_START), CLOCK_SPEED)
+        print(f"[INFO] clock starts at {now():%Y-%m-%d %H:%M:%S} at {CLOCK_SPEED:g}x", flush=True)
+    elif CLOCK_SPEED != 1:
+        set_clock(_time.time(), CLOCK_SPEED)
+        print(f"[INFO] clock runs at {CLOCK_SPEED:g}x", flush=True)
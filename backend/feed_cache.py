@@ -0,0 +1,109 @@
+import hashlib
+import os
+import pickle
+import time
+
+import gtfs_data
+
+# Where compiled feeds are kept; one file per source-content hash.
+CACHE_DIR = os.environ.get(
+    "GTFS_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".gtfs_cache")
+)
+
+# Bump whenever load_static_data / load_shapes change what they return, so
+# artifacts written by older code are never loaded.
+CACHE_FORMAT_VERSION = 4
+
+_HASH_CHUNK = 1 << 20
+
+
+def feed_content_hash(gtfs_dir=None):
+    """
+    SHA-256 over the names and bytes of every .txt file in the feed
+    directory, plus CACHE_FORMAT_VERSION.
+    """
+    gtfs_dir = gtfs_dir or gtfs_data.STATIC_GTFS_DIR
+    digest = hashlib.sha256(f"format={CACHE_FORMAT_VERSION}".encode())
+    for name in sorted(os.listdir(gtfs_dir)):
+        if not name.endswith(".txt"):
+            continue
+        digest.update(name.encode() + b"\0")
+        with open(os.path.join(gtfs_dir, name), "rb") as f:
+            for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _artifact_path(content_hash):
+    return os.path.join(CACHE_DIR, f"feed-{content_hash[:16]}.pickle")
+
+
+def _write_artifact(path, compiled):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(compiled, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)   # atomic: readers never see a partial file
+
+    # Drop artifacts for feeds that are no longer on disk
+    for name in os.listdir(CACHE_DIR):
+        old = os.path.join(CACHE_DIR, name)
+        if name.startswith("feed-") and name.endswith(".pickle") and old != path:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+
+def load_compiled_feed(gtfs_dir=None, use_cache=True):
+    """
+    Returns the compiled static feed in `gtfs_dir` (defaults to
+    gtfs_data.STATIC_GTFS_DIR) as a dict:
+
+      schedule_df, trip_route_map, stops_list, calendar_df,
+      calendar_dates_df, trip_service_map, shapes, content_hash
+
+    The artifact is loaded from CACHE_DIR when one exists for the current
+    feed contents; otherwise the CSVs are parsed and the result is written
+    back for the next start (including every `uvicorn --reload`).
+    """
+    started = time.perf_counter()
+    gtfs_dir = gtfs_dir or gtfs_data.STATIC_GTFS_DIR
+    content_hash = feed_content_hash(gtfs_dir)
+    path = _artifact_path(content_hash)
+
+    if use_cache and os.path.exists(path):
+        try:
+            with open(path, "rb") as f:
+                compiled = pickle.load(f)
+            if compiled.get("content_hash") == content_hash:
+                print(
+                    f"[INFO] loaded compiled feed {content_hash[:12]} from cache "
+                    f"in {time.perf_counter() - started:.2f}s",
+                    flush=True,
+                )
+                return compiled
+        except Exception as e:
+            print(f"[WARN] ignoring unreadable feed cache {path}: {e}", flush=True)
+
+    schedule_df, trip_route_map, stops_list, calendar_df, calendar_dates_df, trip_service_map = (
+        gtfs_data.load_static_data(gtfs_dir)
+    )
+    compiled = {
+        "schedule_df": schedule_df,
+        "trip_route_map": trip_route_map,
+        "stops_list": stops_list,
+        "calendar_df": calendar_df,
+        "calendar_dates_df": calendar_dates_df,
+        "trip_service_map": trip_service_map,
+        "shapes": gtfs_data.load_shapes(gtfs_dir),
+        "content_hash": content_hash,
+    }
+
+    if use_cache:
+        try:
+            _write_artifact(path, compiled)
+            print(f"[INFO] wrote compiled feed cache {path}", flush=True)
+        except OSError as e:
+            print(f"[WARN] could not write feed cache {path}: {e}", flush=True)
+    return compiled
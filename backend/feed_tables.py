@@ -0,0 +1,312 @@
+import json
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from gtfs_rt_pb import parse_feed
+
+# GTFS-RT feeds as column tables.  Only the fields the backend reads are
+# kept, in feed order, and missing values are sentinels ("" / 0 / NaN)
+# rather than absent keys, so a JSON payload and a FeedMessage (where an
+# unset field reads as "" / 0 anyway) give identical tables.
+
+
+def _str_array(values):
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def _int_array(values):
+    return np.array(values, dtype=np.int64) if values else np.zeros(0, dtype=np.int64)
+
+
+def _entities(payload):
+    """The entity list of a JSON feed; ValueError when it has none."""
+    if "entity" not in payload:
+        raise ValueError("feed has no entity list")
+    return payload["entity"] or ()
+
+
+@dataclass(frozen=True)
+class TripUpdates:
+    """
+    A tripUpdates feed, one row per trip update plus one per stop_time_update.
+
+      timestamp      – header timestamp, or None
+      trip_ids       – str per trip update ("" when missing); string columns
+                       are object arrays
+      vehicle_labels – str per trip update ("" when missing)
+      starts         – int64 [n_trips + 1]; trip i's stop updates are
+                       [starts[i], starts[i + 1])
+      stop_ids       – str per stop update
+      arrival_ts     – int64 predicted arrival (Unix time) per stop update,
+                       0 when it has none
+    """
+    timestamp: object
+    trip_ids: np.ndarray
+    vehicle_labels: np.ndarray
+    starts: np.ndarray
+    stop_ids: np.ndarray
+    arrival_ts: np.ndarray
+
+    def __len__(self):
+        return len(self.trip_ids)
+
+    @classmethod
+    def _build(cls, timestamp, trip_ids, labels, counts, stop_ids, arrival_ts):
+        return cls(
+            timestamp=timestamp or None,
+            trip_ids=_str_array(trip_ids),
+            vehicle_labels=_str_array(labels),
+            starts=np.concatenate([[0], np.cumsum(counts, dtype=np.int64)]).astype(np.int64),
+            stop_ids=_str_array(stop_ids),
+            arrival_ts=_int_array(arrival_ts),
+        )
+
+    @classmethod
+    def from_json(cls, payload):
+        """Table of a JSON tripUpdates payload, read in one pass over its entities."""
+        # values go in as parsed; the int64 column also takes protobuf-JSON's string integers
+        trip_ids, labels, counts, stop_ids, arrival_ts = [], [], [], [], []
+        add_stop, add_arrival = stop_ids.append, arrival_ts.append
+        empty = {}
+        for entity in _entities(payload):
+            update = entity.get("trip_update")
+            if not update:
+                continue
+            trip_ids.append((update.get("trip") or empty).get("trip_id") or "")
+            labels.append((update.get("vehicle") or empty).get("label") or "")
+            stop_updates = update.get("stop_time_update") or ()
+            counts.append(len(stop_updates))
+            for stop_update in stop_updates:
+                add_stop(stop_update.get("stop_id") or "")
+                arrival = stop_update.get("arrival")
+                add_arrival(arrival.get("time") or 0 if arrival else 0)
+        return cls._build(
+            (payload.get("header") or {}).get("timestamp"), trip_ids, labels, counts, stop_ids, arrival_ts
+        )
+
+    @classmethod
+    def from_message(cls, message):
+        """Table of a decoded FeedMessage, read field by field without building dicts."""
+        updates = [e.trip_update for e in message.entity if e.HasField("trip_update")]
+        stop_updates = [u.stop_time_update for u in updates]
+        return cls._build(
+            message.header.timestamp,
+            [u.trip.trip_id for u in updates],
+            [u.vehicle.label for u in updates],
+            [len(s) for s in stop_updates],
+            [s.stop_id for ss in stop_updates for s in ss],
+            [s.arrival.time for ss in stop_updates for s in ss],
+        )
+
+    def update_trips(self):
+        """Trip update row of every stop update."""
+        return np.repeat(np.arange(len(self)), np.diff(self.starts))
+
+    def stop_arrivals(self, resolve_route=None):
+        """
+        StopArrivals of this feed: the first stop_time_update per trip and
+        stop when it has a predicted arrival, in feed order.  route_id comes
+        from `resolve_route(trip_id)` when given, else "".
+        """
+        trips = self.update_trips()
+        stop_codes, stops = pd.factorize(self.stop_ids)
+        first = ~pd.Series(trips * max(len(stops), 1) + stop_codes).duplicated().to_numpy()
+        rows = np.flatnonzero(first & (self.arrival_ts != 0))
+
+        order = np.argsort(stop_codes[rows], kind="stable")
+        rows = rows[order]
+        bounds = np.searchsorted(stop_codes[rows], np.arange(len(stops) + 1))
+        present = np.flatnonzero(np.diff(bounds) > 0)
+
+        routes = _str_array(
+            [(resolve_route(t) if resolve_route else "") or "" for t in self.trip_ids.tolist()]
+        )
+        labels = np.where(self.vehicle_labels == "", "Unknown", self.vehicle_labels)
+        return StopArrivals(
+            stop_ids=_str_array(np.asarray(stops, dtype=object)[present].tolist()),
+            starts=np.append(bounds[present], len(rows)).astype(np.int64),
+            trip_ids=self.trip_ids[trips[rows]],
+            route_ids=routes[trips[rows]],
+            arrival_ts=self.arrival_ts[rows],
+            vehicle_labels=_str_array(labels[trips[rows]].tolist()),
+        )
+
+    def next_stops(self, now_ts):
+        """
+        (stop_ids, arrival_ts) of each trip update's next stop: its first
+        stop update with an arrival at or after `now_ts`, else its first
+        one; ("", 0) when it has no stop updates.
+        """
+        upcoming = np.flatnonzero(self.arrival_ts >= now_ts)
+        trips, first = np.unique(self.update_trips()[upcoming], return_index=True)
+        rows = np.where(np.diff(self.starts) > 0, self.starts[:-1], -1)
+        rows[trips] = upcoming[first]
+
+        found = rows >= 0
+        stop_ids = np.full(len(self), "", dtype=object)
+        stop_ids[found] = self.stop_ids[rows[found]]
+        arrival_ts = np.zeros(len(self), dtype=np.int64)
+        arrival_ts[found] = self.arrival_ts[rows[found]]
+        return stop_ids, arrival_ts
+
+    def active_trips(self, after_ts):
+        """Trip update rows with a predicted arrival later than `after_ts`."""
+        return np.unique(self.update_trips()[self.arrival_ts > after_ts])
+
+
+@dataclass(frozen=True)
+class StopArrivals:
+    """
+    Predicted arrivals grouped by stop (see TripUpdates.stop_arrivals).
+
+      stop_ids       – str per stop with arrivals, in order of first
+                       appearance in the feed
+      starts         – int64 [n_stops + 1]; stop i's rows are
+                       [starts[i], starts[i + 1]), in feed order
+      trip_ids, route_ids, vehicle_labels – str per row ("Unknown" for a
+                       trip update without a vehicle label)
+      arrival_ts     – int64 predicted arrival (Unix time) per row
+    """
+    stop_ids: np.ndarray
+    starts: np.ndarray
+    trip_ids: np.ndarray
+    route_ids: np.ndarray
+    arrival_ts: np.ndarray
+    vehicle_labels: np.ndarray
+
+    def __len__(self):
+        return len(self.trip_ids)
+
+    @classmethod
+    def empty(cls):
+        none = _str_array([])
+        return cls(none, np.zeros(1, dtype=np.int64), none, none, _int_array([]), none)
+
+    def stop_rows(self):
+        """{stop_id: (start, end)} row range of every stop."""
+        return dict(zip(
+            self.stop_ids.tolist(), zip(self.starts[:-1].tolist(), self.starts[1:].tolist())
+        ))
+
+    def as_dict(self):
+        """{stop_id: [(trip_id, route_id, arrival_ts, vehicle_label), ...]}"""
+        rows = list(zip(
+            self.trip_ids.tolist(), self.route_ids.tolist(),
+            self.arrival_ts.tolist(), self.vehicle_labels.tolist(),
+        ))
+        return {stop: rows[start:end] for stop, (start, end) in self.stop_rows().items()}
+
+
+@dataclass(frozen=True)
+class VehiclePositions:
+    """
+    A vehiclePositions feed, one row per vehicle entity.
+
+      timestamp   – header timestamp, or None
+      vehicle_ids – str, stripped ("" when missing); string columns are
+                    object arrays
+      trip_ids    – str, stripped ("" when missing)
+      labels      – str ("" when missing)
+      lat, lon    – float64, NaN when the entity has no position
+      bearing, speed – float64, NaN when not reported
+      position_ts – int64 time of the fix, 0 when missing
+    """
+    timestamp: object
+    vehicle_ids: np.ndarray
+    trip_ids: np.ndarray
+    labels: np.ndarray
+    lat: np.ndarray
+    lon: np.ndarray
+    bearing: np.ndarray
+    speed: np.ndarray
+    position_ts: np.ndarray
+
+    def __len__(self):
+        return len(self.vehicle_ids)
+
+    @classmethod
+    def _build(cls, timestamp, vehicle_ids, trip_ids, labels, lat, lon, bearing, speed, position_ts):
+        floats = (np.array(c, dtype=np.float64) for c in (lat, lon, bearing, speed))
+        return cls(
+            timestamp or None,
+            _str_array(vehicle_ids), _str_array(trip_ids), _str_array(labels),
+            *floats,
+            _int_array(position_ts),
+        )
+
+    @classmethod
+    def from_json(cls, payload):
+        """Table of a JSON vehiclePositions payload, read in one pass over its entities."""
+        columns = vehicle_ids, trip_ids, labels, lat, lon, bearing, speed, position_ts = (
+            [], [], [], [], [], [], [], []
+        )
+        nan = np.nan
+        for entity in _entities(payload):
+            wrap = entity.get("vehicle")
+            if not wrap:
+                continue
+            vehicle = wrap.get("vehicle") or {}
+            position = wrap.get("position") or {}
+            vehicle_ids.append(str(vehicle.get("id") or "").strip())
+            trip_ids.append(str((wrap.get("trip") or {}).get("trip_id") or "").strip())
+            labels.append(str(vehicle.get("label") or ""))
+            latitude, longitude = position.get("latitude"), position.get("longitude")
+            has_fix = latitude is not None and longitude is not None
+            lat.append(float(latitude) if has_fix else nan)
+            lon.append(float(longitude) if has_fix else nan)
+            value = position.get("bearing")
+            bearing.append(nan if value is None else float(value))
+            value = position.get("speed")
+            speed.append(nan if value is None else float(value))
+            position_ts.append(int(float(wrap.get("timestamp") or 0)))
+        return cls._build((payload.get("header") or {}).get("timestamp"), *columns)
+
+    @classmethod
+    def from_message(cls, message):
+        """Table of a decoded FeedMessage, read field by field without building dicts."""
+        wraps = [e.vehicle for e in message.entity if e.HasField("vehicle")]
+        fixes = [w.position if w.HasField("position") else None for w in wraps]
+        nan = np.nan
+        return cls._build(
+            message.header.timestamp,
+            [w.vehicle.id.strip() for w in wraps],
+            [w.trip.trip_id.strip() for w in wraps],
+            [w.vehicle.label for w in wraps],
+            [nan if p is None else p.latitude for p in fixes],
+            [nan if p is None else p.longitude for p in fixes],
+            [p.bearing if p is not None and p.HasField("bearing") else nan for p in fixes],
+            [p.speed if p is not None and p.HasField("speed") else nan for p in fixes],
+            [w.timestamp for w in wraps],
+        )
+
+    def identities(self):
+        """Each vehicle's id, else its trip_id ("" when it has neither)."""
+        return np.where(self.vehicle_ids != "", self.vehicle_ids, self.trip_ids)
+
+
+def _decode(table, body, content_type):
+    message = parse_feed(body, content_type)
+    if message is not None:
+        return table.from_message(message)
+    payload = json.loads(body)
+    if not isinstance(payload, dict):
+        raise ValueError("feed is not a JSON object")
+    try:
+        return table.from_json(payload)
+    except (AttributeError, TypeError) as e:
+        # valid JSON of the wrong shape, e.g. an entity that is not an object
+        raise ValueError(f"malformed feed: {e}") from e
+
+
+def decode_trip_updates(body, content_type=None):
+    """tripUpdates response body (protobuf or JSON) -> TripUpdates; ValueError when unreadable."""
+    return _decode(TripUpdates, body, content_type)
+
+
+def decode_vehicle_positions(body, content_type=None):
+    """vehiclePositions response body (protobuf or JSON) -> VehiclePositions; ValueError when unreadable."""
+    return _decode(VehiclePositions, body, content_type)
@@ -1,116 +1,338 @@
+import numpy as np
 import pandas as pd
 import os
-import re
+import sys
+import time
+from collections.abc import Mapping
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 
+import clock
+
 STATIC_GTFS_DIR = "../static gtfs"
 
-def load_static_data():
+
+def _gtfs_time_to_seconds(time_series):
+    """
+    Vectorised HH:MM:SS → seconds since service-day start (HH may be >= 24).
+    Unparseable or empty times become NaN.
+
+    A feed repeats a small set of distinct times across millions of rows, so
+    only the unique strings are parsed and the result is broadcast back.
+    """
+    codes, uniques = pd.factorize(time_series)
+    parsed = [gtfs_time_to_seconds(t) for t in uniques]
+    lookup = np.array([np.nan if sec is None else sec for sec in parsed] + [np.nan], dtype=np.float64)
+    return pd.Series(lookup[codes], index=time_series.index)   # code -1 (NaN) → trailing NaN
+
+
+def _read_gtfs(gtfs_dir, name, columns, dtype=None):
+    """read_csv of one GTFS file, keeping only `columns` (missing ones are skipped)."""
+    wanted = set(columns)
+    return pd.read_csv(
+        os.path.join(gtfs_dir, name),
+        usecols=lambda c: c in wanted,
+        dtype=dtype,
+    )
+
+
+def _text_or_none(df, column):
+    """Stripped string column as a list, with missing/blank values as None."""
+    if column not in df.columns:
+        return [None] * len(df)
+    text = df[column].astype("string").str.strip()
+    return text.astype(object).where(text.notna() & (text != ""), None).tolist()
+
+
+def _prefixed_or_default(series, default):
+    """'#' + value where present, else `default` — for GTFS hex colours."""
+    return np.where(series.notna(), "#" + series.fillna("").astype(str), default)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None if unavailable."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS reports bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Trip → route / service tables
+# ─────────────────────────────────────────────────────────────────────────────
+
+def sorted_positions(sorted_values, wanted):
+    """Position of each of `wanted` in the ascending str array `sorted_values`, -1 when absent."""
+    wanted = np.asarray(wanted, dtype=str)
+    if not len(sorted_values) or not len(wanted):
+        return np.full(len(wanted), -1, dtype=np.int64)
+    pos = np.minimum(np.searchsorted(sorted_values, wanted), len(sorted_values) - 1)
+    return np.where(sorted_values[pos] == wanted, pos, -1)
+
+
+@dataclass(frozen=True)
+class TripTable:
+    """
+    Route and service of every trip, interned: a feed has ~100k trips but
+    only tens of routes and a handful of services, so each trip is one
+    position in two small tables.  Per-trip data are plain arrays, so the
+    table can live in shared memory (see shared_state.py).
+
+      trip_ids    – str array of every trip_id, ascending; a trip's
+                    position is its place in it
+      routes      – tuple of route info dicts, one per route_id, shared by
+                    every trip of the route; treat them as read-only
+      route_idx   – int32 array, position in routes of each trip
+      service_ids – array of service_id strings ("" when a trip has none)
+      service_idx – int32 array, position in service_ids of each trip
+    """
+    trip_ids: np.ndarray
+    routes: tuple
+    route_idx: np.ndarray
+    service_ids: np.ndarray
+    service_idx: np.ndarray
+
+    def positions(self, trip_ids):
+        """Positions of many trip_ids at once (-1 when unknown)."""
+        return sorted_positions(self.trip_ids, trip_ids)
+
+    def position(self, trip_id):
+        """Position of one trip_id (None when unknown), without the array round trip of positions()."""
+        trip_ids = self.trip_ids
+        pos = int(trip_ids.searchsorted(trip_id)) if isinstance(trip_id, str) else len(trip_ids)
+        return pos if pos < len(trip_ids) and trip_ids[pos] == trip_id else None
+
+    def route_info(self, trip_id):
+        pos = self.position(trip_id)
+        return None if pos is None else self.routes[self.route_idx[pos]]
+
+    def route_infos(self, trip_ids):
+        """route_info for many trip_ids, aligned with the input."""
+        routes = self.routes + (None,)          # unknown trips read the trailing None
+        route_idx = np.append(self.route_idx, len(self.routes))
+        return [routes[i] for i in route_idx[self.positions(trip_ids)].tolist()]
+
+    def service_id(self, trip_id):
+        pos = self.position(trip_id)
+        return None if pos is None else self.service_ids[self.service_idx[pos]]
+
+    def calendar_positions(self, trip_ids, calendar):
+        """Position in calendar.service_ids of each trip's service (-1 when unknown)."""
+        per_trip = np.append(calendar.service_index(self.service_ids)[self.service_idx], -1)
+        return per_trip[self.positions(trip_ids)]
+
+
+class TripRouteMap(Mapping):
+    """Read-only {trip_id: route info dict} view over a TripTable."""
+
+    def __init__(self, trips):
+        self.trips = trips
+
+    def __getitem__(self, trip_id):
+        info = self.trips.route_info(trip_id)
+        if info is None:
+            raise KeyError(trip_id)
+        return info
+
+    def __iter__(self):
+        return iter(self.trips.trip_ids.tolist())
+
+    def __len__(self):
+        return len(self.trips.trip_ids)
+
+
+class TripServiceMap(Mapping):
+    """Read-only {trip_id: service_id} view over a TripTable."""
+
+    def __init__(self, trips):
+        self.trips = trips
+
+    def __getitem__(self, trip_id):
+        service_id = self.trips.service_id(trip_id)
+        if service_id is None:
+            raise KeyError(trip_id)
+        return service_id
+
+    def __iter__(self):
+        return iter(self.trips.trip_ids.tolist())
+
+    def __len__(self):
+        return len(self.trips.trip_ids)
+
+
+def build_trip_table(trips_df, routes_df):
+    """
+    TripTable from trips.txt and routes.txt.  A trip listed twice keeps its
+    last row; a route_id missing from routes.txt gets blank names and the
+    default colours.
+    """
+    trips_df = trips_df.drop_duplicates('trip_id', keep='last')
+    trips_df = trips_df.assign(trip_id=trips_df['trip_id'].astype(str)).sort_values('trip_id')
+    route_codes, route_ids = pd.factorize(trips_df['route_id'].astype(str))
+    service_codes, service_ids = pd.factorize(trips_df['service_id'].fillna(""))
+
+    routes = routes_df.drop_duplicates('route_id', keep='last')
+    routes = routes.set_index(routes['route_id'].astype(str)).reindex(route_ids)
+    route_table = tuple(
+        {
+            "route_id": route_id,
+            "short_name": short_name,
+            "long_name": long_name,
+            "color": color,
+            "text_color": text_color,
+        }
+        for route_id, short_name, long_name, color, text_color in zip(
+            route_ids.tolist(),
+            routes['route_short_name'].fillna("").tolist(),
+            routes['route_long_name'].fillna("").tolist(),
+            _prefixed_or_default(routes['route_color'], "#000000").tolist(),
+            _prefixed_or_default(routes['route_text_color'], "#FFFFFF").tolist(),
+        )
+    )
+    return TripTable(
+        trip_ids=trips_df['trip_id'].to_numpy(dtype=str),
+        routes=route_table,
+        route_idx=route_codes.astype(np.int32),
+        service_ids=np.asarray(service_ids, dtype=object),
+        service_idx=service_codes.astype(np.int32),
+    )
+
+
+# Timing / memory figures from the most recent load_static_data call.
+last_load_stats = {}
+
+
+def load_static_data(gtfs_dir=None):
     """
-    Loads static GTFS data and returns:
-      schedule_df      – full stop_times DataFrame (all services)
-      trip_route_map   – trip_id -> route display info
+    Loads static GTFS data from `gtfs_dir` (defaults to STATIC_GTFS_DIR) and returns:
+      schedule_df      – full stop_times DataFrame (all services); arrival
+                         times are stored once as int32 `arrival_sec`
+                         (seconds since service-day start, may be >= 86400)
+                         and trip/stop/route ids are categoricals
+      trip_route_map   – trip_id -> route display info (TripRouteMap view)
       stops_list       – list of stop dicts
       calendar_df      – calendar.txt DataFrame
       calendar_dates_df– calendar_dates.txt DataFrame
-      trip_service_map – {trip_id: service_id}
+      trip_service_map – trip_id -> service_id (TripServiceMap view)
+
+    Both maps are views over one TripTable (`.trips`).
+
+    Only the columns we use are read, and every lookup structure is built
+    from whole columns rather than row by row.
     """
+    gtfs_dir = gtfs_dir or STATIC_GTFS_DIR
     print("Loading Static GTFS data...")
+    started = time.perf_counter()
+
+    stop_times_df = _read_gtfs(
+        gtfs_dir, "stop_times.txt",
+        ['trip_id', 'stop_id', 'arrival_time', 'stop_sequence'],
+        dtype={'trip_id': 'category', 'stop_id': 'category', 'arrival_time': 'category'},
+    )
 
-    stop_times_path = os.path.join(STATIC_GTFS_DIR, "stop_times.txt")
-    stop_times_df = pd.read_csv(stop_times_path, dtype={'trip_id': str, 'stop_id': str})
-    cols = ['trip_id', 'stop_id', 'arrival_time']
+    # Parse HH:MM:SS once; rows without a usable arrival_time cannot anchor a slot
+    cols = ['trip_id', 'stop_id']
     if 'stop_sequence' in stop_times_df.columns:
         cols.append('stop_sequence')
     schedule_df = stop_times_df[cols].copy()
-
-    routes_path = os.path.join(STATIC_GTFS_DIR, "routes.txt")
-    routes_df = pd.read_csv(routes_path, dtype={'route_id': str, 'route_color': str, 'route_text_color': str})
-
-    trips_path = os.path.join(STATIC_GTFS_DIR, "trips.txt")
-    trips_df = pd.read_csv(trips_path, dtype={'trip_id': str, 'route_id': str, 'service_id': str})
-
-    # Enrich schedule with route_id so lookups can be filtered per route
-    schedule_df = schedule_df.merge(
-        trips_df[['trip_id', 'route_id']], on='trip_id', how='left'
+    schedule_df['arrival_sec'] = _gtfs_time_to_seconds(stop_times_df['arrival_time'])
+    del stop_times_df
+    schedule_df = schedule_df.dropna(subset=['arrival_sec'])
+    schedule_df['arrival_sec'] = schedule_df['arrival_sec'].astype(np.int32)
+    if 'stop_sequence' in schedule_df.columns:
+        schedule_df['stop_sequence'] = pd.to_numeric(schedule_df['stop_sequence'], downcast='integer')
+
+    routes_df = _read_gtfs(
+        gtfs_dir, "routes.txt",
+        ['route_id', 'route_short_name', 'route_long_name', 'route_color', 'route_text_color'],
+        dtype=str,
     )
+    trips_df = _read_gtfs(gtfs_dir, "trips.txt", ['trip_id', 'route_id', 'service_id'], dtype=str)
 
-    trips_with_routes = pd.merge(trips_df, routes_df, on='route_id', how='left')
-
-    trip_route_map = {}
-    trip_service_map = {}
-    for _, row in trips_with_routes.iterrows():
-        tid = str(row['trip_id'])
-        trip_route_map[tid] = {
-            "route_id": str(row['route_id']),
-            "short_name": row['route_short_name'] if pd.notna(row['route_short_name']) else "",
-            "long_name": row['route_long_name'] if pd.notna(row['route_long_name']) else "",
-            "color": f"#{row['route_color']}" if pd.notna(row['route_color']) else "#000000",
-            "text_color": f"#{row['route_text_color']}" if pd.notna(row['route_text_color']) else "#FFFFFF"
-        }
-        trip_service_map[tid] = str(row['service_id']) if pd.notna(row['service_id']) else ""
+    # Enrich schedule with route_id so lookups can be filtered per route.
+    # Mapping a categorical only touches its (few) categories.
+    trip_to_route = trips_df.drop_duplicates('trip_id', keep='last').set_index('trip_id')['route_id']
+    schedule_df['route_id'] = schedule_df['trip_id'].map(trip_to_route).astype('category')
+
+    trips = build_trip_table(trips_df, routes_df)
+    trip_route_map = TripRouteMap(trips)
+    trip_service_map = TripServiceMap(trips)
 
     # calendar
     calendar_df = pd.read_csv(
-        os.path.join(STATIC_GTFS_DIR, "calendar.txt"),
+        os.path.join(gtfs_dir, "calendar.txt"),
         dtype={c: str for c in ['service_id', 'start_date', 'end_date']}
     )
     calendar_dates_df = pd.read_csv(
-        os.path.join(STATIC_GTFS_DIR, "calendar_dates.txt"),
+        os.path.join(gtfs_dir, "calendar_dates.txt"),
         dtype={'service_id': str, 'date': str}
     )
 
     # stops
-    stops_df = pd.read_csv(os.path.join(STATIC_GTFS_DIR, "stops.txt"), dtype={'stop_id': str})
-    stops_list = []
-
-    def parse_stop_name_details(stop_name):
-        raw_name = str(stop_name).strip() if pd.notna(stop_name) else "Unknown Stop"
-        match = re.match(r"^(.*?)\s*\((.*?)\)\s*$", raw_name)
-        if not match:
-            return raw_name, None
-
-        base_name = match.group(1).strip() or raw_name
-        detail = match.group(2).strip() or None
-        return base_name, detail
-
-    for _, row in stops_df.iterrows():
-        if pd.notna(row['stop_lat']) and pd.notna(row['stop_lon']):
-            raw_name = str(row['stop_name']) if pd.notna(row['stop_name']) else "Unknown Stop"
-            building_name, stop_detail = parse_stop_name_details(raw_name)
-
-            stop_desc = None
-            if 'stop_desc' in stops_df.columns and pd.notna(row['stop_desc']):
-                desc = str(row['stop_desc']).strip()
-                stop_desc = desc if desc else None
-
-            stop_code = None
-            if 'stop_code' in stops_df.columns and pd.notna(row['stop_code']):
-                code = str(row['stop_code']).strip()
-                stop_code = code if code else None
-
-            parent_station = None
-            if 'parent_station' in stops_df.columns and pd.notna(row['parent_station']):
-                parent = str(row['parent_station']).strip()
-                parent_station = parent if parent else None
-
-            stops_list.append({
-                "stop_id": str(row['stop_id']),
-                "name": raw_name,
-                "building_name": building_name,
-                "stop_detail": stop_detail,
-                "description": stop_desc,
-                "stop_code": stop_code,
-                "parent_station": parent_station,
-                "lat": float(row['stop_lat']),
-                "lon": float(row['stop_lon']),
-            })
+    stops_df = _read_gtfs(
+        gtfs_dir, "stops.txt",
+        ['stop_id', 'stop_code', 'stop_name', 'stop_desc', 'stop_lat', 'stop_lon', 'parent_station'],
+        dtype={'stop_id': str, 'stop_code': str, 'stop_name': str, 'stop_desc': str, 'parent_station': str},
+    )
+    stops_df = stops_df[stops_df['stop_lat'].notna() & stops_df['stop_lon'].notna()]
+
+    # "Building (Detail)" → building_name="Building", stop_detail="Detail"
+    raw_names = stops_df['stop_name'].fillna("Unknown Stop")
+    stripped = raw_names.str.strip()
+    name_parts = stripped.str.extract(r"^(.*?)\s*\((.*?)\)\s*$")
+    base = name_parts[0].str.strip()
+    building_names = base.where(base.notna() & (base != ""), stripped)
+    stop_details = name_parts[1].str.strip()
+    stop_details = stop_details.astype(object).where(stop_details.notna() & (stop_details != ""), None)
+
+    stops_list = [
+        {
+            "stop_id": stop_id,
+            "name": name,
+            "building_name": building_name,
+            "stop_detail": stop_detail,
+            "description": stop_desc,
+            "stop_code": stop_code,
+            "parent_station": parent_station,
+            "lat": lat,
+            "lon": lon,
+        }
+        for stop_id, name, building_name, stop_detail, stop_desc, stop_code, parent_station, lat, lon in zip(
+            stops_df['stop_id'].astype(str).tolist(),
+            raw_names.tolist(),
+            building_names.tolist(),
+            stop_details.tolist(),
+            _text_or_none(stops_df, 'stop_desc'),
+            _text_or_none(stops_df, 'stop_code'),
+            _text_or_none(stops_df, 'parent_station'),
+            stops_df['stop_lat'].astype(float).tolist(),
+            stops_df['stop_lon'].astype(float).tolist(),
+        )
+    ]
+
+    last_load_stats.clear()
+    last_load_stats.update({
+        "load_sec": time.perf_counter() - started,
+        "schedule_rows": len(schedule_df),
+        "schedule_mb": schedule_df.memory_usage(deep=True).sum() / (1024 * 1024),
+        "peak_rss_mb": peak_rss_mb(),
+    })
 
     print(f"Loaded {len(schedule_df)} stop times, {len(trip_route_map)} trips, {len(stops_list)} stops.")
+    peak = last_load_stats["peak_rss_mb"]
+    print(
+        f"[INFO] static load took {last_load_stats['load_sec']:.2f}s; "
+        f"schedule uses {last_load_stats['schedule_mb']:.1f} MB"
+        + (f"; peak RSS {peak:.0f} MB" if peak is not None else ""),
+        flush=True,
+    )
     return schedule_df, trip_route_map, stops_list, calendar_df, calendar_dates_df, trip_service_map
 
 
-def load_shapes():
+def load_shapes(gtfs_dir=None):
     """
     Builds route polylines from shapes.txt, coloured by their route.
 
@@ -122,16 +344,19 @@ def load_shapes():
       trips.txt   → unique shape_id → route_id mapping
       routes.txt  → route_id → color / name
     Multiple trips often share the same shape_id, so we deduplicate and
-    emit one polyline per unique shape_id.
+    emit one polyline per unique shape_id; then dedupe_route_shapes drops
+    shapes that repeat (or are covered by) another shape of the same route.
     """
-    shapes_path = os.path.join(STATIC_GTFS_DIR, "shapes.txt")
-    shapes_df = pd.read_csv(shapes_path, dtype={'shape_id': str})
-
-    routes_path = os.path.join(STATIC_GTFS_DIR, "routes.txt")
-    routes_df = pd.read_csv(routes_path, dtype={'route_id': str, 'route_color': str})
-
-    trips_path = os.path.join(STATIC_GTFS_DIR, "trips.txt")
-    trips_df = pd.read_csv(trips_path, dtype={'trip_id': str, 'route_id': str, 'shape_id': str})
+    gtfs_dir = gtfs_dir or STATIC_GTFS_DIR
+    shapes_df = _read_gtfs(
+        gtfs_dir, "shapes.txt", ['shape_id', 'shape_pt_lat', 'shape_pt_lon', 'shape_pt_sequence'],
+        dtype={'shape_id': str},
+    )
+    routes_df = _read_gtfs(
+        gtfs_dir, "routes.txt", ['route_id', 'route_short_name', 'route_long_name', 'route_color'],
+        dtype=str,
+    )
+    trips_df = _read_gtfs(gtfs_dir, "trips.txt", ['trip_id', 'route_id', 'shape_id'], dtype=str)
 
     # One representative route per shape_id (first encountered)
     shape_route = (
@@ -141,93 +366,259 @@ def load_shapes():
         .merge(routes_df[['route_id', 'route_short_name', 'route_long_name', 'route_color']], on='route_id', how='left')
     )
 
-    shape_color_map = {}
-    shape_name_map = {}
-    for _, row in shape_route.iterrows():
-        sid = str(row['shape_id'])
-        color = f"#{row['route_color']}" if pd.notna(row['route_color']) and str(row['route_color']).strip() else "#888888"
-        name = row['route_long_name'] if pd.notna(row['route_long_name']) and str(row['route_long_name']).strip() \
-               else (row['route_short_name'] if pd.notna(row['route_short_name']) else "")
-        shape_color_map[sid] = color
-        shape_name_map[sid] = str(name)
-
-    # Sort each shape's points by sequence, then build coordinate lists
-    shapes_df = shapes_df.sort_values(['shape_id', 'shape_pt_sequence'])
-    shapes_list = []
-    for shape_id, group in shapes_df.groupby('shape_id', sort=False):
-        sid = str(shape_id)
-        points = [[float(r['shape_pt_lat']), float(r['shape_pt_lon'])] for _, r in group.iterrows()]
-        shapes_list.append({
+    color = shape_route['route_color'].str.strip()
+    long_name = shape_route['route_long_name'].str.strip()
+    names = shape_route['route_long_name'].where(
+        long_name.notna() & (long_name != ""), shape_route['route_short_name']
+    ).fillna("")
+    shape_ids = shape_route['shape_id'].tolist()
+    shape_color_map = dict(zip(
+        shape_ids,
+        np.where(color.notna() & (color != ""), "#" + shape_route['route_color'].fillna(""), "#888888").tolist(),
+    ))
+    shape_name_map = dict(zip(shape_ids, names.astype(str).tolist()))
+
+    # Sort all points once by (shape_id, sequence) and cut the coordinate
+    # array at shape boundaries.
+    shapes_df = shapes_df.sort_values(['shape_id', 'shape_pt_sequence'], kind='stable')
+    sorted_ids = shapes_df['shape_id'].to_numpy()
+    coords = shapes_df[['shape_pt_lat', 'shape_pt_lon']].to_numpy(dtype=float)
+    boundaries = np.flatnonzero(sorted_ids[1:] != sorted_ids[:-1]) + 1
+    starts = np.concatenate([[0], boundaries]) if len(sorted_ids) else np.array([], dtype=int)
+    points_by_shape = {
+        str(sorted_ids[start]): block.tolist()
+        for start, block in zip(starts, np.split(coords, boundaries))
+    }
+
+    shapes_list = [
+        {
             "shape_id": sid,
             "route_name": shape_name_map.get(sid, ""),
             "color": shape_color_map.get(sid, "#888888"),
             "points": points,
-        })
-
-    # Rebuild known problematic routes from canonical shapes.txt geometry.
-    # We pick the most common base shape_id for each route (e.g., 48169 over
-    # 48169.77/48169.108 variants), then draw a single clean polyline.
-    target_route_ids = {"790", "793", "2235"}  # Quad Express, Quad Yard Express, Quad SEC Direct
-    for route_id in target_route_ids:
-        route_trips = trips_df[
-            (trips_df['route_id'].astype(str) == route_id)
-            & (trips_df['shape_id'].notna())
-        ].copy()
-
-        if route_trips.empty:
-            continue
+        }
+        for sid, points in points_by_shape.items()
+    ]
 
-        route_trips['shape_id'] = route_trips['shape_id'].astype(str)
-        route_trips['shape_base'] = route_trips['shape_id'].str.split('.').str[0]
+    # Collapse variant shapes (e.g. 48169 vs 48169.77/48169.108) that draw
+    # the same streets, so each route sends only geometry that adds something.
+    shape_route_ids = dict(zip(shape_ids, shape_route['route_id'].fillna("").astype(str).tolist()))
+    trip_counts = trips_df['shape_id'].dropna().value_counts().to_dict()
+    shapes_list = dedupe_route_shapes(shapes_list, shape_route_ids, trip_counts)
 
-        base_counts = route_trips['shape_base'].value_counts()
-        canonical_base = str(base_counts.index[0])
+    print(f"Loaded {len(shapes_list)} route shapes.")
+    return shapes_list
 
-        canonical_sid = canonical_base
-        if canonical_sid not in set(shapes_df['shape_id'].astype(str)):
-            canonical_sid = str(route_trips['shape_id'].value_counts().index[0])
 
-        canonical_group = shapes_df[shapes_df['shape_id'].astype(str) == canonical_sid]
-        if canonical_group.empty:
-            continue
+# ─────────────────────────────────────────────────────────────────────────────
+# Polyline helpers
+# ─────────────────────────────────────────────────────────────────────────────
 
-        canonical_group = canonical_group.sort_values('shape_pt_sequence')
-        canonical_points = [
-            [float(r['shape_pt_lat']), float(r['shape_pt_lon'])]
-            for _, r in canonical_group.iterrows()
-        ]
+# Douglas–Peucker tolerance (metres) per minimum map zoom.  A client at zoom
+# z gets the entry for the largest key <= z; above the last key (or with no
+# zoom at all) it gets full-resolution geometry.
+ZOOM_TOLERANCES_M = {
+    11: 40.0,
+    13: 12.0,
+    15: 4.0,
+}
+FULL_RESOLUTION_ZOOM = 16
 
-        route_row = routes_df[routes_df['route_id'].astype(str) == route_id]
-        if route_row.empty:
+_EARTH_RADIUS_M = 6371000.0
+
+
+def tolerance_for_zoom(zoom):
+    """Simplification tolerance in metres for a map zoom (0 = no simplification)."""
+    if zoom is None or zoom >= FULL_RESOLUTION_ZOOM:
+        return 0.0
+    levels = [z for z in sorted(ZOOM_TOLERANCES_M) if z <= zoom]
+    return ZOOM_TOLERANCES_M[levels[-1] if levels else min(ZOOM_TOLERANCES_M)]
+
+
+def _project(pts, lat0):
+    """[[lat, lon], ...] → local x/y metres (equirectangular around `lat0` radians)."""
+    return np.column_stack([
+        np.radians(pts[:, 1]) * np.cos(lat0) * _EARTH_RADIUS_M,
+        np.radians(pts[:, 0]) * _EARTH_RADIUS_M,
+    ])
+
+
+def simplify_polyline(points, tolerance_m):
+    """
+    Douglas–Peucker simplification of [[lat, lon], ...] with a tolerance in
+    metres.  Distances are measured to the segment (not the infinite line),
+    so closed loops whose ends coincide simplify correctly.
+    """
+    pts = np.asarray(points, dtype=float)
+    n = len(pts)
+    if n < 3 or tolerance_m <= 0:
+        return pts.tolist()
+
+    # local equirectangular projection is accurate to well under a metre
+    # at campus/metro scale
+    xy = _project(pts, np.radians(pts[:, 0].mean()))
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
             continue
+        seg = xy[last] - xy[first]
+        rel = xy[first + 1:last] - xy[first]
+        seg_len2 = float(seg @ seg)
+        if seg_len2 > 0:
+            t = np.clip((rel @ seg) / seg_len2, 0.0, 1.0)
+            rel = rel - t[:, None] * seg
+        dist = np.hypot(rel[:, 0], rel[:, 1])
+        k = int(np.argmax(dist))
+        if dist[k] > tolerance_m:
+            split = first + 1 + k
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
 
-        route_row = route_row.iloc[0]
-        route_name = (
-            str(route_row['route_long_name']).strip()
-            if pd.notna(route_row['route_long_name']) and str(route_row['route_long_name']).strip()
-            else str(route_row['route_short_name']).strip()
-        )
-        route_color = (
-            f"#{route_row['route_color']}"
-            if pd.notna(route_row['route_color']) and str(route_row['route_color']).strip()
-            else "#888888"
-        )
+    return pts[keep].tolist()
 
-        shapes_list = [s for s in shapes_list if (s.get('route_name') or "") != route_name]
-        shapes_list.append({
-            "shape_id": f"{canonical_sid}-canonical-{route_id}",
-            "route_name": route_name,
-            "color": route_color,
-            "points": canonical_points,
-        })
-
-        print(
-            f"[INFO] Redrew route {route_name} using canonical shape_id {canonical_sid}.",
-            flush=True,
-        )
 
-    print(f"Loaded {len(shapes_list)} route shapes.")
-    return shapes_list
+# Shapes of one route closer than this everywhere are treated as the same line.
+SHAPE_MERGE_TOLERANCE_M = 45.0
+
+# Points compared per block in _max_distance_to_polyline (bounds memory).
+_DISTANCE_BLOCK = 256
+
+
+def _cell_set(xy, cell_m):
+    """
+    Geometry hash of a projected polyline: the set of `cell_m` grid cells
+    touched by the line, sampled at least every `cell_m / 1.5` metres.
+    """
+    step = cell_m / 1.5
+    samples = [xy[:1]]
+    for a, b in zip(xy[:-1], xy[1:]):
+        n = max(1, int(np.ceil(np.hypot(*(b - a)) / step)))
+        t = np.arange(1, n + 1)[:, None] / n
+        samples.append(a + t * (b - a))
+    cells = np.floor(np.concatenate(samples) / cell_m).astype(np.int64)
+    return set(map(tuple, cells.tolist()))
+
+
+def _near_cells(xy, cells, cell_m):
+    """True when every point of `xy` falls in or next to a cell of `cells`."""
+    offsets = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+    for cx, cy in np.floor(xy / cell_m).astype(np.int64).tolist():
+        if not any((cx + dx, cy + dy) in cells for dx, dy in offsets):
+            return False
+    return True
+
+
+def _max_distance_to_polyline(xy, line):
+    """Largest distance (metres) from any point of `xy` to polyline `line`."""
+    if len(line) == 1:
+        return float(np.hypot(*(xy - line[0]).T).max())
+    a, seg = line[:-1], line[1:] - line[:-1]
+    seg_len2 = np.maximum((seg * seg).sum(axis=1), 1e-12)
+    worst = 0.0
+    for start in range(0, len(xy), _DISTANCE_BLOCK):
+        rel = xy[start:start + _DISTANCE_BLOCK, None, :] - a[None, :, :]     # [p, s, 2]
+        t = np.clip((rel * seg[None]).sum(axis=2) / seg_len2[None], 0.0, 1.0)
+        d = np.hypot(*(rel - t[..., None] * seg[None]).transpose(2, 0, 1))
+        worst = max(worst, float(d.min(axis=1).max()))
+    return worst
+
+
+def dedupe_route_shapes(shapes_list, shape_route_ids, trip_counts, tolerance_m=SHAPE_MERGE_TOLERANCE_M):
+    """
+    Drops, per route, every shape that lies within `tolerance_m` of another
+    remaining shape of the same route along its whole length — exact and
+    near duplicates as well as shorter variants contained in a longer one.
+
+    Shapes are considered least-preferred first, where preference is
+    (trips using the shape, geometric length, shorter shape_id); so of two
+    equivalent shapes the one most trips use survives.  Candidate pairs are
+    screened with a grid-cell geometry hash before the exact distance check.
+    Shapes without a route are left untouched.
+    """
+    by_route = {}
+    for shape in shapes_list:
+        route_id = shape_route_ids.get(shape["shape_id"], "")
+        if route_id and len(shape["points"]) > 0:
+            by_route.setdefault(route_id, []).append(shape)
+
+    dropped = set()
+    cell_m = 1.5 * tolerance_m
+    for route_id, shapes in by_route.items():
+        if len(shapes) < 2:
+            continue
+
+        lat0 = np.radians(np.mean([p[0] for shape in shapes for p in shape["points"]]))
+        geo = {}
+        for shape in shapes:
+            xy = _project(np.asarray(shape["points"], dtype=float), lat0)
+            length = float(np.hypot(*np.diff(xy, axis=0).T).sum()) if len(xy) > 1 else 0.0
+            geo[shape["shape_id"]] = (xy, length, _cell_set(xy, cell_m))
+
+        ranked = sorted(
+            shapes,
+            key=lambda sh: (
+                trip_counts.get(sh["shape_id"], 0),
+                geo[sh["shape_id"]][1],
+                -len(sh["shape_id"]),
+                sh["shape_id"],
+            ),
+        )
+        remaining = {sh["shape_id"] for sh in ranked}
+        for shape in ranked:                      # least preferred first
+            sid = shape["shape_id"]
+            xy, _, cells = geo[sid]
+            for other in remaining - {sid}:
+                other_xy, _, other_cells = geo[other]
+                if not cells <= other_cells and not _near_cells(xy, other_cells, cell_m):
+                    continue
+                if _max_distance_to_polyline(xy, other_xy) <= tolerance_m:
+                    remaining.discard(sid)
+                    dropped.add(sid)
+                    print(f"[INFO] route {route_id}: shape {sid} merged into {other}", flush=True)
+                    break
+
+    return [shape for shape in shapes_list if shape["shape_id"] not in dropped]
+
+
+def encode_polyline(points, precision=5):
+    """Google encoded-polyline string for [[lat, lon], ...]."""
+    if len(points) == 0:
+        return ""
+    coords = np.round(np.asarray(points, dtype=float) * 10 ** precision).astype(np.int64)
+    deltas = np.diff(coords, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+
+    out = []
+    for value in deltas.tolist():
+        value = ~(value << 1) if value < 0 else value << 1
+        while value >= 0x20:
+            out.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        out.append(chr(value + 63))
+    return "".join(out)
+
+
+def shapes_for_display(shapes, zoom=None, encoding="points"):
+    """
+    Returns `shapes` simplified for `zoom` (see ZOOM_TOLERANCES_M).  With
+    encoding="polyline" each shape carries a Google encoded `polyline`
+    string instead of a `points` list.
+    """
+    tolerance = tolerance_for_zoom(zoom)
+    out = []
+    for shape in shapes:
+        points = simplify_polyline(shape["points"], tolerance) if tolerance else shape["points"]
+        display = {k: v for k, v in shape.items() if k != "points"}
+        if encoding == "polyline":
+            display["polyline"] = encode_polyline(points)
+        else:
+            display["points"] = points
+        out.append(display)
+    return out
 
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -245,31 +636,28 @@ def get_active_service_ids(calendar_df, calendar_dates_df, date=None):
       3. calendar_dates.txt exception_type=2 removes a service for that date.
     """
     if date is None:
-        date = datetime.now().date()
+        date = clock.today()
 
     today_str = date.strftime("%Y%m%d")
     today_int = int(today_str)
     dow = date.strftime("%A").lower()      # 'monday' … 'sunday'
 
-    active = set()
-
     # Step 1: calendar.txt
-    for _, row in calendar_df.iterrows():
-        try:
-            if int(row[dow]) == 1 and int(row['start_date']) <= today_int <= int(row['end_date']):
-                active.add(str(row['service_id']))
-        except (ValueError, KeyError):
-            pass
-
-    # Step 2: calendar_dates.txt overrides
+    in_range = (
+        (pd.to_numeric(calendar_df['start_date'], errors='coerce') <= today_int)
+        & (pd.to_numeric(calendar_df['end_date'], errors='coerce') >= today_int)
+    )
+    if dow in calendar_df.columns:
+        runs_today = pd.to_numeric(calendar_df[dow], errors='coerce') == 1
+    else:
+        runs_today = pd.Series(False, index=calendar_df.index)
+    active = set(calendar_df.loc[in_range & runs_today, 'service_id'].astype(str))
+
+    # Step 2: calendar_dates.txt overrides (removals win over additions)
     today_rows = calendar_dates_df[calendar_dates_df['date'] == today_str]
-    for _, row in today_rows.iterrows():
-        sid = str(row['service_id'])
-        exc = int(row['exception_type'])
-        if exc == 1:
-            active.add(sid)
-        elif exc == 2:
-            active.discard(sid)
+    exc = pd.to_numeric(today_rows['exception_type'], errors='coerce')
+    active |= set(today_rows.loc[exc == 1, 'service_id'].astype(str))
+    active -= set(today_rows.loc[exc == 2, 'service_id'].astype(str))
 
     return active
 
@@ -280,81 +668,298 @@ def filter_schedule_for_date(schedule_df, trip_service_map, active_service_ids):
     a service that is active today.  This eliminates expired or future service
     periods and prevents the algorithm from latching onto stale scheduled times.
     """
-    active_trips = {tid for tid, sid in trip_service_map.items() if sid in active_service_ids}
+    trips = trip_service_map.trips
+    active = np.isin(trips.service_ids, list(active_service_ids))[trips.service_idx]
+    active_trips = trips.trip_ids[active]
     return schedule_df[schedule_df['trip_id'].isin(active_trips)].copy()
 
 
+_WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+SECONDS_PER_DAY = 24 * 3600
+
+
+# Days the precomputed service bitmap covers, counted from the day it is
+# built: a week back (yesterday's carryover, replays) and over a year
+# ahead, however far the feed's own dates reach.  Dates outside the window
+# are answered by get_active_service_ids instead.
+SERVICE_CALENDAR_PAST_DAYS = int(os.environ.get("SERVICE_CALENDAR_PAST_DAYS", "7"))
+SERVICE_CALENDAR_FUTURE_DAYS = int(os.environ.get("SERVICE_CALENDAR_FUTURE_DAYS", "400"))
+
+
+@dataclass(frozen=True)
+class ServiceCalendar:
+    """
+    Service × date bitmap over a bounded window of dates (see
+    SERVICE_CALENDAR_PAST_DAYS / SERVICE_CALENDAR_FUTURE_DAYS).
+
+      service_ids       – every service_id in calendar.txt or calendar_dates.txt
+      first_date        – date of column 0
+      active            – bool array [len(service_ids), n_days]; active[s, d] is
+                          True when service s runs on first_date + d days
+      calendar_df       – calendar.txt and calendar_dates.txt, for dates
+      calendar_dates_df   outside the window
+    """
+    service_ids: np.ndarray
+    first_date: object
+    active: np.ndarray
+    calendar_df: pd.DataFrame
+    calendar_dates_df: pd.DataFrame
+
+    def active_mask(self, date):
+        """Bool array over service_ids for `date`."""
+        day = (date - self.first_date).days
+        if 0 <= day < self.active.shape[1]:
+            return self.active[:, day]
+        active = get_active_service_ids(self.calendar_df, self.calendar_dates_df, date)
+        return np.isin(self.service_ids, list(active))
+
+    def active_ids(self, date):
+        return set(self.service_ids[self.active_mask(date)].tolist())
+
+    def service_index(self, service_ids):
+        """Positions of `service_ids` (array-like) in self.service_ids, -1 if unknown."""
+        return pd.Categorical(service_ids, categories=self.service_ids).codes.astype(np.int32)
+
+
+def build_service_calendar(calendar_df, calendar_dates_df, today=None):
+    """
+    Precomputes which services run on every date of the window around
+    `today` (defaults to today), applying the rules of
+    get_active_service_ids to all of them at once.  Dates are compared the
+    same way, as YYYYMMDD numbers and strings, so a row whose dates do not
+    parse behaves exactly as it does there.
+    """
+    if today is None:
+        today = clock.today()
+    service_ids = np.array(sorted(
+        set(calendar_df['service_id'].astype(str)) | set(calendar_dates_df['service_id'].astype(str))
+    ), dtype=object)
+
+    first_date = today - timedelta(days=SERVICE_CALENDAR_PAST_DAYS)
+    days = pd.date_range(first_date, periods=SERVICE_CALENDAR_PAST_DAYS + SERVICE_CALENDAR_FUTURE_DAYS + 1, freq='D')
+    day_strs = days.strftime('%Y%m%d')
+    day_ints = day_strs.astype(np.int64).to_numpy()
+    day_weekday = days.weekday.to_numpy()                  # 0 = Monday
+
+    active = np.zeros((len(service_ids), len(days)), dtype=bool)
+
+    # calendar.txt: weekday bit AND within [start_date, end_date]
+    rows = pd.Categorical(calendar_df['service_id'].astype(str), categories=service_ids).codes
+    weekday_bits = np.stack([
+        pd.to_numeric(calendar_df[d], errors='coerce').fillna(0).to_numpy() == 1
+        if d in calendar_df.columns else np.zeros(len(calendar_df), dtype=bool)
+        for d in _WEEKDAYS
+    ], axis=1)                                             # [rows, 7]
+    cal_start = pd.to_numeric(calendar_df['start_date'], errors='coerce').to_numpy(np.float64)
+    cal_end = pd.to_numeric(calendar_df['end_date'], errors='coerce').to_numpy(np.float64)
+    in_range = (cal_start[:, None] <= day_ints[None, :]) & (cal_end[:, None] >= day_ints[None, :])
+    runs = in_range & weekday_bits[:, day_weekday]
+    for row, service in enumerate(rows):
+        active[service] |= runs[row]
+
+    # calendar_dates.txt: additions, then removals; a date outside the
+    # window (or not a date at all) matches none of its days
+    exc_type = pd.to_numeric(calendar_dates_df['exception_type'], errors='coerce').to_numpy()
+    exc_service = pd.Categorical(calendar_dates_df['service_id'].astype(str), categories=service_ids).codes
+    exc_day = calendar_dates_df['date'].map(dict(zip(day_strs, range(len(days))))).to_numpy(np.float64)
+    valid = ~np.isnan(exc_day)
+    for kind, value in ((1, True), (2, False)):
+        pick = valid & (exc_type == kind)
+        active[exc_service[pick], exc_day[pick].astype(int)] = value
+
+    return ServiceCalendar(service_ids, first_date, active, calendar_df, calendar_dates_df)
+
+
+def build_day_index(schedule_df, row_service_idx, calendar, date):
+    """
+    Builds the timetable index for calendar `date`, with slot times in
+    seconds since that date's midnight.
+
+    Trips of the previous service day that run past midnight (arrival_sec
+    >= 24:00:00) are folded in, shifted back by one day, so a 00:30 lookup
+    still sees yesterday's 24:45 departure.
+
+    Returns (row_mask, index): the schedule rows active on `date` and the
+    timetable as a FlatScheduleIndex.
+    """
+    def _rows_for(day):
+        # row_service_idx is -1 for trips without a known service → trailing False
+        mask = np.append(calendar.active_mask(day), False)
+        return mask[row_service_idx]
+
+    today_mask = _rows_for(date)
+    carryover_mask = _rows_for(date - timedelta(days=1)) & (
+        schedule_df['arrival_sec'].to_numpy() >= SECONDS_PER_DAY
+    )
+
+    cols = ['stop_id', 'route_id', 'arrival_sec']
+    carryover = schedule_df.loc[carryover_mask, cols]
+    carryover = carryover.assign(arrival_sec=carryover['arrival_sec'] - SECONDS_PER_DAY)
+    return today_mask, build_flat_schedule_index(pd.concat([schedule_df.loc[today_mask, cols], carryover]))
+
+
 # ─────────────────────────────────────────────────────────────────────────────
 # Schedule lookup helpers (operate on schedule_today — already date-filtered)
 # ─────────────────────────────────────────────────────────────────────────────
 
-def _parse_gtfs_time(time_str, base_date):
+def gtfs_time_to_seconds(time_str):
     """
-    Converts a GTFS arrival_time string (HH:MM:SS, HH may be >= 24 for
-    post-midnight service) to a datetime on `base_date`.
-    Returns None if parsing fails.
+    Converts a GTFS HH:MM:SS string (HH may be >= 24 for post-midnight
+    service) to seconds since service-day start.  Returns None on failure.
     """
     try:
-        h, m, s = map(int, time_str.split(':'))
-        extra_days = h // 24
-        h = h % 24
-        return datetime(base_date.year, base_date.month, base_date.day, h, m, s) + timedelta(days=extra_days)
-    except Exception:
+        h, m, s = map(int, str(time_str).strip().split(':'))
+        return h * 3600 + m * 60 + s
+    except (ValueError, AttributeError):
         return None
 
 
-def fmt_time(time_str):
-    """Format a GTFS HH:MM:SS string to 12-hour display, e.g. '9:05 AM'."""
-    try:
-        h, m, s = map(int, time_str.split(':'))
-        h = h % 24
-        dummy = datetime.now().replace(hour=h, minute=m, second=s, microsecond=0)
-        return dummy.strftime("%I:%M %p").lstrip("0")
-    except Exception:
-        return time_str
+def service_time_to_datetime(service_date, seconds):
+    """
+    Seconds since service-day start → datetime.  Times >= 24:00:00 land on
+    the following calendar day(s).
+    """
+    midnight = datetime(service_date.year, service_date.month, service_date.day)
+    return midnight + timedelta(seconds=int(seconds))
+
+
+def fmt_time(seconds):
+    """Format seconds since service-day start to 12-hour display, e.g. '9:05 AM'."""
+    seconds = int(seconds)
+    h = seconds // 3600 % 24
+    m = seconds // 60 % 60
+    return f"{h % 12 or 12}:{m:02d} {'AM' if h < 12 else 'PM'}"
+
+
+# every minute of the day, pre-formatted: fmt_times is then an array lookup
+_MINUTE_LABELS = np.array([fmt_time(m * 60) for m in range(24 * 60)], dtype=object)
+
 
+def fmt_times(seconds):
+    """fmt_time over an integer array."""
+    return _MINUTE_LABELS[(np.asarray(seconds, dtype=np.int64) // 60) % (24 * 60)]
 
-def get_stop_schedule_context(stop_id, route_id, eta_dt, schedule_today, full_schedule=None):
+
+def build_schedule_index(schedule_df):
+    """
+    Builds the per-day timetable index used by get_stop_schedule_context:
+
+      {(stop_id, route_id): np.ndarray of unique arrival seconds, ascending}
+
+    Built once whenever schedule_today is refreshed, so a lookup is a dict
+    hit plus a binary search instead of a scan of the whole schedule.
+    """
+    df = schedule_df[['stop_id', 'route_id', 'arrival_sec']].dropna(subset=['route_id'])
+    df = df.drop_duplicates().sort_values(['stop_id', 'route_id', 'arrival_sec'])
+
+    return {
+        (str(stop_id), str(route_id)): group.to_numpy()
+        for (stop_id, route_id), group in df.groupby(
+            ['stop_id', 'route_id'], sort=False, observed=True
+        )['arrival_sec']
+    }
+
+
+@dataclass(frozen=True)
+class FlatScheduleIndex:
+    """
+    A day's timetable as arrays, for matching many (stop_id, route_id)
+    lookups in one vectorised pass.  Plain arrays only, so the index can
+    live in shared memory (see shared_state.py).
+
+      keys      – str array of f"{stop_id}{KEY_SEP}{route_id}", ascending;
+                  key k is keys[k]
+      starts    – int64 [n_keys + 1]; key k's times are times[starts[k]:starts[k + 1]]
+      times     – int64, every key's unique arrival seconds, ascending per key
+      sort_keys – key id * KEY_STRIDE + time, ascending over the whole array,
+                  so one searchsorted finds a slot inside any key's run
+    """
+    KEY_STRIDE = 1 << 20        # > any arrival_sec (~290h)
+    KEY_SEP = "\x1f"
+
+    keys: np.ndarray
+    starts: np.ndarray
+    times: np.ndarray
+    sort_keys: np.ndarray
+
+    def key_ids_for(self, stop_ids, route_ids):
+        """Key id of each (stop_id, route_id) pair, -1 when the timetable has none."""
+        sep = self.KEY_SEP
+        return sorted_positions(self.keys, [f"{s}{sep}{r}" for s, r in zip(stop_ids, route_ids)])
+
+    def as_dict(self):
+        """The build_schedule_index dict of the same timetable."""
+        bounds = zip(self.starts[:-1].tolist(), self.starts[1:].tolist())
+        return {
+            tuple(key.split(self.KEY_SEP, 1)): self.times[start:end]
+            for key, (start, end) in zip(self.keys.tolist(), bounds)
+        }
+
+
+def build_flat_schedule_index(schedule_df):
+    """FlatScheduleIndex straight from schedule rows, without the intermediate dict."""
+    df = schedule_df[['stop_id', 'route_id', 'arrival_sec']].dropna(subset=['stop_id', 'route_id'])
+    stop_codes, stop_ids = pd.factorize(df['stop_id'])
+    route_codes, route_ids = pd.factorize(df['route_id'])
+    n_routes = max(len(route_ids), 1)
+    pairs, pair_of_row = np.unique(stop_codes.astype(np.int64) * n_routes + route_codes, return_inverse=True)
+    sep = FlatScheduleIndex.KEY_SEP
+    key_names = [
+        f"{s}{sep}{r}"
+        for s, r in zip(
+            np.asarray(stop_ids, dtype=str)[pairs // n_routes].tolist(),
+            np.asarray(route_ids, dtype=str)[pairs % n_routes].tolist(),
+        )
+    ]
+
+    # key ids in ascending key order, then unique (key, time) pairs, ascending
+    order = np.argsort(key_names, kind="stable")
+    key_ids = np.empty(len(order), dtype=np.int64)
+    key_ids[order] = np.arange(len(order))
+    stride = FlatScheduleIndex.KEY_STRIDE
+    sort_keys = np.unique(key_ids[pair_of_row.reshape(-1)] * stride + df['arrival_sec'].to_numpy(np.int64))
+    row_keys = sort_keys // stride
+    return FlatScheduleIndex(
+        keys=np.asarray(key_names, dtype=str)[order] if len(order) else np.empty(0, dtype="<U1"),
+        starts=np.searchsorted(row_keys, np.arange(len(order) + 1)).astype(np.int64),
+        times=sort_keys - row_keys * stride,
+        sort_keys=sort_keys.astype(np.float64),
+    )
+
+
+def get_stop_schedule_context(stop_id, route_id, eta_dt, schedule_index, full_schedule=None):
     """
      Schedule lookup anchored on *now* for a specific stop + route.
 
      Behavior:
-        1. Build today's unique timetable slots for (stop_id, route_id).
+        1. Look up today's unique timetable slots for (stop_id, route_id)
+           in the index built by build_schedule_index.
         2. Define "current" as the first slot >= now (or the last slot if all are past).
         3. Return context around that current slot: past/current/next.
         4. Compute delta against the current slot, but guard against stale history:
             - if current slot is too far in the past, force delta=0
             - if eta is unrealistically far from current slot, force delta=0
 
-     Returns: (scheduled_raw_str, context_dict, delta_sec)
+     Returns: (scheduled_sec, context_dict, delta_sec) — scheduled_sec is
+     seconds since service-day start, or None when the stop has no slots.
     """
-    now  = datetime.now()
-    base = now.date()
+    now  = clock.now()
+    midnight = service_time_to_datetime(now.date(), 0)
     stale_past_cutoff_sec = 30 * 60
     max_deviation_anchor_sec = 60 * 60
 
-    def _build_times(df):
-        rows = df[(df['stop_id'] == str(stop_id)) & (df['route_id'] == str(route_id))]
-        seen = {}
-        for ts in rows['arrival_time']:
-            if ts not in seen:
-                dt = _parse_gtfs_time(ts, base)
-                if dt is not None:
-                    seen[ts] = dt
-        return sorted(seen.items(), key=lambda x: x[1])  # [(raw_str, dt), ...]
+    times = schedule_index.get((str(stop_id), str(route_id)))
 
-    times = _build_times(schedule_today)
-
-    if not times:
+    if times is None or len(times) == 0:
         return None, {"past": None, "current": None, "next": None}, 0
 
     # Anchor: first scheduled time >= NOW (source of truth for "current").
-    current_idx = next(
-        (i for i, (_, dt) in enumerate(times) if dt >= now),
-        len(times) - 1
-    )
+    now_sec = (now - midnight).total_seconds()
+    current_idx = min(int(np.searchsorted(times, now_sec, side='left')), len(times) - 1)
 
-    scheduled_raw, scheduled_dt = times[current_idx]
+    scheduled_sec = int(times[current_idx])
+    scheduled_dt  = midnight + timedelta(seconds=scheduled_sec)
     delta_sec = (eta_dt - scheduled_dt).total_seconds()
 
     # Do not base deviation on schedules that are way back in the past.
@@ -366,11 +971,11 @@ def get_stop_schedule_context(stop_id, route_id, eta_dt, schedule_today, full_sc
     if abs(delta_sec) > max_deviation_anchor_sec:
         delta_sec = float('inf')
 
-    past_str    = fmt_time(times[current_idx - 1][0]) if current_idx > 0 else None
-    current_str = fmt_time(scheduled_raw)
-    next_str    = fmt_time(times[current_idx + 1][0]) if current_idx < len(times) - 1 else None
+    past_str    = fmt_time(times[current_idx - 1]) if current_idx > 0 else None
+    current_str = fmt_time(scheduled_sec)
+    next_str    = fmt_time(times[current_idx + 1]) if current_idx < len(times) - 1 else None
 
-    return scheduled_raw, {"past": past_str, "current": current_str, "next": next_str}, delta_sec
+    return scheduled_sec, {"past": past_str, "current": current_str, "next": next_str}, delta_sec
 
 
 if __name__ == "__main__":
@@ -378,9 +983,10 @@ if __name__ == "__main__":
     df, route_map, stops, cal, cal_dates, tsvc = load_static_data()
     active = get_active_service_ids(cal, cal_dates)
     today_df = filter_schedule_for_date(df, tsvc, active)
+    today_index = build_schedule_index(today_df)
     print(f"Active service_ids: {active}")
     print(f"Rows in today's schedule: {len(today_df)}")
     eta_test = _dt.now().replace(second=0, microsecond=0)
-    raw, ctx, delta = get_stop_schedule_context("5049", eta_test, today_df, df)
-    print(f"Test stop 5049 at {eta_test.strftime('%H:%M')}: scheduled={raw}, delta={delta:.0f}s")
+    sched, ctx, delta = get_stop_schedule_context("5049", "777", eta_test, today_index, df)
+    print(f"Test stop 5049 at {eta_test.strftime('%H:%M')}: scheduled={fmt_time(sched) if sched is not None else None}, delta={delta:.0f}s")
     print(f"Context: {ctx}")
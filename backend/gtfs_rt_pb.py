@@ -0,0 +1,53 @@
+try:
+    from google.transit import gtfs_realtime_pb2   # optional: pip install gtfs-realtime-bindings
+except ImportError:
+    gtfs_realtime_pb2 = None
+
+
+def protobuf_available():
+    return gtfs_realtime_pb2 is not None
+
+
+def _media_type(content_type):
+    return (content_type or "").split(";", 1)[0].strip().lower()
+
+
+def parse_feed(body, content_type=None):
+    """
+    The FeedMessage in `body`, or None when `body` is to be read as JSON.
+
+    A JSON Content-Type is taken at its word, and so is a protobuf /
+    octet-stream one, which raises ValueError when the body does not parse.
+    With no Content-Type, or an uninformative one (text/plain), the body is
+    tried as a FeedMessage and read as JSON when that fails.
+    """
+    media_type = _media_type(content_type)
+    if media_type == "application/json" or media_type.endswith("+json"):
+        return None
+    declared = "protobuf" in media_type or media_type == "application/octet-stream"
+    if gtfs_realtime_pb2 is None:
+        if declared:
+            raise ValueError("protobuf feed received but gtfs-realtime-bindings is not installed")
+        return None
+
+    message = gtfs_realtime_pb2.FeedMessage()
+    try:
+        message.ParseFromString(body)
+    except Exception as e:    # google.protobuf.message.DecodeError
+        if declared:
+            raise ValueError(f"invalid GTFS-RT protobuf: {e}") from e
+        return None
+    return message
+
+
+def encode_feed(payload):
+    """JSON-layout feed dict -> binary FeedMessage (for tests, replays and benchmarks)."""
+    if gtfs_realtime_pb2 is None:
+        raise ValueError("gtfs-realtime-bindings is not installed")
+    from google.protobuf import json_format
+
+    message = gtfs_realtime_pb2.FeedMessage()
+    json_format.ParseDict(payload, message, ignore_unknown_fields=True)
+    if not message.header.gtfs_realtime_version:    # required in protobuf, often omitted in JSON
+        message.header.gtfs_realtime_version = "2.0"
+    return message.SerializeToString()
@@ -0,0 +1,254 @@
+"""
+Record GTFS-RT feeds to disk and replay them as a local stand-in upstream.
+
+    python gtfs_rt_replay.py record recordings/monday --duration 3600 --interval 5
+    python gtfs_rt_replay.py serve recordings/monday --speed 10 --port 8765
+
+then start the backend against the replay:
+
+    REALTIME_URL=http://127.0.0.1:8765/tripUpdates.json \\
+    VEHICLE_POSITIONS_URL=http://127.0.0.1:8765/vehiclePositions.json \\
+    PASSIOGO_CLOCK_URL=http://127.0.0.1:8765/clock \\
+    REALTIME_POLL_INTERVAL_SEC=0.5 uvicorn main:app
+
+A recording is a directory with one gzip file per captured payload and
+frames.jsonl listing {t, feed, file, sha256, content_type} in capture
+order.  The server keeps a virtual clock starting at the first frame and
+running `speed` times faster than real time; each feed URL returns the
+latest frame at or before that clock (ETag = payload hash, so conditional
+GETs get 304 until the next frame) and /clock reports the clock for the
+backend to follow.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from bisect import bisect_right
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+from realtime import REALTIME_URL, VEHICLE_POSITIONS_URL
+from upstream import feed_name
+
+FRAMES = "frames.jsonl"
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Recording
+# ─────────────────────────────────────────────────────────────────────────────
+
+def record(out_dir, urls, duration_sec, interval_sec):
+    """
+    Poll every URL in `urls` each `interval_sec` for `duration_sec` and append
+    the payloads to the recording in `out_dir`.  A payload identical to the
+    feed's previous one is not stored again.  Returns the number of frames written.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    last_hash = {}
+    written = 0
+    deadline = time.monotonic() + duration_sec
+
+    with httpx.Client(timeout=10) as client, open(os.path.join(out_dir, FRAMES), "a") as index:
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            for url in urls:
+                feed = feed_name(url)
+                try:
+                    response = client.get(url)
+                    response.raise_for_status()
+                except httpx.HTTPError as e:
+                    print(f"[WARN] {feed}: {e}", flush=True)
+                    continue
+
+                captured_at = time.time()
+                digest = hashlib.sha256(response.content).hexdigest()
+                if last_hash.get(feed) == digest:
+                    continue
+                last_hash[feed] = digest
+
+                name = os.path.join(feed, f"{int(captured_at * 1000)}.gz")
+                os.makedirs(os.path.join(out_dir, feed), exist_ok=True)
+                with open(os.path.join(out_dir, name), "wb") as f:
+                    f.write(gzip.compress(response.content, mtime=0))
+                index.write(json.dumps({
+                    "t": captured_at,
+                    "feed": feed,
+                    "file": name,
+                    "sha256": digest,
+                    "content_type": response.headers.get("Content-Type", "application/json"),
+                }) + "\n")
+                index.flush()
+                written += 1
+
+            time.sleep(max(0.0, interval_sec - (time.monotonic() - started)))
+
+    print(f"[INFO] recorded {written} frames into {out_dir}", flush=True)
+    return written
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Replay
+# ─────────────────────────────────────────────────────────────────────────────
+
+class Recording:
+    """The frames of one recording, per feed and in time order."""
+
+    BODY_CACHE_FRAMES = 64      # decompressed bodies kept per recording
+
+    def __init__(self, rec_dir):
+        self.rec_dir = rec_dir
+        self.frames = {}    # feed -> [frame dict, ...] sorted by t
+        self._bodies = {}   # frame file -> decompressed body, oldest first
+        self._bodies_lock = threading.Lock()
+        with open(os.path.join(rec_dir, FRAMES)) as f:
+            for line in f:
+                if line.strip():
+                    frame = json.loads(line)
+                    self.frames.setdefault(frame["feed"], []).append(frame)
+        if not self.frames:
+            raise ValueError(f"{rec_dir} has no frames")
+        for frames in self.frames.values():
+            frames.sort(key=lambda frame: frame["t"])
+        self._times = {feed: [frame["t"] for frame in frames] for feed, frames in self.frames.items()}
+        self.first_t = min(times[0] for times in self._times.values())
+        self.last_t = max(times[-1] for times in self._times.values())
+
+    def frame_at(self, feed, t):
+        """Latest frame of `feed` captured at or before `t` (the first one before it starts)."""
+        frames = self.frames.get(feed)
+        if not frames:
+            return None
+        return frames[max(0, bisect_right(self._times[feed], t) - 1)]
+
+    def body(self, name):
+        """Decompressed payload of the frame stored as `name`; the latest BODY_CACHE_FRAMES stay in memory."""
+        with self._bodies_lock:
+            body = self._bodies.get(name)
+        if body is None:
+            with open(os.path.join(self.rec_dir, name), "rb") as f:
+                body = gzip.decompress(f.read())
+            with self._bodies_lock:
+                self._bodies[name] = body
+                while len(self._bodies) > self.BODY_CACHE_FRAMES:
+                    del self._bodies[next(iter(self._bodies))]
+        return body
+
+
+class ReplayServer:
+    """
+    HTTP stand-in for the upstream feeds, replaying a Recording against a
+    virtual clock.  Feeds are addressed by name with any extension
+    (/tripUpdates.json); GET /clock returns {"now", "speed", "start", "end"}.
+    """
+
+    def __init__(self, recording, speed=1.0, start_offset_sec=0.0, host="127.0.0.1", port=8765):
+        self.recording = recording
+        self.speed = speed
+        self._start_t = recording.first_t + start_offset_sec
+        self._started = time.monotonic()
+        replay = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                replay._handle(self)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def now(self):
+        """Virtual Unix time of the replay."""
+        return self._start_t + (time.monotonic() - self._started) * self.speed
+
+    def _send(self, handler, status, body=b"", headers=None):
+        handler.send_response(status)
+        for key, value in (headers or {}).items():
+            handler.send_header(key, value)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def _handle(self, handler):
+        path = handler.path.split("?", 1)[0]
+        if path == "/clock":
+            body = json.dumps({
+                "now": self.now(), "speed": self.speed,
+                "start": self.recording.first_t, "end": self.recording.last_t,
+            }).encode()
+            self._send(handler, 200, body, {"Content-Type": "application/json"})
+            return
+
+        frame = self.recording.frame_at(feed_name(path), self.now())
+        if frame is None:
+            self._send(handler, 404)
+            return
+
+        etag = f'"{frame["sha256"][:32]}"'
+        if handler.headers.get("If-None-Match") == etag:
+            self._send(handler, 304, headers={"ETag": etag})
+            return
+        self._send(handler, 200, self.recording.body(frame["file"]), {
+            "Content-Type": frame.get("content_type", "application/json"),
+            "ETag": etag,
+        })
+
+    def start(self):
+        """Serve on a daemon thread (returns immediately)."""
+        self._thread = threading.Thread(target=self.server.serve_forever, name="gtfs-rt-replay", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rec = commands.add_parser("record", help="capture the live feeds into a recording")
+    rec.add_argument("out_dir")
+    rec.add_argument("--duration", type=float, default=3600, help="seconds to record")
+    rec.add_argument("--interval", type=float, default=5, help="seconds between polls")
+    rec.add_argument("--url", action="append", help="feed URL (repeatable; default: both configured feeds)")
+
+    serve = commands.add_parser("serve", help="replay a recording over HTTP")
+    serve.add_argument("rec_dir")
+    serve.add_argument("--speed", type=float, default=1.0, help="virtual seconds per real second")
+    serve.add_argument("--start-offset", type=float, default=0.0, help="seconds into the recording to start at")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8765)
+
+    args = parser.parse_args()
+    if args.command == "record":
+        record(args.out_dir, args.url or [REALTIME_URL, VEHICLE_POSITIONS_URL], args.duration, args.interval)
+        return
+
+    recording = Recording(args.rec_dir)
+    replay = ReplayServer(recording, args.speed, args.start_offset, args.host, args.port)
+    span = recording.last_t - recording.first_t
+    print(
+        f"[INFO] replaying {sum(len(f) for f in recording.frames.values())} frames "
+        f"({span:.0f}s, feeds: {', '.join(sorted(recording.frames))}) at {args.speed:g}x on {replay.url}",
+        flush=True,
+    )
+    try:
+        replay.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,34 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
-from gtfs_data import (
-    load_static_data, load_shapes,
-    get_active_service_ids, filter_schedule_for_date,
-    get_stop_schedule_context, fmt_time
+from fastapi.responses import Response, StreamingResponse
+from adherence import AdherenceTable, match_schedule
+import clock
+import metrics
+import shared_state
+from metrics import MetricsMiddleware, stage_latency
+from precompressed import brotli_available, precompressed_response
+from spatial import GridIndex, parse_bbox
+from response_cache import response_cache
+from realtime import (
+    get_snapshot, current_snapshot, start_poller, stop_poller, add_snapshot_listener,
+    set_route_resolver, MAX_STALE_SEC
 )
-from realtime import fetch_realtime_updates, fetch_vehicle_positions, determine_status_color
+from upstream import circuit_states
+from gtfs_rt_pb import protobuf_available
+from static_bundle import (
+    current_bundle, load_bundle, swap_bundle, add_swap_listener,
+    reload_static_in_background, reload_state
+)
+from vehicle_stream import VehicleStream
+from vehicle_history import vehicle_history
 from datetime import datetime, timedelta
 import math
+import os
 import threading
 import time
 
+import numpy as np
+
 app = FastAPI()
 
 # allow CORS for frontend
@@ -21,165 +39,208 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# per-route request counts and latency, exposed at /metrics
+app.add_middleware(MetricsMiddleware)
+
+# Static data lives in an immutable StaticBundle (see static_bundle.py);
+# endpoints grab current_bundle() once so a hot reload never splits a request.
+
+# Shared secret for POST /api/admin/reload-static; the endpoint is disabled when unset.
+STATIC_RELOAD_TOKEN = os.environ.get("STATIC_RELOAD_TOKEN")
+
+# realtime-derived state
+vehicles_payload   = (None, None)   # ((snapshot version, bundle version), /api/vehicles payload)
+adherence_table    = (None, None)   # ((snapshot version, bundle version), AdherenceTable)
+vehicle_index      = (None, None)   # (payload, GridIndex over its vehicles)
+vehicle_stream     = VehicleStream()
+
+def require_bundle():
+    """Return the current StaticBundle or raise 503 before the first load."""
+    bundle = current_bundle()
+    if bundle is None:
+        raise HTTPException(status_code=503, detail="Static data not loaded")
+    return bundle
+
+def bbox_or_400(bbox):
+    """Parsed ?bbox=west,south,east,north as (south, west, north, east), or None when absent."""
+    if bbox is None:
+        return None
+    try:
+        return parse_bbox(bbox)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-# global state for static data
-static_schedule    = None   # full schedule (all services)
-trip_route_map     = None
-stops_list         = None
-shapes_data        = None
-calendar_df        = None
-calendar_dates_df  = None
-trip_service_map   = None
-schedule_today     = None   # schedule filtered to today's active trips
-schedule_today_date = None  # date the filter was last computed
-
-def get_schedule_today():
-    """Return a schedule DataFrame filtered to today's active trips.
-    Re-filters whenever the calendar date advances (midnight rollover)."""
-    global schedule_today, schedule_today_date
-    today = datetime.now().date()
-    if schedule_today is None or schedule_today_date != today:
-        active = get_active_service_ids(calendar_df, calendar_dates_df, today)
-        schedule_today      = filter_schedule_for_date(static_schedule, trip_service_map, active)
-        schedule_today_date = today
-        print(f"[INFO] schedule_today refreshed for {today}: {len(schedule_today)} rows, active services: {active}", flush=True)
-    return schedule_today
+def on_bundle_swap(bundle):
+    # Trip updates are re-indexed against the new trip -> route mapping
+    set_route_resolver(bundle.route_id_for)
 
 @app.on_event("startup")
 def startup_event():
-    global static_schedule, trip_route_map, stops_list, shapes_data
-    global calendar_df, calendar_dates_df, trip_service_map
-    static_schedule, trip_route_map, stops_list, calendar_df, calendar_dates_df, trip_service_map = load_static_data()
-    shapes_data = load_shapes()
-    # Pre-warm today's filtered schedule
-    get_schedule_today()
+    # transit clock: real time unless pointed at a replay (see clock.py)
+    clock.configure()
+    add_swap_listener(on_bundle_swap)
+    add_snapshot_listener(publish_vehicle_stream)
+    # recent positions per vehicle, for trails and derived speed / heading
+    add_snapshot_listener(vehicle_history.record_snapshot)
+    if not protobuf_available():
+        print("[WARN] gtfs-realtime-bindings not installed: only JSON realtime feeds can be read", flush=True)
+    if not brotli_available():
+        print("[WARN] brotli not installed: static responses are served gzip-compressed only", flush=True)
+    # With PASSIOGO_SHARED_DIR set, one worker loads and polls and the
+    # others attach to what it publishes (see shared_state.py)
+    if shared_state.start():
+        return
+    # Parsed from the CSVs only when the feed changed; otherwise from disk cache.
+    # load_bundle also pre-warms today's filtered schedule.
+    swap_bundle(load_bundle())
+    # Endpoints read the shared realtime snapshot kept fresh by this poller
+    start_poller()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    stop_poller()
+    shared_state.stop()
 
 @app.get("/api/health")
 def health_check():
-    return {"status": "ok"}
+    """
+    "ok", or "degraded" while a realtime feed is too stale to serve; with
+    the age of each feed's last good payload and the upstream circuit states.
+    """
+    snapshot = current_snapshot()
+    feeds = {
+        feed: {
+            "age_sec": snapshot.feed_age_sec(feed) if snapshot else None,
+            "fresh": bool(snapshot and snapshot.is_fresh(feed)),
+        }
+        for feed in ("trip_updates", "vehicle_positions")
+    }
+    return {
+        "status": "ok" if all(f["fresh"] for f in feeds.values()) else "degraded",
+        "realtime": feeds,
+        "circuits": circuit_states(),
+    }
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus text exposition of request, upstream, stage and static-data metrics."""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 @app.get("/api/stops")
-def get_all_stops():
+def get_all_stops(
+    bbox: str = Query(None, description="west,south,east,north"),
+    accept_encoding: str = Header(None),
+    if_none_match: str = Header(None),
+):
     """
     Returns all stops from the static GTFS data with their coordinates and names.
+    Served pre-serialised and pre-compressed per static bundle, with an ETag.
+    With `bbox`, only the stops inside that viewport are returned.
     """
-    if stops_list is None:
-        raise HTTPException(status_code=503, detail="Static data not loaded")
-    return {"stops": stops_list}
+    bundle = require_bundle()
+    box = bbox_or_400(bbox)
+    if box is not None:
+        return {"stops": [bundle.stops_list[i] for i in bundle.stop_index.within(*box).tolist()]}
+    return precompressed_response(bundle.stops_response(), accept_encoding, if_none_match)
+
+@app.get("/api/stops/nearest")
+def get_nearest_stops(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    n: int = Query(5, ge=1, le=100),
+    max_distance_m: float = Query(None, gt=0),
+):
+    """The `n` stops closest to lat/lon (optionally within max_distance_m), closest first."""
+    bundle = require_bundle()
+    nearest = bundle.stop_index.nearest(lat, lon, n, max_distance_m)
+    return {
+        "stops": [dict(bundle.stops_list[i], distance_m=round(d, 1)) for i, d in nearest],
+    }
 
 @app.get("/api/shapes")
-def get_shapes():
+def get_shapes(
+    zoom: int = Query(None, ge=0, le=22),
+    encoding: str = Query("points", pattern="^(points|polyline)$"),
+    accept_encoding: str = Header(None),
+    if_none_match: str = Header(None),
+):
     """
     Returns all route shapes with colours for rendering polylines on the map.
+
+    `zoom` returns geometry simplified (Douglas–Peucker) for that map zoom;
+    omit it for full resolution.  `encoding=polyline` replaces each shape's
+    `points` with a Google encoded-polyline string.
+    Served pre-serialised and pre-compressed per static bundle, with an ETag.
     """
-    if shapes_data is None:
-        raise HTTPException(status_code=503, detail="Static data not loaded")
-    return {"shapes": shapes_data}
+    encoded = require_bundle().shapes_response(zoom, encoding)
+    return precompressed_response(encoded, accept_encoding, if_none_match)
 
-@app.get("/api/stop/{stop_id}")
-def get_stop_status(stop_id: str):
+def get_adherence(snapshot, bundle):
+    """AdherenceTable for `snapshot`, built at most once per snapshot and bundle version."""
+    global adherence_table
+    key, table = adherence_table
+    if key != (snapshot.version, bundle.version):
+        with stage_latency.time(stage="adherence_table"):
+            table = AdherenceTable(snapshot, bundle.flat_schedule_index_today(), clock.now())
+        adherence_table = ((snapshot.version, bundle.version), table)
+    return table
+
+
+def stop_arrivals(stop_id, table, bundle, now, log=False):
     """
-    Returns upcoming buses for a specific stop with status colors.
+    Upcoming buses at one stop from a snapshot's AdherenceTable, each with
+    its timetable match and status colour; the soonest bus per route, by ETA.
     """
-    global static_schedule, trip_route_map
-    if static_schedule is None:
-        raise HTTPException(status_code=503, detail="Static data not loaded")
+    buses = []
+    match = table.match
 
-    # fetch realtime updates
-    realtime_data = fetch_realtime_updates()
-    if not realtime_data or 'entity' not in realtime_data:
-        raise HTTPException(status_code=502, detail="Failed to fetch realtime data")
+    # pending arrivals at this stop, matched to today's timetable once per snapshot
+    start, end = table.stop_rows.get(stop_id, (0, 0))
+    for i in range(start, end):
+        eta_dt = datetime.fromtimestamp(int(table.arrival_ts[i]))
+        seconds_away = (eta_dt - now).total_seconds()
 
-    buses = []
-    
-    # process entities
-    for entity in realtime_data['entity']:
-        trip_update = entity.get('trip_update')
-        if not trip_update:
-            continue
-            
-        trip_id = trip_update.get('trip', {}).get('trip_id')
-        stop_time_updates = trip_update.get('stop_time_update', [])
-        
-        # find update for this stop
-        target_update = None
-        for update in stop_time_updates:
-            if update.get('stop_id') == stop_id:
-                target_update = update
-                break
-        
-        if not target_update:
-            continue
-            
-        # get realtime arrival
-        arrival = target_update.get('arrival')
-        if not arrival or 'time' not in arrival:
+        # Only keep future buses so each route shows the soonest upcoming ETA.
+        if seconds_away < 0:
             continue
-            
-        predicted_unix = arrival['time']
-        eta_dt = datetime.fromtimestamp(predicted_unix)
-
-        # Schedules belong to the stop's timetable, not to individual trip_ids.
-        # Match this bus to the closest scheduled slot at this stop from today's
-        # active timetable — works even when the realtime trip_id belongs to an
-        # expired service period that the provider hasn't rotated out yet.
-        sched_today = get_schedule_today()
-        route_info = trip_route_map.get(trip_id, {})
-        route_id = route_info.get("route_id", "")
-        scheduled_time_str, schedule_context, delta = get_stop_schedule_context(
-            stop_id, route_id, eta_dt, sched_today, static_schedule
-        )
+
+        # Schedules belong to the stop's timetable, not to individual trip_ids:
+        # each bus was matched to the closest scheduled slot at this stop from
+        # today's active timetable — works even when the realtime trip_id
+        # belongs to an expired service period the provider hasn't rotated out yet.
+        trip_id = table.trip_ids[i]
+        route_id = table.route_ids[i]
+        route_info = bundle.trip_route_map.get(trip_id, {})
+        scheduled_sec, schedule_context, delta = match.context(i)
 
         # debug logging
-        print(f"[DEBUG] Trip: {trip_id}, Stop: {stop_id}, ETA: {eta_dt.strftime('%H:%M:%S')} -> Scheduled: {scheduled_time_str} delta={delta:.0f}s", flush=True)
-
-        # determine status (lateness) from the computed delta
-        if scheduled_time_str:
-            if delta == float('inf') or delta == float('-inf'):
-                status = "Off Schedule"
-                color  = "Black"
-                delta  = 0          # zero out so frontend doesn't show wild numbers
-            else:
-                status, color = determine_status_color(delta)
-        else:
-            status = "Off Schedule"
-            color  = "Black"
+        if log:
+            print(f"[DEBUG] Trip: {trip_id}, Stop: {stop_id}, ETA: {eta_dt.strftime('%H:%M:%S')} -> Scheduled: {scheduled_sec} delta={delta:.0f}s", flush=True)
+
+        # lateness from the matched delta; Off Schedule without a usable slot
+        status, color = match.status_color(i)
 
         route_name = route_info.get("long_name") or route_info.get("short_name") or "Unknown Route"
         route_badge = route_info.get("short_name") or "Bus"
         route_color = route_info.get("color") or "#e310d2"
-        
-        # get vehicle label
-        vehicle_label = entity.get('trip_update', {}).get('vehicle', {}).get('label', 'Unknown')
-        
-        # calculate ETA from now
-        now = datetime.now()
-        seconds_away = (eta_dt - now).total_seconds()
-
-        # Only keep future buses so each route shows the soonest upcoming ETA.
-        if seconds_away < 0:
-            continue
 
         minutes_away = int(seconds_away // 60)
 
-        # format scheduled time
-        formatted_schedule = fmt_time(scheduled_time_str) if scheduled_time_str else None
-
         buses.append({
             "trip_id": trip_id,
             "route_id": route_id,
             "route_badge": route_badge,
             "route_name": route_name,
-            "bus_number": vehicle_label,
-            "scheduled_time": formatted_schedule,
+            "bus_number": table.vehicle_labels[i],
+            "scheduled_time": schedule_context["current"],
             "schedule_context": schedule_context,
             "eta_min": max(0, minutes_away),
             "status": status,
             "color": color,
             "route_color": route_color,
-            "delta_sec": delta
+            "delta_sec": match.delta_sec(i)
         })
-    
+
     # sort by ETA, then deduplicate: one entry per route (soonest bus)
     buses.sort(key=lambda x: x['eta_min'])
 
@@ -189,174 +250,357 @@ def get_stop_status(stop_id: str):
         if rid not in seen_routes:
             seen_routes[rid] = b
 
-    deduped = sorted(seen_routes.values(), key=lambda x: x['eta_min'])
+    return sorted(seen_routes.values(), key=lambda x: x['eta_min'])
 
-    return {
-        "stop_id": stop_id,
-        "buses": deduped
-    }
+
+def require_fresh(snapshot, feed, response):
+    """
+    503 when `feed`'s last good payload is older than REALTIME_MAX_STALE_SEC;
+    otherwise tags `response` with its age (X-Realtime-Age, seconds), which
+    grows past the poll interval while the upstream is failing.
+    """
+    age = snapshot.feed_age_sec(feed)
+    if age is not None and age > MAX_STALE_SEC:
+        raise HTTPException(
+            status_code=503, detail=f"Realtime data is {age:.0f}s old (limit {MAX_STALE_SEC:.0f}s)"
+        )
+    if age is not None:
+        response.headers["X-Realtime-Age"] = str(int(age))
+
+
+def require_trip_updates(response):
+    """
+    The current realtime snapshot, or 502 when it has no trip updates and
+    503 when its last good trip updates are too old to serve.
+    """
+    snapshot = get_snapshot()
+    if snapshot.trip_updates is None:
+        raise HTTPException(status_code=502, detail="Failed to fetch realtime data")
+    require_fresh(snapshot, "trip_updates", response)
+    return snapshot
+
+
+@app.get("/api/stop/{stop_id}")
+def get_stop_status(stop_id: str, response: Response):
+    """
+    Returns upcoming buses for a specific stop with status colors.
+    """
+    bundle = require_bundle()
+    snapshot = require_trip_updates(response)
+
+    # identical for every caller until the next snapshot
+    return response_cache.get_or_compute(
+        "stop", stop_id, snapshot, bundle,
+        lambda: {
+            "stop_id": stop_id,
+            "buses": stop_arrivals(
+                stop_id, get_adherence(snapshot, bundle), bundle, clock.now(), log=True
+            ),
+        },
+    )
+
+
+@app.get("/api/arrivals")
+def get_arrivals(response: Response, stop_ids: str = Query(..., description='comma-separated stop_ids, or "all"')):
+    """
+    Upcoming buses for many stops at once — the /api/stop/{stop_id} result
+    for each requested stop, computed in one pass over the current snapshot
+    with one adherence table and one clock reading.  `stop_ids=all` covers
+    every stop in the static feed.
+    """
+    bundle = require_bundle()
+    snapshot = require_trip_updates(response)
+
+    if stop_ids.strip().lower() == "all":
+        wanted = [stop["stop_id"] for stop in bundle.stops_list]
+        params = "all"
+    else:
+        wanted = list(dict.fromkeys(s.strip() for s in stop_ids.split(",") if s.strip()))
+        if not wanted:
+            raise HTTPException(status_code=400, detail="No stop_ids given")
+        params = tuple(wanted)
+
+    def compute():
+        table = get_adherence(snapshot, bundle)
+        now = clock.now()
+        return {
+            "snapshot_version": snapshot.version,
+            "stops": {
+                stop_id: stop_arrivals(stop_id, table, bundle, now)
+                for stop_id in wanted
+            },
+        }
+
+    return response_cache.get_or_compute("arrivals", params, snapshot, bundle, compute)
+
+
+@app.get("/api/on-time")
+def get_on_time_summary(response: Response):
+    """
+    Network-wide schedule adherence: every active trip counted once, at its
+    next predicted stop, by status (Early / On Time / Late / Very Late /
+    Off Schedule), with the on-time percentage and median deviation overall
+    and per route.
+    """
+    bundle = require_bundle()
+    snapshot = require_trip_updates(response)
+
+    def compute():
+        table = get_adherence(snapshot, bundle)
+        return {
+            "snapshot_version": snapshot.version,
+            "as_of": table.now.isoformat(timespec="seconds"),
+            **table.summary({info["route_id"]: info for info in bundle.trips.routes}),
+        }
+
+    return response_cache.get_or_compute("on-time", None, snapshot, bundle, compute)
 
 
 @app.get("/api/active-routes")
-def get_active_routes():
+def get_active_routes(response: Response):
     """
     Returns the list of route names that currently have at least one
     active realtime trip update (i.e. buses running right now or soon).
     """
-    global trip_route_map
-    if trip_route_map is None:
-        raise HTTPException(status_code=503, detail="Static data not loaded")
-
-    realtime_data = fetch_realtime_updates()
-    if not realtime_data or "entity" not in realtime_data:
+    bundle = require_bundle()
+    snapshot = get_snapshot()
+    require_fresh(snapshot, "trip_updates", response)
+    return response_cache.get_or_compute(
+        "active-routes", None, snapshot, bundle, lambda: active_routes(snapshot, bundle)
+    )
+
+
+def active_routes(snapshot, bundle):
+    """Route names with a future predicted arrival in `snapshot`."""
+    trip_updates = snapshot.trip_updates
+    if trip_updates is None:
         return {"active_routes": []}
 
-    now = datetime.now()
+    # trips with at least one future stop arrival, resolved in one lookup
+    trips = trip_updates.active_trips(clock.now().timestamp())
     active_names = set()
-
-    for entity in realtime_data["entity"]:
-        trip_update = entity.get("trip_update")
-        if not trip_update:
-            continue
-
-        trip_id = trip_update.get("trip", {}).get("trip_id")
-        route_info = trip_route_map.get(trip_id, {})
-        route_name = (
+    for route_info in bundle.trips.route_infos(trip_updates.trip_ids[trips].tolist()):
+        route_info = route_info or {}
+        active_names.add(
             route_info.get("long_name")
             or route_info.get("short_name")
             or "Unknown Route"
         )
 
-        # Check if the trip has at least one future stop arrival
-        stop_updates = trip_update.get("stop_time_update", [])
-        for upd in stop_updates:
-            arrival = upd.get("arrival")
-            if arrival and "time" in arrival:
-                if datetime.fromtimestamp(arrival["time"]) > now:
-                    active_names.add(route_name)
-                    break
-
     return {"active_routes": sorted(active_names)}
 
 
-@app.get("/api/vehicles")
-def get_active_vehicles():
+def build_vehicles_payload(snapshot, bundle):
     """
-    Returns active buses with current coordinates, heading, route info,
-    and realtime ETA status color (on-time/early/late/off-schedule).
+    Builds the /api/vehicles payload (active buses with coordinates, heading,
+    route info and ETA status colour) from one realtime snapshot and static bundle.
+    Returns None when the snapshot has no vehicle position data.
     """
-    global trip_route_map
-    if trip_route_map is None:
-        raise HTTPException(status_code=503, detail="Static data not loaded")
-
-    vehicle_data = fetch_vehicle_positions()
-    if not vehicle_data or "entity" not in vehicle_data:
-        raise HTTPException(status_code=502, detail="Failed to fetch vehicle position data")
+    feed = snapshot.vehicle_positions
+    if feed is None:
+        return None
 
-    trip_updates = fetch_realtime_updates() or {}
-    trip_update_index = {}
-    for entity in trip_updates.get("entity", []):
-        trip_update = entity.get("trip_update")
-        if not trip_update:
-            continue
-        trip_id = trip_update.get("trip", {}).get("trip_id")
-        if trip_id:
-            trip_update_index[str(trip_id)] = trip_update
-
-    now = datetime.now()
+    now = clock.now()
     now_ts = int(now.timestamp())
-    sched_today = get_schedule_today()
-
-    vehicles = []
-    for entity in vehicle_data["entity"]:
-        vehicle_wrap = entity.get("vehicle")
-        if not vehicle_wrap:
-            continue
 
-        trip_id = str(vehicle_wrap.get("trip", {}).get("trip_id", "")).strip()
-        position = vehicle_wrap.get("position") or {}
-        lat = position.get("latitude")
-        lon = position.get("longitude")
-        if lat is None or lon is None:
-            continue
+    # next stop of every trip update; a trip_id listed twice keeps its last one
+    trip_updates = snapshot.trip_updates
+    next_stop_by_trip = {}
+    if trip_updates is not None:
+        stop_ids, arrival_ts = trip_updates.next_stops(now_ts)
+        next_stop_by_trip = {
+            trip_id: (stop_id, ts)
+            for trip_id, stop_id, ts in zip(trip_updates.trip_ids.tolist(), stop_ids.tolist(), arrival_ts.tolist())
+            if trip_id
+        }
+
+    located = np.flatnonzero(~(np.isnan(feed.lat) | np.isnan(feed.lon)))
+    trip_ids = feed.trip_ids[located].tolist()
+    # every vehicle's route resolved in one lookup against the trip table
+    route_infos = bundle.trips.route_infos(trip_ids)
+    columns = zip(
+        trip_ids, route_infos, feed.vehicle_ids[located].tolist(), feed.labels[located].tolist(),
+        feed.lat[located].tolist(), feed.lon[located].tolist(),
+        np.nan_to_num(feed.bearing[located]).tolist(), np.nan_to_num(feed.speed[located]).tolist(),
+        feed.position_ts[located].tolist(),
+    )
 
-        route_info = trip_route_map.get(trip_id, {})
+    vehicles = []
+    pending = []        # (position in vehicles, next stop_id, route_id, predicted arrival)
+    for trip_id, route_info, vehicle_id, vehicle_label, lat, lon, bearing, speed, position_ts in columns:
+        route_info = route_info or {}
         route_id = route_info.get("route_id", "")
         route_name = route_info.get("long_name") or route_info.get("short_name") or "Unknown Route"
         route_badge = route_info.get("short_name") or "Bus"
         route_color = route_info.get("color") or "#e310d2"
 
-        vehicle_info = vehicle_wrap.get("vehicle") or {}
-        vehicle_id = str(vehicle_info.get("id", "")).strip()
-        vehicle_label = vehicle_info.get("label") or "Unknown"
-
-        status = "Off Schedule"
-        color = "Black"
         eta_min = None
-        delta_sec = 0
-
-        trip_update = trip_update_index.get(trip_id)
-        if trip_update:
-            stop_updates = trip_update.get("stop_time_update", [])
-            next_update = None
-
-            for upd in stop_updates:
-                arrival = upd.get("arrival")
-                if arrival and "time" in arrival and int(arrival["time"]) >= now_ts:
-                    next_update = upd
-                    break
-
-            if next_update is None and stop_updates:
-                next_update = stop_updates[0]
-
-            if next_update:
-                arrival = next_update.get("arrival") or {}
-                predicted_unix = arrival.get("time")
-                next_stop_id = next_update.get("stop_id")
-
-                if predicted_unix and next_stop_id:
-                    eta_dt = datetime.fromtimestamp(predicted_unix)
-                    seconds_away = (eta_dt - now).total_seconds()
-                    eta_min = max(0, int(seconds_away // 60))
-
-                    scheduled_time_str, _, delta = get_stop_schedule_context(
-                        next_stop_id, route_id, eta_dt, sched_today, static_schedule
-                    )
-
-                    if scheduled_time_str:
-                        if delta == float("inf") or delta == float("-inf"):
-                            status = "Off Schedule"
-                            color = "Black"
-                            delta_sec = 0
-                        else:
-                            status, color = determine_status_color(delta)
-                            delta_sec = delta
+        next_stop_id, predicted_unix = next_stop_by_trip.get(trip_id, ("", 0))
+        if predicted_unix and next_stop_id:
+            seconds_away = (datetime.fromtimestamp(predicted_unix) - now).total_seconds()
+            eta_min = max(0, int(seconds_away // 60))
+            pending.append((len(vehicles), next_stop_id, route_id, predicted_unix))
 
         vehicles.append({
             "vehicle_id": vehicle_id,
-            "bus_number": vehicle_label,
+            "bus_number": vehicle_label or "Unknown",
             "trip_id": trip_id,
             "route_id": route_id,
             "route_name": route_name,
             "route_badge": route_badge,
             "route_color": route_color,
-            "lat": float(lat),
-            "lon": float(lon),
-            "bearing": float(position.get("bearing", 0) or 0),
-            "speed": float(position.get("speed", 0) or 0),
-            "status": status,
-            "color": color,
-            "delta_sec": delta_sec,
+            "lat": lat,
+            "lon": lon,
+            "bearing": bearing,
+            "speed": speed,
+            "status": "Off Schedule",
+            "color": "Black",
+            "delta_sec": 0,
             "eta_min": eta_min,
-            "position_timestamp": vehicle_wrap.get("timestamp"),
+            "position_timestamp": position_ts or None,
         })
 
+    # every vehicle's next stop matched to today's timetable in one pass
+    if pending:
+        positions, stop_ids, route_ids, arrival_ts = zip(*pending)
+        with stage_latency.time(stage="schedule_context"):
+            match = match_schedule(bundle.flat_schedule_index_today(), stop_ids, route_ids, arrival_ts, now)
+        for i, position in enumerate(positions):
+            status, color = match.status_color(i)
+            vehicles[position].update(status=status, color=color, delta_sec=match.delta_sec(i))
+
     return {
-        "timestamp": vehicle_data.get("header", {}).get("timestamp"),
+        "timestamp": feed.timestamp,
         "vehicles": vehicles,
     }
 
 
+def get_vehicles_payload(snapshot, bundle):
+    """Vehicle payload for `snapshot`, built at most once per snapshot and bundle version."""
+    global vehicles_payload
+    key, payload = vehicles_payload
+    if key != (snapshot.version, bundle.version):
+        with stage_latency.time(stage="vehicles_payload"):
+            payload = build_vehicles_payload(snapshot, bundle)
+        vehicles_payload = ((snapshot.version, bundle.version), payload)
+    return payload
+
+
+def get_vehicle_index(payload):
+    """GridIndex over the vehicles of `payload`, built once per payload."""
+    global vehicle_index
+    indexed, index = vehicle_index
+    if indexed is not payload:
+        vehicles = payload["vehicles"]
+        index = GridIndex([v["lat"] for v in vehicles], [v["lon"] for v in vehicles])
+        vehicle_index = (payload, index)
+    return index
+
+
+def publish_vehicle_stream(snapshot):
+    """Snapshot listener: push the new vehicle list to /api/vehicles/stream subscribers."""
+    bundle = current_bundle()
+    if bundle is None:
+        return
+    payload = get_vehicles_payload(snapshot, bundle)
+    if payload is not None:
+        vehicle_stream.publish(snapshot.version, payload)
+
+
+@app.get("/api/vehicles")
+def get_active_vehicles(response: Response, bbox: str = Query(None, description="west,south,east,north")):
+    """
+    Returns active buses with current coordinates, heading, route info,
+    and realtime ETA status color (on-time/early/late/off-schedule).
+    With `bbox`, only the buses inside that viewport are returned.
+    """
+    bundle = require_bundle()
+    box = bbox_or_400(bbox)
+
+    snapshot = get_snapshot()
+    payload = get_vehicles_payload(snapshot, bundle)
+    if payload is None:
+        raise HTTPException(status_code=502, detail="Failed to fetch vehicle position data")
+    require_fresh(snapshot, "vehicle_positions", response)
+    if box is not None:
+        vehicles = payload["vehicles"]
+        payload = dict(payload, vehicles=[vehicles[i] for i in get_vehicle_index(payload).within(*box).tolist()])
+    return payload
+
+
+@app.get("/api/vehicles/stream")
+def stream_vehicles():
+    """
+    Server-sent events: one `snapshot` event with the full vehicle list on
+    connect, then a `delta` event per realtime snapshot carrying only the
+    vehicles whose position, status or ETA changed (plus removed keys).
+    """
+    require_bundle()
+
+    return StreamingResponse(
+        vehicle_stream.subscribe(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/vehicles/motion")
+def get_vehicle_motion():
+    """
+    Speed (m/s) and heading (degrees) of every tracked vehicle, derived
+    from its last two recorded positions — also for feeds that leave
+    `speed` / `bearing` empty.  null heading: the vehicle is standing still.
+    """
+    return vehicle_history.motion_payload()
+
+
+@app.get("/api/vehicles/{vehicle_id}/trail")
+def get_vehicle_trail(vehicle_id: str):
+    """
+    The vehicle's recent positions, oldest first (up to
+    VEHICLE_HISTORY_POINTS), each with the speed and heading of the move
+    that led to it; top-level speed_mps / heading are the latest move's.
+    """
+    trail = vehicle_history.trail_payload(vehicle_id)
+    if trail is None:
+        raise HTTPException(status_code=404, detail=f"No position history for vehicle {vehicle_id}")
+    return trail
+
+
+@app.post("/api/admin/reload-static")
+def reload_static_data(path: str = None, x_reload_token: str = Header(None)):
+    """
+    Loads a new static GTFS feed (directory or .zip; defaults to the
+    configured `static gtfs` directory) in the background and atomically
+    swaps it in.  Requests already running finish on the previous bundle.
+    Requires the X-Reload-Token header to match STATIC_RELOAD_TOKEN.
+    """
+    if not STATIC_RELOAD_TOKEN or x_reload_token != STATIC_RELOAD_TOKEN:
+        raise HTTPException(status_code=403, detail="Static reload not permitted")
+    if path is not None and not os.path.exists(path):
+        raise HTTPException(status_code=400, detail=f"No such feed: {path}")
+
+    if shared_state.role() == "follower":
+        started = shared_state.request_reload(path)     # the leader loads, every worker swaps
+    else:
+        started = reload_static_in_background(path)
+    return {"started": started, **static_status()}
+
+
+@app.get("/api/admin/static-status")
+def static_status():
+    """Which static bundle is live, and the state of any background reload."""
+    bundle = current_bundle()
+    return {
+        "version": bundle.version if bundle else None,
+        "content_hash": bundle.content_hash if bundle else None,
+        "source": bundle.source if bundle else None,
+        "loaded_at": bundle.loaded_at.isoformat() if bundle else None,
+        "reload": dict(reload_state),
+        "worker_role": shared_state.role(),
+    }
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
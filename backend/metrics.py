@@ -0,0 +1,299 @@
+import bisect
+import threading
+import time
+
+# Latency buckets (seconds) shared by every histogram: 50µs … 10s.
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonic count per label set."""
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def values(self):
+        """{label value tuple: count} for every label set seen."""
+        with self._lock:
+            return dict(self._values)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """
+    Current value per label set, either set() directly or read from
+    `callback()` at scrape time (returning a number, a {label tuple: number}
+    dict, or None to omit the sample).
+    """
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=(), callback=None):
+        super().__init__(name, help_text, labels)
+        self._values = {}
+        self._callback = callback
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._values)
+        if self._callback is not None:
+            try:
+                result = self._callback()
+            except Exception as e:
+                print(f"[WARN] metric {self.name} callback failed: {e}", flush=True)
+                result = None
+            if isinstance(result, dict):
+                values.update(result)
+            elif result is not None:
+                values[()] = result
+        return [
+            f"{self.name}{_format_labels(self.label_names, k)} {_format_value(v)}"
+            for k, v in sorted(values.items()) if v is not None
+        ]
+
+
+class Histogram(_Metric):
+    """
+    Fixed-bucket latency histogram per label set.  observe() is a bisect and
+    two additions under a lock, so its cost does not grow with traffic and
+    memory is bounded by (label sets × buckets).
+    """
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+        self._series = {}   # label tuple -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[idx] += 1
+            series[-1] += value
+
+    def time(self, **labels):
+        """Context manager observing the duration of its block."""
+        return _Timer(self, labels)
+
+    def count(self, **labels):
+        series = self._series.get(self._key(labels))
+        return sum(series[:-1]) if series else 0
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        lines = []
+        names = self.label_names + ("le",)
+        for key, series in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_format_labels(names, key + (_format_value(bound),))} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {series[-1]!r}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("_histogram", "_labels", "_started")
+
+    def __init__(self, histogram, labels):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._started, **self._labels)
+        return False
+
+
+_registry = []
+
+
+def _register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def counter(name, help_text, labels=()):
+    return _register(Counter(name, help_text, labels))
+
+
+def gauge(name, help_text, labels=(), callback=None):
+    return _register(Gauge(name, help_text, labels, callback))
+
+
+def histogram(name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+    return _register(Histogram(name, help_text, labels, buckets))
+
+
+def render():
+    """Every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in list(_registry):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Metrics shared across modules
+# ─────────────────────────────────────────────────────────────────────────────
+
+http_requests = counter(
+    "passiogo_http_requests_total", "HTTP requests by route template and status.",
+    ("method", "route", "status"),
+)
+http_latency = histogram(
+    "passiogo_http_request_duration_seconds",
+    "Time from request to response headers, by route template.",
+    ("method", "route"),
+)
+upstream_requests = counter(
+    "passiogo_upstream_requests_total",
+    "GTFS-RT feed fetches by outcome (ok, not_modified, http_error, invalid, error, short_circuit).",
+    ("feed", "outcome"),
+)
+upstream_latency = histogram(
+    "passiogo_upstream_fetch_duration_seconds", "GTFS-RT feed fetch latency.", ("feed",),
+)
+stage_latency = histogram(
+    "passiogo_stage_duration_seconds",
+    "Time spent in internal hot-path stages (schedule_context, snapshot_build, "
+    "stop_index_build, adherence_table, vehicles_payload, vehicle_history, serialize, "
+    "stream_publish).",
+    ("stage",),
+)
+schedule_refreshes = counter(
+    "passiogo_schedule_day_builds_total", "Service days built (daily schedule refreshes).",
+)
+static_reloads = counter(
+    "passiogo_static_reloads_total", "Static GTFS hot reloads by outcome.", ("outcome",),
+)
+
+
+def _observation_cost():
+    """Mean seconds per Histogram.observe(), measured on a throwaway histogram."""
+    probe = Histogram("probe", "", ("stage",))
+    rounds = 2000
+    started = time.perf_counter()
+    for _ in range(rounds):
+        probe.observe(0.001, stage="probe")
+    return (time.perf_counter() - started) / rounds
+
+
+_overhead = {}
+
+
+def observation_cost_sec():
+    """Measured on the first scrape, then reported with every scrape."""
+    if "observe" not in _overhead:
+        _overhead["observe"] = _observation_cost()
+    return _overhead["observe"]
+
+
+gauge(
+    "passiogo_metrics_observe_cost_seconds",
+    "Measured cost of one histogram observation (instrumentation overhead).",
+    callback=observation_cost_sec,
+)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting requests and timing them up to the response
+    start.  Routes are labelled by their template (/api/stop/{stop_id}), so
+    the number of series stays bounded; a streamed response is timed until
+    its headers, not for the life of the stream.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        recorded = False
+
+        def record(status):
+            route = scope.get("route")
+            labels = {"method": scope["method"], "route": getattr(route, "path", "unmatched")}
+            http_latency.observe(time.perf_counter() - started, **labels)
+            http_requests.inc(status=status, **labels)
+
+        async def send_wrapper(message):
+            nonlocal recorded
+            if message["type"] == "http.response.start" and not recorded:
+                recorded = True
+                record(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            if not recorded:
+                record(500)
+            raise
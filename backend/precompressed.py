@@ -0,0 +1,85 @@
+import gzip
+import hashlib
+import json
+
+from fastapi import Response
+
+from metrics import stage_latency
+
+try:
+    import brotli   # optional: pip install brotli
+except ImportError:
+    brotli = None
+
+
+def brotli_available():
+    return brotli is not None
+
+
+class EncodedPayload:
+    """
+    A JSON payload serialised once, with its compressed variants.
+
+      identity / gzip / br – response bodies (br is None without brotli)
+      etag                 – strong validator of the JSON content
+    """
+    __slots__ = ("identity", "gzip", "br", "etag")
+
+    def __init__(self, payload):
+        with stage_latency.time(stage="serialize"):
+            self.identity = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            self.gzip = gzip.compress(self.identity, compresslevel=9, mtime=0)
+            self.br = brotli.compress(self.identity, quality=11) if brotli is not None else None
+        self.etag = hashlib.sha256(self.identity).hexdigest()[:32]
+
+    def etag_for(self, encoding):
+        # Each content-coding is its own representation, so its own strong ETag
+        return f'"{self.etag}"' if encoding == "identity" else f'"{self.etag}-{encoding}"'
+
+
+def _accepted_encodings(accept_encoding):
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        name, _, q = params.strip().partition("=")
+        try:
+            weight = float(q) if name.strip().lower() == "q" else 1.0
+        except ValueError:
+            weight = 1.0
+        if coding and weight > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def precompressed_response(encoded, accept_encoding=None, if_none_match=None):
+    """
+    Response for an EncodedPayload: 304 when If-None-Match names any of its
+    variants, otherwise the smallest body the client accepts (br > gzip >
+    identity).  Clients always revalidate, so a reload is seen at once.
+    """
+    accepted = _accepted_encodings(accept_encoding)
+    if encoded.br is not None and ("br" in accepted or "*" in accepted):
+        encoding, body = "br", encoded.br
+    elif "gzip" in accepted or "*" in accepted:
+        encoding, body = "gzip", encoded.gzip
+    else:
+        encoding, body = "identity", encoded.identity
+
+    headers = {
+        "ETag": encoded.etag_for(encoding),
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+    }
+
+    if if_none_match:
+        candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        known = {encoded.etag_for(e) for e in ("identity", "gzip", "br")}
+        matched = candidates & known
+        if "*" in candidates or matched:
+            if matched:
+                headers["ETag"] = sorted(matched)[0]
+            return Response(status_code=304, headers=headers)
+
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -1,65 +1,384 @@
-import requests
+import os
+import threading
 import time
-from datetime import datetime, timedelta
-import pandas as pd
+from dataclasses import dataclass
+from datetime import datetime
+import clock
+from feed_tables import (
+    StopArrivals, TripUpdates, VehiclePositions, decode_trip_updates, decode_vehicle_positions
+)
+from gtfs_data import fmt_time, gtfs_time_to_seconds, service_time_to_datetime
+from metrics import gauge, stage_latency
+from upstream import get_client, close_client
+
+# realtime URLs (override to point at a local stand-in); either the JSON or
+# the binary protobuf rendering of the feeds works
+REALTIME_URL = os.environ.get(
+    "REALTIME_URL", "https://passio3.com/harvard/passioTransit/gtfs/realtime/tripUpdates.json"
+)
+VEHICLE_POSITIONS_URL = os.environ.get(
+    "VEHICLE_POSITIONS_URL", "https://passio3.com/harvard/passioTransit/gtfs/realtime/vehiclePositions.json"
+)
+
+
+def _feed_payload(result, what):
+    if result.payload is None:
+        print(f"Failed to fetch {what}: {result.error}")
+    return result.payload
+
+
+async def fetch_feeds_async():
+    """
+    Fetches tripUpdates and vehiclePositions concurrently over the pooled
+    upstream client.  Returns (TripUpdates, VehiclePositions); either is
+    None on failure.  A 304 returns the previously decoded table object.
+    """
+    trip_result, vehicle_result = await get_client().fetch_many([
+        (REALTIME_URL, decode_trip_updates),
+        (VEHICLE_POSITIONS_URL, decode_vehicle_positions),
+    ])
+    return (
+        _feed_payload(trip_result, "realtime data"),
+        _feed_payload(vehicle_result, "vehicle positions"),
+    )
+
+
+def fetch_feeds():
+    """Blocking wrapper around fetch_feeds_async for threads without a loop."""
+    client = get_client()
+    return client.run(fetch_feeds_async())
 
-# realtime URL
-REALTIME_URL = "https://passio3.com/harvard/passioTransit/gtfs/realtime/tripUpdates.json"
-VEHICLE_POSITIONS_URL = "https://passio3.com/harvard/passioTransit/gtfs/realtime/vehiclePositions.json"
 
 def fetch_realtime_updates():
     """
-    Fetches the latest GTFS Realtime JSON feed.
-    Returns: Parsed JSON content or None on failure.
+    Fetches the latest GTFS Realtime trip updates (JSON or protobuf).
+    Returns: a feed_tables.TripUpdates, or None on failure.
     """
-    try:
-        response = requests.get(REALTIME_URL)
-        if response.status_code == 200:
-            return response.json()
-        print(f"Failed to fetch realtime data: {response.status_code}")
-        return None
-    except Exception as e:
-        print(f"Error fetching realtime data: {e}")
-        return None
+    client = get_client()
+    return _feed_payload(
+        client.run(client.fetch_feed(REALTIME_URL, decode_trip_updates)), "realtime data"
+    )
 
 
 def fetch_vehicle_positions():
     """
-    Fetches the latest GTFS Realtime Vehicle Positions JSON feed.
-    Returns: Parsed JSON content or None on failure.
+    Fetches the latest GTFS Realtime Vehicle Positions (JSON or protobuf).
+    Returns: a feed_tables.VehiclePositions, or None on failure.
     """
-    try:
-        response = requests.get(VEHICLE_POSITIONS_URL)
-        if response.status_code == 200:
-            return response.json()
-        print(f"Failed to fetch vehicle positions: {response.status_code}")
-        return None
-    except Exception as e:
-        print(f"Error fetching vehicle positions: {e}")
-        return None
+    client = get_client()
+    return _feed_payload(
+        client.run(client.fetch_feed(VEHICLE_POSITIONS_URL, decode_vehicle_positions)),
+        "vehicle positions",
+    )
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Shared realtime snapshot
+# ─────────────────────────────────────────────────────────────────────────────
+
+# Seconds between background fetches of both feeds.
+POLL_INTERVAL_SEC = float(os.environ.get("REALTIME_POLL_INTERVAL_SEC", "5"))
+# A feed whose last good payload is older than this is refused (503) rather
+# than served; until then the last good payload is served with its age.
+MAX_STALE_SEC = float(os.environ.get("REALTIME_MAX_STALE_SEC", "300"))
+
+
+@dataclass(frozen=True)
+class RealtimeSnapshot:
+    """
+    One immutable view of both GTFS-RT feeds, shared by every request.
+
+      version              – increases by one each time a snapshot is published
+      fetched_at           – time.time() when the fetch completed
+      trip_updates         – last good tripUpdates feed (feed_tables.TripUpdates),
+                             or None if there never was one
+      vehicle_positions    – last good vehiclePositions feed (VehiclePositions), or None
+      stop_arrivals        – feed_tables.StopArrivals, built once from trip_updates
+                             (see build_stop_arrivals_index)
+      route_resolver       – the resolver stop_arrivals was built with
+      trip_updates_at      – time.time() when trip_updates was fetched
+      vehicle_positions_at – same for vehicle_positions; either lags fetched_at
+                             after a failed fetch of that feed
+
+    Payloads are treated as read-only once published.
+    """
+    version: int
+    fetched_at: float
+    trip_updates: TripUpdates = None
+    vehicle_positions: VehiclePositions = None
+    stop_arrivals: StopArrivals = None
+    route_resolver: object = None
+    trip_updates_at: float = None
+    vehicle_positions_at: float = None
+
+    @property
+    def age_sec(self):
+        return time.time() - self.fetched_at
+
+    def feed_age_sec(self, feed):
+        """Seconds since `feed` ("trip_updates" / "vehicle_positions") was last fetched, None if never."""
+        fetched_at = getattr(self, f"{feed}_at")
+        return None if fetched_at is None else time.time() - fetched_at
+
+    def is_fresh(self, feed, max_stale_sec=None):
+        """True when `feed` has a payload no older than `max_stale_sec` (default MAX_STALE_SEC)."""
+        age = self.feed_age_sec(feed)
+        return age is not None and age <= (MAX_STALE_SEC if max_stale_sec is None else max_stale_sec)
+
+
+_snapshot = None                     # latest published RealtimeSnapshot
+_resolve_route = None                # trip_id -> route_id (see set_route_resolver)
+_listeners = []                      # called with each newly published snapshot
+_snapshot_source = None              # replaces the upstream fetch (see set_snapshot_source)
+_fetch_lock = threading.Lock()       # serialises upstream fetches (single flight)
+_revalidating = threading.Event()    # set while a background refresh runs
+_poller_thread = None
+_poller_stop = threading.Event()
+
+
+def build_stop_arrivals_index(trip_updates, resolve_route=None):
+    """
+    Inverts a TripUpdates table into StopArrivals (rows grouped by stop),
+    keeping the first stop_time_update per trip and stop when it has a
+    predicted arrival.  route_id comes from `resolve_route(trip_id)` (static
+    data) when given, else "".  Built once per feed so a stop lookup is one
+    row range.
+    """
+    if trip_updates is None:
+        return StopArrivals.empty()
+    return trip_updates.stop_arrivals(resolve_route)
+
+
+def set_route_resolver(resolve_route):
+    """
+    Set the `trip_id -> route_id` lookup used to index trip updates.  The
+    next snapshot rebuilds its stop index even if the feed is unchanged.
+    """
+    global _resolve_route
+    _resolve_route = resolve_route
+
+
+def add_snapshot_listener(callback):
+    """Register `callback(snapshot)`, run on the publishing thread after each fetch."""
+    _listeners.append(callback)
+
+
+def _notify_listeners(snapshot):
+    for callback in list(_listeners):
+        try:
+            callback(snapshot)
+        except Exception as e:
+            print(f"[WARN] snapshot listener {getattr(callback, '__name__', callback)} failed: {e}", flush=True)
 
-def parse_time(time_str):
+
+def set_snapshot_source(source):
+    """
+    Make refresh_snapshot() return `source()` instead of fetching upstream;
+    multi-worker followers read the snapshot the leader published this way
+    (see shared_state.py).  None restores fetching.
+    """
+    global _snapshot_source
+    _snapshot_source = source
+
+
+def adopt_snapshot(version, fetched_at, trip_updates, vehicle_positions, stop_arrivals,
+                   trip_updates_at=None, vehicle_positions_at=None):
+    """
+    Publish a snapshot built by another process, keeping its version, and
+    notify listeners as if it had been fetched here.
+    """
+    global _snapshot
+    snapshot = _snapshot = RealtimeSnapshot(
+        version=version,
+        fetched_at=fetched_at,
+        trip_updates=trip_updates,
+        vehicle_positions=vehicle_positions,
+        stop_arrivals=stop_arrivals,
+        route_resolver=_resolve_route,
+        trip_updates_at=trip_updates_at,
+        vehicle_positions_at=vehicle_positions_at,
+    )
+    _notify_listeners(snapshot)
+    return snapshot
+
+
+def current_snapshot():
+    """Return the latest published snapshot (None before the first fetch)."""
+    return _snapshot
+
+
+def refresh_snapshot():
     """
-    Parses GTFS time string "HH:MM:SS" into a datetime object for today.
-    Handles times > 24:00:00 (e.g. 25:30:00 is 1:30 AM tomorrow).
+    Fetch both feeds and publish a new snapshot.  A feed whose fetch failed
+    keeps its last good payload (and that payload's fetch time).
+
+    Single flight: if another thread is already fetching, wait for it and
+    return the snapshot it published instead of starting a second fetch.
     """
-    if not time_str:
+    global _snapshot
+    source = _snapshot_source
+    if source is not None:
+        return source()
+
+    seen = _snapshot
+    with _fetch_lock:
+        if _snapshot is not seen:
+            return _snapshot
+        started = time.perf_counter()
+        trip_updates, vehicle_positions = fetch_feeds()
+        fetched_at = time.time()
+        trip_updates_at = vehicle_positions_at = fetched_at
+        if _snapshot is not None:
+            if trip_updates is None:
+                trip_updates, trip_updates_at = _snapshot.trip_updates, _snapshot.trip_updates_at
+            if vehicle_positions is None:
+                vehicle_positions, vehicle_positions_at = (
+                    _snapshot.vehicle_positions, _snapshot.vehicle_positions_at
+                )
+        if trip_updates is None:
+            trip_updates_at = None
+        if vehicle_positions is None:
+            vehicle_positions_at = None
+
+        # An unchanged (304) trip-updates payload keeps its existing index
+        resolve_route = _resolve_route
+        if (
+            _snapshot is not None
+            and trip_updates is not None
+            and trip_updates is _snapshot.trip_updates
+            and resolve_route is _snapshot.route_resolver
+        ):
+            stop_arrivals = _snapshot.stop_arrivals
+        else:
+            with stage_latency.time(stage="stop_index_build"):
+                stop_arrivals = build_stop_arrivals_index(trip_updates, resolve_route)
+
+        version = _snapshot.version + 1 if _snapshot else 1
+        snapshot = _snapshot = RealtimeSnapshot(
+            version=version,
+            fetched_at=fetched_at,
+            trip_updates=trip_updates,
+            vehicle_positions=vehicle_positions,
+            stop_arrivals=stop_arrivals,
+            route_resolver=resolve_route,
+            trip_updates_at=trip_updates_at,
+            vehicle_positions_at=vehicle_positions_at,
+        )
+        stage_latency.observe(time.perf_counter() - started, stage="snapshot_build")
+
+    _notify_listeners(snapshot)
+    return snapshot
+
+
+def _revalidate_in_background():
+    """Start one background refresh_snapshot unless one is already running."""
+    if _revalidating.is_set():
+        return
+    _revalidating.set()
+
+    def run():
+        try:
+            refresh_snapshot()
+        except Exception as e:
+            print(f"[WARN] background realtime refresh failed: {e}", flush=True)
+        finally:
+            _revalidating.clear()
+
+    threading.Thread(target=run, name="realtime-revalidate", daemon=True).start()
+
+
+def get_snapshot(max_age_sec=None):
+    """
+    Return the latest snapshot without waiting on the upstream.
+
+    Stale-while-revalidate: a snapshot older than `max_age_sec` (defaults to
+    twice the poll interval) is still returned, and a background refresh
+    is started.  Only the very first caller, with nothing to serve yet,
+    waits for a fetch.  Whether the payloads are too old to use is the
+    caller's decision (see RealtimeSnapshot.is_fresh).
+    """
+    if max_age_sec is None:
+        max_age_sec = 2 * POLL_INTERVAL_SEC
+    snap = _snapshot
+    if snap is None:
+        return refresh_snapshot()
+    if snap.age_sec > max_age_sec:
+        _revalidate_in_background()
+    return snap
+
+
+gauge(
+    "passiogo_realtime_snapshot_age_seconds", "Age of the published realtime snapshot.",
+    callback=lambda: _snapshot.age_sec if _snapshot else None,
+)
+gauge(
+    "passiogo_realtime_snapshot_version", "Version of the published realtime snapshot.",
+    callback=lambda: _snapshot.version if _snapshot else None,
+)
+gauge(
+    "passiogo_realtime_feed_age_seconds",
+    "Age of the feed's last good payload in the published snapshot.",
+    ("feed",),
+    callback=lambda: {
+        ("tripUpdates",): _snapshot.feed_age_sec("trip_updates"),
+        ("vehiclePositions",): _snapshot.feed_age_sec("vehicle_positions"),
+    } if _snapshot else None,
+)
+gauge(
+    "passiogo_realtime_feed_available",
+    "1 when the feed's last good payload is recent enough to serve (REALTIME_MAX_STALE_SEC), else 0.",
+    ("feed",),
+    callback=lambda: {
+        ("tripUpdates",): int(_snapshot.is_fresh("trip_updates")),
+        ("vehiclePositions",): int(_snapshot.is_fresh("vehicle_positions")),
+    } if _snapshot else None,
+)
+
+
+def _poll_loop(interval_sec):
+    while not _poller_stop.is_set():
+        started = time.monotonic()
+        try:
+            refresh_snapshot()
+        except Exception as e:
+            print(f"[WARN] realtime poll failed: {e}", flush=True)
+        _poller_stop.wait(max(0.0, interval_sec - (time.monotonic() - started)))
+
+
+def start_poller(interval_sec=None):
+    """Start the background thread that refreshes the snapshot every interval."""
+    global _poller_thread
+    if _poller_thread is not None and _poller_thread.is_alive():
+        return
+    interval_sec = POLL_INTERVAL_SEC if interval_sec is None else interval_sec
+    _poller_stop.clear()
+    _poller_thread = threading.Thread(
+        target=_poll_loop, args=(interval_sec,), name="realtime-poller", daemon=True
+    )
+    _poller_thread.start()
+    print(f"[INFO] realtime poller started (every {interval_sec:g}s)", flush=True)
+
+
+def stop_poller():
+    global _poller_thread
+    _poller_stop.set()
+    if _poller_thread is not None:
+        _poller_thread.join(timeout=5)
+    _poller_thread = None
+    close_client()
+
+
+def parse_time(scheduled_sec, service_date=None):
+    """
+    Converts a scheduled time in seconds since service-day start (the
+    `arrival_sec` column) to a datetime on `service_date` (defaults to today).
+    Times >= 24:00:00 land on the following day.
+    """
+    if scheduled_sec is None:
         return None
-    
-    parts = time_str.split(':')
-    hours = int(parts[0])
-    minutes = int(parts[1])
-    seconds = int(parts[2])
-    
-    now = datetime.now()
-    # base calculation
-    day_offset = 0
-    if hours >= 24:
-        hours -= 24
-        day_offset = 1
-        
-    dt = now.replace(hour=hours, minute=minutes, second=seconds, microsecond=0) + timedelta(days=day_offset)
-    return dt
+    if service_date is None:
+        service_date = clock.today()
+    return service_time_to_datetime(service_date, scheduled_sec)
 
 def determine_status_color(delta_seconds):
     """
@@ -78,12 +397,13 @@ def determine_status_color(delta_seconds):
     else: # delta > 300
         return "Very Late", "Red"
 
-def process_trip_update(entity_update, scheduled_time_str):
+def process_trip_update(entity_update, scheduled_sec):
     """
-    Processes a single trip update against the scheduled time.
+    Processes a single trip update against the scheduled time
+    (seconds since service-day start).
     Returns: dict with status details
     """
-    if not scheduled_time_str:
+    if scheduled_sec is None:
         return None
     
     # extract prediction time (Unix timestamp)
@@ -111,7 +431,7 @@ def process_trip_update(entity_update, scheduled_time_str):
         return None
 
     eta_dt = datetime.fromtimestamp(predicted_unix)
-    scheduled_dt = parse_time(scheduled_time_str)
+    scheduled_dt = parse_time(scheduled_sec)
     
     if not scheduled_dt:
         return None
@@ -130,7 +450,7 @@ def process_trip_update(entity_update, scheduled_time_str):
         "trip_id": entity_update.get('trip_update', {}).get('trip', {}).get('trip_id'),
         "stop_id": stop_id,
         "vehicle_label": vehicle_label,
-        "scheduled": scheduled_time_str,
+        "scheduled": fmt_time(scheduled_sec),
         "eta": eta_dt.strftime("%H:%M:%S"),
         "delta_sec": delta,
         "status": status,
@@ -139,9 +459,20 @@ def process_trip_update(entity_update, scheduled_time_str):
 
 if __name__ == "__main__":
     updates = fetch_realtime_updates()
-    if updates and 'entity' in updates:
-        print(f"Fetched {len(updates['entity'])} entities.")
+    if updates is not None and len(updates):
+        print(f"Fetched {len(updates)} trip updates.")
+        # first trip update, back in the entity layout process_trip_update reads
+        start, end = updates.starts[:2].tolist()
+        entity = {"trip_update": {
+            "trip": {"trip_id": str(updates.trip_ids[0])},
+            "vehicle": {"label": str(updates.vehicle_labels[0])},
+            "stop_time_update": [
+                {"stop_id": stop_id, "arrival": {"time": ts}}
+                for stop_id, ts in zip(updates.stop_ids[start:end].tolist(), updates.arrival_ts[start:end].tolist())
+                if ts
+            ],
+        }}
         # test logic with dummy scheduled time
-        dummy_sched = "22:30:00" # arbitrary
-        result = process_trip_update(updates['entity'][0], dummy_sched)
+        dummy_sched = gtfs_time_to_seconds("22:30:00") # arbitrary
+        result = process_trip_update(entity, dummy_sched)
         print("Sample processing:", result)
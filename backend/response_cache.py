@@ -0,0 +1,78 @@
+import os
+import threading
+from collections import OrderedDict
+
+from metrics import counter, gauge
+
+# Most responses kept at once (all endpoints together).
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "2048"))
+
+_lookups = counter(
+    "passiogo_response_cache_lookups_total", "Response cache lookups by endpoint and result (hit, miss).",
+    ("endpoint", "result"),
+)
+_evictions = counter("passiogo_response_cache_evictions_total", "Responses evicted from the LRU cache.")
+
+
+class ResponseCache:
+    """
+    Bounded LRU of computed responses.
+
+    Keys are (endpoint, params, realtime snapshot version, static bundle
+    version), so an entry is only ever served for the data it was computed
+    from: a new snapshot or bundle simply misses, and entries for old
+    versions age out of the LRU.  Cached responses are shared between
+    requests and must not be mutated.
+    """
+
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_or_compute(self, endpoint, params, snapshot, bundle, compute):
+        """Cached response for the key, else `compute()` stored under it."""
+        key = (endpoint, params, snapshot.version, bundle.version)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                response = self._entries[key]
+                _lookups.inc(endpoint=endpoint, result="hit")
+                return response
+
+        _lookups.inc(endpoint=endpoint, result="miss")
+        response = compute()
+        with self._lock:
+            self._entries[key] = response
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                _evictions.inc()
+        return response
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def hit_ratios(self):
+        """{(endpoint,): hits / lookups} for every endpoint seen so far."""
+        totals = {}
+        for (endpoint, result), n in _lookups.values().items():
+            hits, lookups = totals.get(endpoint, (0, 0))
+            totals[endpoint] = (hits + (n if result == "hit" else 0), lookups + n)
+        return {(endpoint,): hits / lookups for endpoint, (hits, lookups) in totals.items() if lookups}
+
+
+response_cache = ResponseCache()
+
+gauge(
+    "passiogo_response_cache_entries", "Responses currently held in the LRU cache.",
+    callback=lambda: len(response_cache),
+)
+gauge(
+    "passiogo_response_cache_hit_ratio", "Share of response cache lookups served from the cache.",
+    ("endpoint",), callback=response_cache.hit_ratios,
+)
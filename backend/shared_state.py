@@ -0,0 +1,510 @@
+import dataclasses
+import json
+import os
+import pickle
+import shutil
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl                     # leader election; POSIX only
+except ImportError:
+    fcntl = None
+
+import realtime
+import static_bundle
+from feed_tables import StopArrivals, TripUpdates, VehiclePositions
+from gtfs_data import (
+    FlatScheduleIndex, TripRouteMap, TripServiceMap, TripTable, build_service_calendar
+)
+from metrics import gauge
+
+# Multi-worker mode.  With PASSIOGO_SHARED_DIR set (ideally on tmpfs, e.g.
+# /dev/shm/passiogo) every `uvicorn main:app --workers N` process joins one
+# group: the worker holding the leader lock loads the static feed, builds the
+# service days, polls the upstream feeds and publishes all of it into the
+# directory as .npy arrays; the others map those arrays read-only.  Pickle is
+# only used for the small non-array parts (route infos, calendars, stops,
+# shapes).
+SHARED_DIR = os.environ.get("PASSIOGO_SHARED_DIR")
+# Seconds between a follower's checks for a new snapshot, bundle or vacant lock.
+SHARED_POLL_SEC = float(os.environ.get("PASSIOGO_SHARED_POLL_SEC", "0.25"))
+# How long a follower waits for the leader to publish a day it prepares ahead
+# before building its own copy.
+SHARED_DAY_WAIT_SEC = float(os.environ.get("PASSIOGO_SHARED_DAY_WAIT_SEC", "60"))
+
+_role = None                        # None (single process), "leader" or "follower"
+_lock_file = None                   # held open for the life of the process
+_watcher = None
+_stop = threading.Event()
+_seen_snapshot = None               # stat signature of the last adopted snapshot.json
+_followed_parts = {}                # part -> (dir name, mapped table), followers
+_published_parts = {}               # part -> (table, dir name), leader
+_published_pointer = None           # the last snapshot.json the leader wrote
+_follow_lock = threading.Lock()
+
+
+def role():
+    return _role
+
+
+def _path(*parts):
+    return os.path.join(SHARED_DIR, *parts)
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)       # readers never see a partial file
+
+
+def _mapped(directory, name):
+    return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r").view(np.ndarray)
+
+
+def _write_table(directory, table):
+    """
+    A frozen dataclass of arrays (TripTable, TripUpdates, ...): one .npy
+    file per array field, object string columns stored as fixed-width str
+    so they can be mapped; the other fields are pickled into fields.pickle.
+    """
+    os.makedirs(directory)
+    fields = {}
+    for field in dataclasses.fields(table):
+        value = getattr(table, field.name)
+        if not isinstance(value, np.ndarray):
+            fields[field.name] = value
+            continue
+        if value.dtype == object:
+            value = value.astype(str)
+        np.save(os.path.join(directory, f"{field.name}.npy"), value)
+    with open(os.path.join(directory, "fields.pickle"), "wb") as f:
+        pickle.dump(fields, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _read_table(cls, directory):
+    """The `cls` table _write_table wrote, its arrays backed by read-only maps."""
+    with open(os.path.join(directory, "fields.pickle"), "rb") as f:
+        fields = pickle.load(f)
+    for field in dataclasses.fields(cls):
+        if field.name not in fields:
+            fields[field.name] = _mapped(directory, field.name)
+    return cls(**fields)
+
+
+def _publish_dir(directory, write):
+    """Run `write(tmp_dir)` and rename the result to `directory` in one step."""
+    tmp_dir = f"{directory}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    try:
+        write(tmp_dir)
+        os.replace(tmp_dir, directory)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Static feed as memory-mapped arrays
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _write_feed(feed, directory):
+    """
+    Schedule columns go to one .npy file each (categorical codes for
+    categoricals) and the trip table to trips/, so they can be mapped
+    without a copy; everything else is pickled into meta.pickle, written
+    last as the completion marker.
+    """
+    os.makedirs(directory)
+    schedule = feed["schedule_df"]
+    columns = []
+    for name in schedule.columns:
+        column = schedule[name]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            np.save(os.path.join(directory, f"{name}.npy"), column.array.codes)
+            columns.append((name, column.cat.categories))
+        else:
+            np.save(os.path.join(directory, f"{name}.npy"), column.to_numpy())
+            columns.append((name, None))
+
+    calendar = build_service_calendar(feed["calendar_df"], feed["calendar_dates_df"])
+    np.save(
+        os.path.join(directory, "row_service_idx.npy"),
+        static_bundle.row_service_index(calendar, schedule, feed["trip_service_map"].trips),
+    )
+
+    _write_table(os.path.join(directory, "trips"), feed["trip_route_map"].trips)
+
+    shared = ("schedule_df", "row_service_idx", "trip_route_map", "trip_service_map")
+    meta = {k: v for k, v in feed.items() if k not in shared}
+    meta["schedule_columns"] = columns
+    with open(os.path.join(directory, "meta.pickle"), "wb") as f:
+        pickle.dump(meta, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _read_feed(directory):
+    """The feed dict of _write_feed, its schedule and trip table backed by read-only maps."""
+    with open(os.path.join(directory, "meta.pickle"), "rb") as f:
+        feed = pickle.load(f)
+
+    data = {}
+    for name, categories in feed.pop("schedule_columns"):
+        values = _mapped(directory, name)
+        if categories is not None:
+            values = pd.Categorical.from_codes(
+                values, dtype=pd.CategoricalDtype(categories), validate=False
+            )
+        data[name] = values
+    feed["schedule_df"] = pd.DataFrame(data, copy=False)
+    feed["row_service_idx"] = _mapped(directory, "row_service_idx")
+    trips = _read_table(TripTable, os.path.join(directory, "trips"))
+    feed["trip_route_map"] = TripRouteMap(trips)
+    feed["trip_service_map"] = TripServiceMap(trips)
+    return feed
+
+
+def _static_name(content_hash):
+    return f"static-{content_hash[:16]}"
+
+
+def publish_feed(feed, version, source):
+    """
+    static_bundle feed publisher (leader only): writes `feed` into the shared
+    directory and returns the mapped copy so the leader serves from the same
+    pages as everyone else.  Followers are pointed at it once the bundle
+    (and so its first days) is live, see _point_followers.
+    """
+    if _role != "leader":
+        return feed
+    directory = _path(_static_name(feed["content_hash"]))
+    if not os.path.exists(os.path.join(directory, "meta.pickle")):
+        shutil.rmtree(directory, ignore_errors=True)
+        _publish_dir(directory, lambda tmp_dir: _write_feed(feed, tmp_dir))
+        print(f"[INFO] published static feed {feed['content_hash'][:12]} to {directory}", flush=True)
+    return _read_feed(directory)
+
+
+def _point_followers(bundle):
+    """Swap listener (leader only): point followers at the bundle that just went live."""
+    if _role != "leader":
+        return
+    name = _static_name(bundle.content_hash)
+    pointer = {
+        "version": bundle.version, "content_hash": bundle.content_hash, "dir": name, "source": bundle.source,
+    }
+    _write_atomic(_path("static.json"), json.dumps(pointer).encode())
+
+    # Older generations; workers still mapping them keep their pages until they swap
+    for entry in os.listdir(SHARED_DIR):
+        if entry.startswith("static-") and entry != name:
+            shutil.rmtree(_path(entry), ignore_errors=True)
+
+
+def _read_pointer():
+    try:
+        with open(_path("static.json"), "rb") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _attach_static(pointer):
+    """Build the bundle the leader published under `pointer` and swap it in."""
+    feed = _read_feed(_path(pointer["dir"]))
+    bundle = static_bundle.bundle_from_feed(feed, pointer["version"], pointer["source"])
+    static_bundle.swap_bundle(bundle)
+
+
+def _follow_static():
+    pointer = _read_pointer()
+    bundle = static_bundle.current_bundle()
+    if pointer and (
+        bundle is None
+        or (pointer["version"], pointer["content_hash"]) != (bundle.version, bundle.content_hash)
+    ):
+        _attach_static(pointer)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Service days
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _day_dir(bundle, date):
+    return _path(_static_name(bundle.content_hash), f"day-{date.isoformat()}")
+
+
+def _write_day(day, directory):
+    row_mask, index = day
+    _write_table(directory, index)
+    np.save(os.path.join(directory, "row_mask.npy"), row_mask)
+
+
+def _read_day(directory):
+    return _mapped(directory, "row_mask"), _read_table(FlatScheduleIndex, directory)
+
+
+def _shared_day(bundle, date, build, background):
+    """
+    static_bundle day builder: the leader builds each service day once and
+    publishes it next to the static feed; followers map it.  A follower
+    waits up to SHARED_DAY_WAIT_SEC for a day it prepares ahead, and builds
+    its own copy of a day it needs now that is not published yet.
+    """
+    directory = _day_dir(bundle, date)
+    if _role == "leader":
+        if not os.path.isdir(directory):
+            day = build()
+            try:
+                _publish_dir(directory, lambda tmp_dir: _write_day(day, tmp_dir))
+            except OSError as e:
+                print(f"[WARN] could not publish the {date} schedule: {e}", flush=True)
+                return day
+            # days that can no longer be asked for (see StaticBundle.prepare_day)
+            for entry in os.listdir(os.path.dirname(directory)):
+                if entry.startswith("day-") and entry[4:] < (date - timedelta(days=1)).isoformat():
+                    shutil.rmtree(os.path.join(os.path.dirname(directory), entry), ignore_errors=True)
+        return _read_day(directory)
+
+    deadline = time.monotonic() + (SHARED_DAY_WAIT_SEC if background else 0)
+    while True:
+        if os.path.isdir(directory):
+            try:
+                return _read_day(directory)
+            except OSError:
+                pass                          # removed under us; build our own
+        if time.monotonic() >= deadline or _stop.wait(SHARED_POLL_SEC):
+            break
+    print(f"[INFO] the {date} schedule is not published yet; building a private copy", flush=True)
+    return build()
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Realtime snapshot
+# ─────────────────────────────────────────────────────────────────────────────
+
+_SNAPSHOT_PARTS = {
+    "trip_updates": TripUpdates,
+    "vehicle_positions": VehiclePositions,
+    "stop_arrivals": StopArrivals,
+}
+
+
+def _publish_snapshot(snapshot):
+    """
+    Snapshot listener: the leader writes every new snapshot for the
+    followers, each feed table as its own directory of arrays under
+    realtime/ (a table carried over from the previous snapshot keeps its
+    directory), then points snapshot.json at them.
+    """
+    global _published_pointer
+    if _role != "leader":
+        return
+    os.makedirs(_path("realtime"), exist_ok=True)
+    parts = {}
+    for part in _SNAPSHOT_PARTS:
+        table = getattr(snapshot, part)
+        published = _published_parts.get(part)
+        if table is None:
+            parts[part] = None
+        elif published is not None and published[0] is table:
+            parts[part] = published[1]
+        else:
+            name = f"{part}-{snapshot.version}"
+            _publish_dir(_path("realtime", name), lambda tmp_dir: _write_table(tmp_dir, table))
+            _published_parts[part] = (table, name)
+            parts[part] = name
+
+    pointer = {
+        "version": snapshot.version,
+        "fetched_at": snapshot.fetched_at,
+        "trip_updates_at": snapshot.trip_updates_at,
+        "vehicle_positions_at": snapshot.vehicle_positions_at,
+        "parts": parts,
+    }
+    _write_atomic(_path("snapshot.json"), json.dumps(pointer).encode())
+
+    # A follower may still be reading the previous snapshot; older ones go
+    keep = set(parts.values()) | set((_published_pointer or {}).get("parts", {}).values())
+    _published_pointer = pointer
+    for entry in os.listdir(_path("realtime")):
+        if entry not in keep:
+            shutil.rmtree(_path("realtime", entry), ignore_errors=True)
+
+
+def _follow_snapshot():
+    """Adopt the leader's snapshot if snapshot.json changed since the last look."""
+    global _seen_snapshot, _followed_parts
+    try:
+        stat = os.stat(_path("snapshot.json"))
+    except OSError:
+        return
+    signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    if signature == _seen_snapshot:
+        return
+    with _follow_lock:
+        if signature == _seen_snapshot:
+            return
+        try:
+            with open(_path("snapshot.json"), "rb") as f:
+                pointer = json.load(f)
+            followed = {}
+            for part, cls in _SNAPSHOT_PARTS.items():
+                name = pointer["parts"][part]
+                if name is not None:
+                    mapped = _followed_parts.get(part)
+                    if mapped is None or mapped[0] != name:
+                        mapped = (name, _read_table(cls, _path("realtime", name)))
+                    followed[part] = mapped
+        except (OSError, ValueError):
+            return                            # replaced while reading; next poll
+        _seen_snapshot = signature
+        _followed_parts = followed
+        current = realtime.current_snapshot()
+        if current is None or pointer["version"] > current.version:
+            tables = {part: followed[part][1] if part in followed else None for part in _SNAPSHOT_PARTS}
+            realtime.adopt_snapshot(
+                pointer["version"], pointer["fetched_at"], **tables,
+                trip_updates_at=pointer["trip_updates_at"],
+                vehicle_positions_at=pointer["vehicle_positions_at"],
+            )
+
+
+def _shared_snapshot():
+    """refresh_snapshot() for followers: the leader's latest, never an upstream fetch."""
+    _follow_snapshot()
+    snapshot = realtime.current_snapshot()
+    if snapshot is None:
+        # nothing published yet: answer like a failed fetch
+        snapshot = realtime.adopt_snapshot(0, time.time(), None, None, None)
+    return snapshot
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Roles
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _try_lock():
+    try:
+        fcntl.flock(_lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def _lead():
+    """Take over loading and polling (at startup, or when the leader went away)."""
+    global _role
+    promoted = _role == "follower"
+    _role = "leader"
+    realtime.set_snapshot_source(None)
+    if static_bundle.current_bundle() is None:
+        if realtime.current_snapshot() is None:
+            # left over from an earlier run
+            try:
+                os.remove(_path("snapshot.json"))
+            except OSError:
+                pass
+            shutil.rmtree(_path("realtime"), ignore_errors=True)
+        static_bundle.swap_bundle(static_bundle.load_bundle())
+    realtime.start_poller()
+    print(f"[INFO] worker {os.getpid()} is the {'new ' if promoted else ''}leader", flush=True)
+
+
+def _serve_reload_request():
+    """Run a static reload a follower was asked for (leader only)."""
+    path = _path("reload-request.json")
+    try:
+        with open(path, "rb") as f:
+            request = json.load(f)
+        os.remove(path)
+    except (OSError, ValueError):
+        return
+    static_bundle.reload_static_in_background(request.get("source"))
+
+
+def request_reload(source=None):
+    """Ask the leader to reload static data; followers then pick up the new bundle."""
+    _write_atomic(_path("reload-request.json"), json.dumps({"source": source}).encode())
+    return True
+
+
+def _watch():
+    while not _stop.wait(SHARED_POLL_SEC):
+        try:
+            if _role == "follower":
+                if _try_lock():
+                    _lead()
+                    continue
+                _follow_static()
+                _follow_snapshot()
+            else:
+                _serve_reload_request()
+        except Exception as e:
+            print(f"[WARN] shared state ({_role}): {e}", flush=True)
+
+
+def start():
+    """
+    Join the worker group in PASSIOGO_SHARED_DIR (called at startup).
+    Returns False in single-process mode, where the caller loads and polls
+    itself; otherwise the static bundle is live and, in the leader, the
+    poller is running when this returns.
+    """
+    global _role, _lock_file, _watcher
+    if not SHARED_DIR:
+        return False
+    if fcntl is None:
+        print("[WARN] PASSIOGO_SHARED_DIR needs fcntl; running single-process", flush=True)
+        return False
+
+    os.makedirs(SHARED_DIR, exist_ok=True)
+    _lock_file = open(_path("leader.lock"), "a+b")
+    static_bundle.set_feed_publisher(publish_feed)
+    static_bundle.set_day_builder(_shared_day)
+    static_bundle.add_swap_listener(_point_followers)
+    realtime.add_snapshot_listener(_publish_snapshot)
+
+    if _try_lock():
+        _lead()
+    else:
+        _role = "follower"
+        realtime.set_snapshot_source(_shared_snapshot)
+        print(f"[INFO] worker {os.getpid()} follows the leader in {SHARED_DIR}", flush=True)
+        while static_bundle.current_bundle() is None:
+            if _try_lock():
+                _lead()
+                break
+            try:
+                _follow_static()
+            except Exception as e:
+                print(f"[WARN] could not attach to shared static data yet: {e}", flush=True)
+            if static_bundle.current_bundle() is None:
+                time.sleep(SHARED_POLL_SEC)
+        _follow_snapshot()
+
+    _stop.clear()
+    _watcher = threading.Thread(target=_watch, name="shared-state", daemon=True)
+    _watcher.start()
+    return True
+
+
+gauge(
+    "passiogo_shared_leader", "1 in the multi-worker leader, 0 in followers (absent when single-process).",
+    callback=lambda: None if _role is None else int(_role == "leader"),
+)
+
+
+def stop():
+    """Stop watching and give up the leader lock, so another worker can take over."""
+    global _lock_file
+    _stop.set()
+    if _watcher is not None:
+        _watcher.join(timeout=5)
+    if _lock_file is not None:
+        _lock_file.close()
+        _lock_file = None
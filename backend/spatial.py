@@ -0,0 +1,143 @@
+import math
+
+import numpy as np
+
+# Grid cell edge; about a city block or two, so a viewport or a nearest-stop
+# search only touches a handful of cells.
+CELL_M = 250.0
+
+_EARTH_RADIUS_M = 6371008.8
+_M_PER_DEG_LAT = math.pi * _EARTH_RADIUS_M / 180.0
+
+
+def parse_bbox(value):
+    """
+    "west,south,east,north" (degrees, Leaflet's toBBoxString order) ->
+    (south, west, north, east).  Raises ValueError on malformed input.
+    """
+    parts = [float(p) for p in value.split(",")]
+    if len(parts) != 4:
+        raise ValueError("bbox must be west,south,east,north")
+    if not all(math.isfinite(p) for p in parts):
+        raise ValueError("bbox coordinates must be finite numbers")
+    west, south, east, north = parts
+    if south > north or west > east:
+        raise ValueError("bbox must be west,south,east,north with west <= east and south <= north")
+    return south, west, north, east
+
+
+class GridIndex:
+    """
+    Uniform lat/lon grid over a set of points (stops, or the vehicles of one
+    snapshot).  Points are sorted by cell once; a query then only looks at
+    the cells it overlaps, so its cost follows the size of the area asked
+    about rather than the number of points indexed.
+
+      within(south, west, north, east) – positions inside a bounding box
+      nearest(lat, lon, n)             – [(position, metres)] closest first
+    """
+
+    def __init__(self, lats, lons, cell_m=CELL_M):
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        n = len(self.lats)
+        lat0 = float(self.lats.mean()) if n else 0.0
+        self._cos_lat0 = max(math.cos(math.radians(lat0)), 1e-6)
+        self.cell_lat = cell_m / _M_PER_DEG_LAT
+        self.cell_lon = cell_m / (_M_PER_DEG_LAT * self._cos_lat0)
+
+        rows = np.floor(self.lats / self.cell_lat).astype(np.int64)
+        cols = np.floor(self.lons / self.cell_lon).astype(np.int64)
+        self._order = np.lexsort((cols, rows))
+        self._cells = {}
+        if n:
+            r, c = rows[self._order], cols[self._order]
+            breaks = np.flatnonzero((r[1:] != r[:-1]) | (c[1:] != c[:-1])) + 1
+            starts = np.concatenate([[0], breaks])
+            ends = np.concatenate([breaks, [n]])
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                self._cells[(int(r[start]), int(c[start]))] = (start, end)
+            self._row_range = (int(rows.min()), int(rows.max()))
+            self._col_range = (int(cols.min()), int(cols.max()))
+
+    def __len__(self):
+        return len(self.lats)
+
+    def _cell_of(self, lat, lon):
+        return math.floor(lat / self.cell_lat), math.floor(lon / self.cell_lon)
+
+    def _gather(self, cells):
+        chunks = [self._order[span[0]:span[1]] for span in map(self._cells.get, cells) if span]
+        return np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int64)
+
+    def within(self, south, west, north, east):
+        """Positions of the points inside the box, in index order."""
+        if not self._cells:
+            return np.empty(0, dtype=np.int64)
+        r0, c0 = self._cell_of(south, west)
+        r1, c1 = self._cell_of(north, east)
+        r0, r1 = max(r0, self._row_range[0]), min(r1, self._row_range[1])
+        c0, c1 = max(c0, self._col_range[0]), min(c1, self._col_range[1])
+        if r0 > r1 or c0 > c1:
+            return np.empty(0, dtype=np.int64)
+
+        if (r1 - r0 + 1) * (c1 - c0 + 1) > len(self._cells):
+            candidates = np.arange(len(self.lats))        # box covers most of the grid
+        else:
+            candidates = self._gather((r, c) for r in range(r0, r1 + 1) for c in range(c0, c1 + 1))
+        lats, lons = self.lats[candidates], self.lons[candidates]
+        inside = (lats >= south) & (lats <= north) & (lons >= west) & (lons <= east)
+        return np.sort(candidates[inside])
+
+    def _distances_m(self, positions, lat, lon):
+        dy = (self.lats[positions] - lat) * _M_PER_DEG_LAT
+        dx = (self.lons[positions] - lon) * _M_PER_DEG_LAT * self._cos_lat0
+        return np.hypot(dx, dy)
+
+    def nearest(self, lat, lon, n=5, max_distance_m=None):
+        """
+        Up to `n` (position, distance in metres) pairs, closest first.  Rings
+        of cells are searched outwards until the n-th best is closer than
+        any unsearched cell can be.  A query far from the data (or in a
+        sparse part of it) scans all points instead, once the rings would
+        visit more cells than the grid holds.
+        """
+        if not self._cells or n <= 0:
+            return []
+        row, col = self._cell_of(lat, lon)
+        cell_m = min(self.cell_lat * _M_PER_DEG_LAT, self.cell_lon * _M_PER_DEG_LAT * self._cos_lat0)
+        max_ring = max(
+            abs(row - self._row_range[0]), abs(row - self._row_range[1]),
+            abs(col - self._col_range[0]), abs(col - self._col_range[1]),
+        )
+        if max_distance_m is not None:
+            max_ring = min(max_ring, int(math.ceil(max_distance_m / cell_m)) + 1)
+
+        found = []
+        for ring in range(max_ring + 1):
+            if (2 * ring + 1) ** 2 > 4 * len(self._cells):
+                positions = np.arange(len(self.lats))
+                found = [(positions, self._distances_m(positions, lat, lon))]
+                break
+            if ring == 0:
+                cells = [(row, col)]
+            else:
+                cells = [(row + dr, col + dc) for dr in range(-ring, ring + 1) for dc in (-ring, ring)]
+                cells += [(row + dr, col + dc) for dr in (-ring, ring) for dc in range(-ring + 1, ring)]
+            positions = self._gather(cells)
+            if len(positions):
+                found.append((positions, self._distances_m(positions, lat, lon)))
+            # every point in rings beyond this one is at least ring * cell_m away
+            if found and sum(len(p) for p, _ in found) >= n:
+                best = np.sort(np.concatenate([d for _, d in found]))[n - 1]
+                if best <= ring * cell_m:
+                    break
+
+        if not found:
+            return []
+        positions = np.concatenate([p for p, _ in found])
+        distances = np.concatenate([d for _, d in found])
+        keep = distances <= max_distance_m if max_distance_m is not None else slice(None)
+        positions, distances = positions[keep], distances[keep]
+        order = np.argsort(distances, kind="stable")[:n]
+        return list(zip(positions[order].tolist(), distances[order].tolist()))
@@ -0,0 +1,331 @@
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import clock
+import gtfs_data
+from feed_cache import load_compiled_feed
+from gtfs_data import build_service_calendar, build_day_index, shapes_for_display, tolerance_for_zoom
+from metrics import gauge, schedule_refreshes, static_reloads
+from precompressed import EncodedPayload
+from spatial import GridIndex
+
+
+def row_service_index(calendar, schedule, trips):
+    """Position in calendar.service_ids of every schedule row's service (-1 if unknown)."""
+    trip_ids = schedule['trip_id'].array           # categorical: resolve each trip once
+    per_trip = np.append(trips.calendar_positions(trip_ids.categories, calendar), -1)
+    return per_trip[trip_ids.codes]
+
+
+class StaticBundle:
+    """
+    One immutable generation of static GTFS data plus the indexes derived
+    from it.
+
+    Requests take a reference to the current bundle once and use it for
+    their whole lifetime, so a reload swapping in a new bundle never mixes
+    old and new data inside one response.  Derived per-day state
+    (schedule_today and its index) lives on the bundle, so it is dropped
+    together with the data it came from.
+
+    Service days are precomputed from a service × date bitmap: today and
+    tomorrow are ready when the bundle goes live, so the midnight rollover
+    is a dict lookup, and the following day is prepared in the background.
+    """
+
+    def __init__(self, feed, version, source):
+        self.version           = version
+        self.source            = source
+        self.content_hash      = feed["content_hash"]
+        self.schedule          = feed["schedule_df"]        # full schedule (all services)
+        self.trip_route_map    = feed["trip_route_map"]
+        self.stops_list        = feed["stops_list"]
+        self.shapes            = feed["shapes"]
+        self.calendar_df       = feed["calendar_df"]
+        self.calendar_dates_df = feed["calendar_dates_df"]
+        self.trip_service_map  = feed["trip_service_map"]
+        self.trips             = self.trip_route_map.trips   # TripTable behind both maps
+        self.loaded_at         = datetime.now()
+        self.schedule_bytes    = int(self.schedule.memory_usage(deep=True).sum())
+        # stops_list positions by location, for nearest-stop and viewport queries
+        self.stop_index = GridIndex(
+            [stop["lat"] for stop in self.stops_list], [stop["lon"] for stop in self.stops_list]
+        )
+
+        self.calendar = build_service_calendar(self.calendar_df, self.calendar_dates_df)
+        # service position of every schedule row (-1 when the trip has no known service)
+        self._row_service_idx = feed.get("row_service_idx")
+        if self._row_service_idx is None:
+            self._row_service_idx = row_service_index(self.calendar, self.schedule, self.trips)
+
+        self._day_lock = threading.Lock()
+        self._days = {}        # date -> (row_mask, FlatScheduleIndex)
+        self._preparing = set()  # dates being built in the background
+        self._index_dict = (None, None)  # (FlatScheduleIndex, its as_dict())
+        self._encoded_lock = threading.Lock()
+        self._encoded = {}  # response name -> EncodedPayload
+
+    def encoded(self, name, build_payload):
+        """
+        EncodedPayload for a response that only depends on this bundle,
+        serialised and compressed on first use and then reused.
+        """
+        encoded = self._encoded.get(name)
+        if encoded is None:
+            with self._encoded_lock:
+                encoded = self._encoded.get(name)
+                if encoded is None:
+                    encoded = self._encoded[name] = EncodedPayload(build_payload())
+        return encoded
+
+    def stops_response(self):
+        return self.encoded("stops", lambda: {"stops": self.stops_list})
+
+    def shapes_response(self, zoom=None, encoding="points"):
+        """Shapes sized for `zoom`; zooms sharing a tolerance share one payload."""
+        tolerance = tolerance_for_zoom(zoom)
+        return self.encoded(
+            f"shapes:{tolerance:g}:{encoding}",
+            lambda: {"shapes": shapes_for_display(self.shapes, zoom, encoding)},
+        )
+
+    def route_id_for(self, trip_id):
+        info = self.trips.route_info(trip_id)
+        return info["route_id"] if info else ""
+
+    def prepare_day(self, date, background=False):
+        """Build (or return the already built) service day for `date`."""
+        day = self._days.get(date)
+        if day is not None:
+            return day
+        with self._day_lock:
+            day = self._days.get(date)
+            if day is None:
+                def build():
+                    return build_day_index(self.schedule, self._row_service_idx, self.calendar, date)
+
+                day = build() if _day_builder is None else _day_builder(self, date, build, background)
+                # drop days that can no longer be asked for
+                self._days = {
+                    d: v for d, v in self._days.items() if d >= date - timedelta(days=1)
+                }
+                self._days[date] = day
+                schedule_refreshes.inc()
+                print(
+                    f"[INFO] schedule for {date} prepared: {int(day[0].sum())} rows, "
+                    f"active services: {self.calendar.active_ids(date)}",
+                    flush=True,
+                )
+        return day
+
+    def _prepare_in_background(self, date):
+        if date in self._days or date in self._preparing:
+            return
+        self._preparing.add(date)
+
+        def run():
+            try:
+                self.prepare_day(date, background=True)
+            finally:
+                self._preparing.discard(date)
+
+        threading.Thread(target=run, name="schedule-prepare", daemon=True).start()
+
+    def _today(self):
+        today = clock.today()
+        day = self._days.get(today)
+        if day is None:
+            day = self.prepare_day(today)
+        self._prepare_in_background(today + timedelta(days=1))
+        return day
+
+    def schedule_today(self):
+        """Schedule rows for today's active trips (switches over at midnight)."""
+        return self.schedule[self._today()[0]]
+
+    def schedule_index_today(self):
+        """
+        (stop_id, route_id) timetable dict for today, incl. post-midnight
+        carryover, for get_stop_schedule_context; built once per service day.
+        """
+        flat = self._today()[1]
+        indexed, index = self._index_dict
+        if indexed is not flat:
+            index = flat.as_dict()
+            self._index_dict = (flat, index)
+        return index
+
+    def flat_schedule_index_today(self):
+        """schedule_index_today() as a FlatScheduleIndex, for vectorised matching."""
+        return self._today()[1]
+
+
+_bundle = None                      # currently served StaticBundle
+_swap_listeners = []                # called with each newly swapped-in bundle
+_feed_publisher = None              # see set_feed_publisher
+_day_builder = None                 # see set_day_builder
+_reload_lock = threading.Lock()     # one reload at a time
+reload_state = {"loading": False, "source": None, "error": None}
+
+
+def current_bundle():
+    """The StaticBundle requests should use (None before the first load)."""
+    return _bundle
+
+
+def add_swap_listener(callback):
+    """Register `callback(bundle)`, run after every bundle swap."""
+    _swap_listeners.append(callback)
+
+
+def set_feed_publisher(callback):
+    """
+    Register `callback(feed, version, source) -> feed`, run on every newly
+    loaded feed before its bundle is built.  Multi-worker mode uses it to
+    move the arrays into shared memory (see shared_state.py).
+    """
+    global _feed_publisher
+    _feed_publisher = callback
+
+
+def set_day_builder(callback):
+    """
+    Register `callback(bundle, date, build, background) -> day`, run in
+    place of `build()` whenever a bundle prepares a service day
+    (`background` is True for the day prepared ahead).  Multi-worker mode
+    uses it to build each day once and share it (see shared_state.py).
+    """
+    global _day_builder
+    _day_builder = callback
+
+
+def _resolve_feed_dir(source, workdir):
+    """
+    Returns a directory containing the GTFS .txt files for `source`, which
+    may be a directory or a .zip (extracted into `workdir`).
+    """
+    if not zipfile.is_zipfile(source):
+        return source
+    with zipfile.ZipFile(source) as archive:
+        archive.extractall(workdir)
+    # Feeds are sometimes zipped inside a top-level folder
+    for root, _, files in os.walk(workdir):
+        if "stop_times.txt" in files:
+            return root
+    raise FileNotFoundError(f"no stop_times.txt in {source}")
+
+
+def load_bundle(source=None):
+    """Build (but do not publish) a StaticBundle from a feed directory or zip."""
+    source = source or gtfs_data.STATIC_GTFS_DIR
+    workdir = tempfile.mkdtemp(prefix="gtfs-")
+    try:
+        feed = load_compiled_feed(_resolve_feed_dir(source, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    version = _bundle.version + 1 if _bundle else 1
+    if _feed_publisher is not None:
+        feed = _feed_publisher(feed, version, source)
+    return bundle_from_feed(feed, version, source)
+
+
+def bundle_from_feed(feed, version, source):
+    """Build and pre-warm a StaticBundle from an already compiled feed."""
+    bundle = StaticBundle(feed, version, source)
+    # pre-warm before it serves requests
+    today = clock.today()
+    bundle.prepare_day(today)
+    bundle.prepare_day(today + timedelta(days=1))
+    bundle.stops_response()
+    bundle.shapes_response()
+    return bundle
+
+
+def swap_bundle(bundle):
+    """Atomically make `bundle` the one new requests see."""
+    global _bundle
+    _bundle = bundle
+    for callback in list(_swap_listeners):
+        try:
+            callback(bundle)
+        except Exception as e:
+            print(f"[WARN] bundle swap listener failed: {e}", flush=True)
+    print(f"[INFO] static bundle v{bundle.version} ({bundle.content_hash[:12]}) from {bundle.source} is live", flush=True)
+
+
+def _reload(source):
+    """reload_static's work; the caller holds _reload_lock."""
+    reload_state.update(loading=True, source=source or gtfs_data.STATIC_GTFS_DIR, error=None)
+    try:
+        swap_bundle(load_bundle(source))
+        static_reloads.inc(outcome="ok")
+    except Exception as e:
+        static_reloads.inc(outcome="error")
+        reload_state["error"] = f"{type(e).__name__}: {e}"
+        print(f"[WARN] static reload from {reload_state['source']} failed: {e}", flush=True)
+        raise
+    finally:
+        reload_state["loading"] = False
+
+
+def reload_static(source=None):
+    """Load `source` and swap it in; the previous bundle keeps serving meanwhile."""
+    with _reload_lock:
+        _reload(source)
+
+
+gauge(
+    "passiogo_static_bundle_version", "Version of the live static bundle.",
+    callback=lambda: _bundle.version if _bundle else None,
+)
+gauge(
+    "passiogo_static_schedule_bytes", "Memory held by the live bundle's schedule DataFrame.",
+    callback=lambda: _bundle.schedule_bytes if _bundle else None,
+)
+gauge(
+    "passiogo_static_schedule_rows", "Stop-time rows in the live bundle.",
+    callback=lambda: len(_bundle.schedule) if _bundle else None,
+)
+gauge(
+    "passiogo_static_parse_seconds", "Duration of the last CSV parse (load_static_data).",
+    callback=lambda: gtfs_data.last_load_stats.get("load_sec"),
+)
+def _peak_rss_bytes():
+    peak = gtfs_data.peak_rss_mb()
+    return None if peak is None else peak * 1024 * 1024
+
+
+gauge(
+    "passiogo_process_peak_rss_bytes", "Peak resident set size of this process.",
+    callback=_peak_rss_bytes,
+)
+
+
+def reload_static_in_background(source=None):
+    """Start reload_static on a daemon thread; returns False if one is already running."""
+    # taking the lock here, not in the thread, makes check and claim one step
+    if not _reload_lock.acquire(blocking=False):
+        return False
+    reload_state["loading"] = True
+
+    def run():
+        try:
+            _reload(source)
+        except Exception:
+            pass    # recorded in reload_state
+        finally:
+            _reload_lock.release()
+
+    try:
+        threading.Thread(target=run, name="static-reload", daemon=True).start()
+    except BaseException:
+        reload_state["loading"] = False
+        _reload_lock.release()
+        raise
+    return True
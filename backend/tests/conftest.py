@@ -0,0 +1,51 @@
+import os
+import sys
+
+# backend modules are imported flat (uvicorn main:app runs from backend/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+import pytest
+
+TINY_FEED = {
+    "routes.txt": [
+        "route_id,route_short_name,route_long_name,route_color,route_text_color",
+        "R1,A,Alpha,FF0000,FFFFFF",
+        "R2,B,Bravo,00FF00,000000",
+    ],
+    "trips.txt": [
+        "trip_id,route_id,service_id",
+        "T1,R1,WK",
+        "T2,R2,WK",
+        "T3,R1,SAT",
+    ],
+    "stop_times.txt": [
+        "trip_id,stop_id,arrival_time,stop_sequence",
+        "T1,S1,08:00:00,1",
+        "T1,S2,08:10:00,2",
+        "T2,S1,09:00:00,1",
+        "T2,S2,25:10:00,2",
+        "T3,S1,10:00:00,1",
+    ],
+    "stops.txt": [
+        "stop_id,stop_code,stop_name,stop_desc,stop_lat,stop_lon,parent_station",
+        "S1,1,Science Center (North),,42.3760,-71.1160,",
+        "S2,2,Quad,,42.3820,-71.1250,",
+    ],
+    "calendar.txt": [
+        "service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date",
+        "WK,1,1,1,1,1,0,0,20200101,20991231",
+        "SAT,0,0,0,0,0,1,0,20200101,20991231",
+    ],
+    "calendar_dates.txt": ["service_id,date,exception_type"],
+}
+
+
+@pytest.fixture
+def make_gtfs(tmp_path):
+    """Writes the tiny test feed, with any file replaced by the given lines, and returns its directory."""
+    def make(**overrides):
+        for name, lines in dict(TINY_FEED, **overrides).items():
+            (tmp_path / name).write_text("\n".join(lines) + "\n")
+        return str(tmp_path)
+    return make
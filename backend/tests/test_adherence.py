@@ -0,0 +1,57 @@
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pytest
+
+import clock
+import gtfs_data
+from adherence import match_schedule
+from realtime import determine_status_color
+from static_bundle import row_service_index
+
+DAY = date(2024, 6, 4)          # a Tuesday: WK runs, and Monday's 25:10 carries over
+
+
+@pytest.fixture
+def day_index(make_gtfs):
+    schedule, trip_route_map, _, calendar_df, calendar_dates_df, _ = gtfs_data.load_static_data(make_gtfs())
+    calendar = gtfs_data.build_service_calendar(calendar_df, calendar_dates_df)
+    row_service_idx = row_service_index(calendar, schedule, trip_route_map.trips)
+    _, index = gtfs_data.build_day_index(schedule, row_service_idx, calendar, DAY)
+    yield index
+    clock.reset_clock()
+
+
+def _per_stop_status(scheduled_sec, delta):
+    """The per-stop endpoints' status rule around get_stop_schedule_context."""
+    if scheduled_sec is None or np.isinf(delta):
+        return "Off Schedule", "Black"
+    return determine_status_color(delta)
+
+
+@pytest.mark.parametrize("now_hm", ["00:30", "08:05", "08:45", "12:00"])
+def test_match_schedule_agrees_with_get_stop_schedule_context(day_index, now_hm):
+    now = datetime.combine(DAY, datetime.strptime(now_hm, "%H:%M").time())
+    clock.set_clock(now.timestamp(), speed=0)
+    index_dict = day_index.as_dict()
+
+    stop_ids, route_ids, eta_ts = [], [], []
+    for stop_id in ("S1", "S2", "S9"):
+        for route_id in ("R1", "R2", "R9"):
+            for minutes in (-5, 0, 1.5, 3, 4.5, 10, 90):
+                stop_ids.append(stop_id)
+                route_ids.append(route_id)
+                eta_ts.append(int((now + timedelta(minutes=minutes)).timestamp()))
+
+    match = match_schedule(day_index, stop_ids, route_ids, np.array(eta_ts), now)
+    for i, (stop_id, route_id, eta) in enumerate(zip(stop_ids, route_ids, eta_ts)):
+        expected = gtfs_data.get_stop_schedule_context(
+            stop_id, route_id, datetime.fromtimestamp(eta), index_dict
+        )
+        assert match.context(i) == expected, (stop_id, route_id, eta)
+        assert match.status_color(i) == _per_stop_status(expected[0], expected[2])
+
+
+def test_carryover_slot_is_in_the_day_index(day_index):
+    # T2 reaches S2 at 25:10: Monday's run is 01:10 on Tuesday, Tuesday's own stays 25:10
+    assert day_index.as_dict()[("S2", "R2")].tolist() == [70 * 60, (24 * 60 + 70) * 60]
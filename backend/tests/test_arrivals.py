@@ -0,0 +1,91 @@
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+import clock
+import feed_cache
+import main
+import realtime
+import static_bundle
+from feed_tables import TripUpdates
+from response_cache import response_cache
+from test_static_bundle import SHAPES, TRIPS
+
+NOW = datetime(2025, 3, 3, 7, 50)          # a Monday: WK service runs
+
+
+def _at(hour, minute):
+    return int(NOW.replace(hour=hour, minute=minute).timestamp())
+
+
+TRIP_UPDATES = {"entity": [
+    {"trip_update": {
+        "trip": {"trip_id": "T1"}, "vehicle": {"label": "101"},
+        "stop_time_update": [
+            {"stop_id": "S1", "arrival": {"time": _at(8, 2)}},
+            {"stop_id": "S2", "arrival": {"time": _at(8, 12)}},
+        ],
+    }},
+    {"trip_update": {
+        "trip": {"trip_id": "T2"}, "vehicle": {"label": "202"},
+        "stop_time_update": [{"stop_id": "S1", "arrival": {"time": _at(7, 40)}}],     # already gone
+    }},
+]}
+
+
+@pytest.fixture
+def client(make_gtfs, tmp_path, monkeypatch):
+    """The tiny feed live at NOW, with one fixed tripUpdates table upstream."""
+    monkeypatch.setattr(feed_cache, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(static_bundle, "_swap_listeners", [])
+    clock.set_clock(NOW.timestamp(), speed=0)
+    bundle = static_bundle.load_bundle(make_gtfs(**{"trips.txt": TRIPS, "shapes.txt": SHAPES}))
+    monkeypatch.setattr(static_bundle, "_bundle", bundle)
+
+    state = {"trip_updates": TripUpdates.from_json(TRIP_UPDATES)}
+    monkeypatch.setattr(realtime, "fetch_feeds", lambda: (state["trip_updates"], None))
+    monkeypatch.setattr(realtime, "_snapshot", None)
+    response_cache.clear()                 # versions restart at 1 in every test
+    monkeypatch.setattr(realtime, "_resolve_route", lambda trip_id: bundle.trip_route_map.get(trip_id, {}).get("route_id"))
+    yield TestClient(main.app), state
+    clock.reset_clock()
+
+
+def test_batch_matches_the_single_stop_endpoint(client):
+    client, _ = client
+    response = client.get("/api/arrivals?stop_ids=S1, S2,S1")
+    assert response.status_code == 200
+    stops = response.json()["stops"]
+    assert list(stops) == ["S1", "S2"]
+    for stop_id, buses in stops.items():
+        assert buses == client.get(f"/api/stop/{stop_id}").json()["buses"]
+
+    # T2 has passed S1; T1 is two minutes behind its 08:00 slot
+    [bus] = stops["S1"]
+    assert (bus["trip_id"], bus["scheduled_time"], bus["delta_sec"]) == ("T1", "8:00 AM", 120)
+    assert bus["eta_min"] == 12 and bus["bus_number"] == "101"
+
+
+def test_all_covers_every_static_stop(client):
+    client, _ = client
+    body = client.get("/api/arrivals?stop_ids=all").json()
+    assert set(body["stops"]) == {"S1", "S2"}
+    assert body["snapshot_version"] == 1
+
+
+def test_bad_requests_and_missing_feed(client, monkeypatch):
+    client, state = client
+    assert client.get("/api/arrivals?stop_ids=,").status_code == 400
+    assert client.get("/api/arrivals").status_code == 422
+
+    # a failed fetch keeps serving the last good table
+    served = client.get("/api/arrivals?stop_ids=S1").json()["stops"]
+    state["trip_updates"] = None
+    realtime.refresh_snapshot()
+    assert client.get("/api/arrivals?stop_ids=S1").json()["stops"] == served
+
+    monkeypatch.setattr(realtime, "_snapshot", None)
+    response_cache.clear()
+    realtime.refresh_snapshot()
+    assert client.get("/api/arrivals?stop_ids=S1").status_code == 502
@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+import feed_cache
+import gtfs_data
+
+TRIPS = ["trip_id,route_id,service_id,shape_id", "T1,R1,WK,SH1", "T2,R2,WK,", "T3,R1,SAT,SH1"]
+SHAPES = [
+    "shape_id,shape_pt_lat,shape_pt_lon,shape_pt_sequence",
+    "SH1,42.3760,-71.1160,1",
+    "SH1,42.3820,-71.1250,2",
+]
+
+@pytest.fixture
+def feed_dir(make_gtfs, tmp_path, monkeypatch):
+    """Tiny feed as STATIC_GTFS_DIR, a private cache dir, and a count of CSV loads."""
+    directory = make_gtfs(**{"trips.txt": TRIPS, "shapes.txt": SHAPES})
+    monkeypatch.setattr(gtfs_data, "STATIC_GTFS_DIR", directory)
+    monkeypatch.setattr(feed_cache, "CACHE_DIR", str(tmp_path / "cache"))
+    loads = []
+    real_load = gtfs_data.load_static_data
+    monkeypatch.setattr(gtfs_data, "load_static_data", lambda gtfs_dir=None: loads.append(1) or real_load(gtfs_dir))
+    return directory, loads
+
+
+def test_second_load_is_served_from_the_cache(feed_dir):
+    _, loads = feed_dir
+    first = feed_cache.load_compiled_feed()
+    second = feed_cache.load_compiled_feed()
+    assert len(loads) == 1
+    assert second["content_hash"] == first["content_hash"]
+    assert second["schedule_df"].equals(first["schedule_df"])
+    assert second["trip_route_map"] == first["trip_route_map"]
+
+
+def test_changed_feed_contents_invalidate_the_cache(feed_dir):
+    directory, loads = feed_dir
+    first = feed_cache.load_compiled_feed()
+    with open(os.path.join(directory, "stop_times.txt"), "a") as f:
+        f.write("T3,S2,10:30:00,2\n")
+    second = feed_cache.load_compiled_feed()
+
+    assert len(loads) == 2
+    assert second["content_hash"] != first["content_hash"]
+    assert len(second["schedule_df"]) == len(first["schedule_df"]) + 1
+    # only the artifact for the current contents is kept
+    assert os.listdir(feed_cache.CACHE_DIR) == [f"feed-{second['content_hash'][:16]}.pickle"]
+
+
+def test_format_version_is_part_of_the_key(feed_dir, monkeypatch):
+    directory, _ = feed_dir
+    before = feed_cache.feed_content_hash(directory)
+    monkeypatch.setattr(feed_cache, "CACHE_FORMAT_VERSION", feed_cache.CACHE_FORMAT_VERSION + 1)
+    assert feed_cache.feed_content_hash(directory) != before
+
+
+def test_unreadable_artifact_is_rebuilt(feed_dir):
+    _, loads = feed_dir
+    compiled = feed_cache.load_compiled_feed()
+    with open(feed_cache._artifact_path(compiled["content_hash"]), "wb") as f:
+        f.write(b"not a pickle")
+    assert feed_cache.load_compiled_feed()["content_hash"] == compiled["content_hash"]
+    assert len(loads) == 2
@@ -0,0 +1,129 @@
+import json
+
+import numpy as np
+import pytest
+
+import gtfs_rt_pb
+from feed_tables import TripUpdates, VehiclePositions, decode_trip_updates, decode_vehicle_positions
+
+TRIP_UPDATES = {
+    "header": {"gtfs_realtime_version": "2.0", "timestamp": 1700000000},
+    "entity": [
+        {"id": "1", "trip_update": {
+            "trip": {"trip_id": "T1"},
+            "vehicle": {"id": "V1", "label": "101"},
+            "stop_time_update": [
+                {"stop_id": "S1", "arrival": {"time": 1700000060}},
+                {"stop_id": "S2"},                                    # no prediction
+                {"stop_id": "S1", "arrival": {"time": 1700000900}},   # repeated stop
+                {"stop_id": "S3", "arrival": {"time": 1700000300}},
+            ],
+        }},
+        {"id": "2", "trip_update": {
+            "trip": {"trip_id": "T2"},
+            "stop_time_update": [{"stop_id": "S3", "arrival": {"time": 1699999000}}],
+        }},
+        {"id": "3", "trip_update": {"trip": {"trip_id": "T3"}}},
+        {"id": "4", "vehicle": {"trip": {"trip_id": "T1"}}},
+    ],
+}
+
+VEHICLE_POSITIONS = {
+    "header": {"gtfs_realtime_version": "2.0", "timestamp": 1700000000},
+    "entity": [
+        {"id": "1", "vehicle": {
+            "trip": {"trip_id": "T1"},
+            "vehicle": {"id": " V1 ", "label": "101"},
+            "position": {"latitude": 42.37, "longitude": -71.11, "bearing": 90.0},
+            "timestamp": 1699999990,
+        }},
+        {"id": "2", "vehicle": {"trip": {"trip_id": "T2"}, "vehicle": {"label": "102"}}},
+    ],
+}
+
+needs_protobuf = pytest.mark.skipif(not gtfs_rt_pb.protobuf_available(), reason="gtfs-realtime-bindings not installed")
+
+
+def assert_same_table(a, b):
+    assert type(a) is type(b)
+    for name in a.__dataclass_fields__:
+        x, y = getattr(a, name), getattr(b, name)
+        if isinstance(x, np.ndarray) and x.dtype.kind == "f":
+            np.testing.assert_allclose(x, y, rtol=1e-6, err_msg=name)   # protobuf floats are 32-bit
+        elif isinstance(x, np.ndarray):
+            assert x.tolist() == y.tolist(), name
+        else:
+            assert x == y, name
+
+
+def test_trip_updates_from_json():
+    table = TripUpdates.from_json(TRIP_UPDATES)
+    assert table.timestamp == 1700000000
+    assert table.trip_ids.tolist() == ["T1", "T2", "T3"]
+    assert table.vehicle_labels.tolist() == ["101", "", ""]
+    assert table.starts.tolist() == [0, 4, 5, 5]
+    assert table.stop_ids.tolist() == ["S1", "S2", "S1", "S3", "S3"]
+    assert table.arrival_ts.tolist() == [1700000060, 0, 1700000900, 1700000300, 1699999000]
+
+
+def test_stop_arrivals_keeps_first_update_per_trip_and_stop():
+    table = TripUpdates.from_json(TRIP_UPDATES)
+    assert table.stop_arrivals({"T1": "R1"}.get).as_dict() == {
+        "S1": [("T1", "R1", 1700000060, "101")],
+        "S3": [("T1", "R1", 1700000300, "101"), ("T2", "", 1699999000, "Unknown")],
+    }
+
+
+def test_next_stops_and_active_trips():
+    table = TripUpdates.from_json(TRIP_UPDATES)
+    stop_ids, arrival_ts = table.next_stops(1700000100)
+    # T1: first arrival at or after now; T2: none upcoming, so its first; T3: nothing
+    assert stop_ids.tolist() == ["S1", "S3", ""]
+    assert arrival_ts.tolist() == [1700000900, 1699999000, 0]
+    assert table.active_trips(1700000100).tolist() == [0]
+
+
+def test_feed_without_entity_list_is_unreadable():
+    assert len(TripUpdates.from_json({"entity": []})) == 0
+    assert TripUpdates.from_json({"entity": None}).stop_arrivals().as_dict() == {}
+    with pytest.raises(ValueError):
+        TripUpdates.from_json({})
+    with pytest.raises(ValueError):
+        VehiclePositions.from_json({"header": {}})
+
+
+def test_vehicle_positions_from_json():
+    table = VehiclePositions.from_json(VEHICLE_POSITIONS)
+    assert table.vehicle_ids.tolist() == ["V1", ""]
+    assert table.identities().tolist() == ["V1", "T2"]
+    assert table.lat[0] == 42.37 and np.isnan(table.lat[1])
+    assert table.bearing[0] == 90.0 and np.isnan(table.speed[0])
+    assert table.position_ts.tolist() == [1699999990, 0]
+
+
+@needs_protobuf
+@pytest.mark.parametrize("content_type", ["application/x-protobuf", "application/octet-stream", None, "text/plain"])
+def test_protobuf_and_json_decode_to_the_same_tables(content_type):
+    for payload, decode in ((TRIP_UPDATES, decode_trip_updates), (VEHICLE_POSITIONS, decode_vehicle_positions)):
+        from_pb = decode(gtfs_rt_pb.encode_feed(payload), content_type)
+        from_json = decode(json.dumps(payload).encode(), "application/json")
+        assert_same_table(from_pb, from_json)
+
+
+@pytest.mark.parametrize("content_type", ["application/json; charset=utf-8", None, "text/plain"])
+def test_json_body_is_read_as_json(content_type):
+    table = decode_trip_updates(json.dumps(TRIP_UPDATES).encode(), content_type)
+    assert table.trip_ids.tolist() == ["T1", "T2", "T3"]
+
+
+@needs_protobuf
+def test_declared_protobuf_that_does_not_parse_is_an_error():
+    with pytest.raises(ValueError, match="protobuf"):
+        decode_trip_updates(json.dumps(TRIP_UPDATES).encode(), "application/x-protobuf")
+
+
+def test_unreadable_body_is_an_error():
+    with pytest.raises(ValueError):
+        decode_trip_updates(b"\x00not a feed", None)
+    with pytest.raises(ValueError):
+        decode_trip_updates(b"[1, 2]", "application/json")
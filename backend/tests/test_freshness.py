@@ -0,0 +1,43 @@
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import feed_cache
+import main
+import realtime
+import static_bundle
+from feed_tables import TripUpdates
+from test_static_bundle import SHAPES, TRIPS
+
+
+@pytest.fixture
+def client(make_gtfs, tmp_path, monkeypatch):
+    monkeypatch.setattr(feed_cache, "CACHE_DIR", str(tmp_path / "cache"))
+    bundle = static_bundle.load_bundle(make_gtfs(**{"trips.txt": TRIPS, "shapes.txt": SHAPES}))
+    monkeypatch.setattr(main, "current_bundle", lambda: bundle)
+    return TestClient(main.app)        # no startup: nothing is loaded or polled
+
+
+def _serve_snapshot(monkeypatch, version, age_sec):
+    fetched_at = time.time() - age_sec
+    snapshot = realtime.RealtimeSnapshot(
+        version=version, fetched_at=time.time(),
+        trip_updates=TripUpdates.from_json({"entity": []}), stop_arrivals=None, trip_updates_at=fetched_at,
+    )
+    monkeypatch.setattr(main, "get_snapshot", lambda: snapshot)
+
+
+def test_active_routes_reports_realtime_age(client, monkeypatch):
+    _serve_snapshot(monkeypatch, 1001, age_sec=20)
+    r = client.get("/api/active-routes")
+    assert r.status_code == 200
+    assert r.json() == {"active_routes": []}
+    assert 19 <= int(r.headers["X-Realtime-Age"]) <= 21
+
+
+def test_active_routes_refuses_stale_realtime_data(client, monkeypatch):
+    _serve_snapshot(monkeypatch, 1002, age_sec=realtime.MAX_STALE_SEC + 60)
+    r = client.get("/api/active-routes")
+    assert r.status_code == 503
+    assert "old" in r.json()["detail"]
@@ -0,0 +1,276 @@
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import clock
+import gtfs_data
+from conftest import TINY_FEED
+
+NOW = datetime(2024, 6, 4, 8, 5)
+
+
+@pytest.fixture
+def frozen_now():
+    clock.set_clock(NOW.timestamp(), speed=0)
+    yield
+    clock.reset_clock()
+
+
+def test_load_static_data_tiny_feed(make_gtfs, monkeypatch):
+    monkeypatch.setattr(gtfs_data, "STATIC_GTFS_DIR", make_gtfs())
+    schedule, trip_route_map, stops, calendar_df, calendar_dates_df, trip_service_map = (
+        gtfs_data.load_static_data()
+    )
+    assert len(schedule) == 5
+    assert schedule["arrival_sec"].tolist() == [28800, 29400, 32400, 90600, 36000]
+    assert trip_route_map["T1"]["route_id"] == "R1"
+    assert trip_route_map["T2"]["long_name"] == "Bravo"
+    assert trip_service_map["T3"] == "SAT"
+    assert stops[0]["building_name"] == "Science Center" and stops[0]["stop_detail"] == "North"
+
+
+def test_duplicate_trip_ids_agree_on_the_last_row(make_gtfs, monkeypatch):
+    trips = TINY_FEED["trips.txt"] + ["T1,R2,WK"]
+    monkeypatch.setattr(gtfs_data, "STATIC_GTFS_DIR", make_gtfs(**{"trips.txt": trips}))
+    schedule, trip_route_map, *_ = gtfs_data.load_static_data()
+    t1 = schedule[schedule["trip_id"] == "T1"]
+    assert set(t1["route_id"].astype(str)) == {"R2"}
+    assert trip_route_map["T1"]["route_id"] == "R2"
+
+
+def test_arrival_times_are_parsed_once_into_seconds(make_gtfs, monkeypatch):
+    stop_times = TINY_FEED["stop_times.txt"] + ["T3,S2,,2", "T3,S2,bad,3"]
+    monkeypatch.setattr(gtfs_data, "STATIC_GTFS_DIR", make_gtfs(**{"stop_times.txt": stop_times}))
+    schedule = gtfs_data.load_static_data()[0]
+    assert "arrival_time" not in schedule.columns
+    assert schedule["arrival_sec"].dtype == np.int32
+    assert len(schedule) == 5            # rows without a usable time are dropped
+
+
+def test_loader_builds_lookups_from_whole_columns(make_gtfs, monkeypatch):
+    routes = TINY_FEED["routes.txt"] + ["R3,C,,,"]
+    trips = TINY_FEED["trips.txt"] + ["T4,R3,"]
+    stops = TINY_FEED["stops.txt"] + ["S3,, Annex () ,Side door,42.3700,-71.1100,S1", "S4,4,Nowhere,,,,"]
+    monkeypatch.setattr(gtfs_data, "STATIC_GTFS_DIR", make_gtfs(**{
+        "routes.txt": routes, "trips.txt": trips, "stops.txt": stops,
+    }))
+    schedule, trip_route_map, stops, _, _, trip_service_map = gtfs_data.load_static_data()
+
+    assert trip_route_map["T4"] == {
+        "route_id": "R3", "short_name": "C", "long_name": "",
+        "color": "#000000", "text_color": "#FFFFFF",
+    }
+    assert trip_route_map["T1"]["color"] == "#FF0000"
+    assert trip_service_map["T4"] == ""
+    assert schedule["trip_id"].dtype == "category" and schedule["route_id"].dtype == "category"
+
+    assert [stop["stop_id"] for stop in stops] == ["S1", "S2", "S3"]     # no coordinates, no stop
+    annex = stops[2]
+    assert (annex["building_name"], annex["stop_detail"]) == ("Annex", None)
+    assert (annex["description"], annex["stop_code"], annex["parent_station"]) == ("Side door", None, "S1")
+    assert stops[1]["stop_code"] == "2" and stops[1]["description"] is None
+
+    assert set(gtfs_data.last_load_stats) >= {"load_sec", "schedule_rows"}
+    assert gtfs_data.last_load_stats["schedule_rows"] == 5
+
+
+CALENDAR_DATES = [
+    "service_id,date,exception_type",
+    "WK,20240604,2",        # no weekday service on Tuesday 4 June
+    "SAT,20240604,1",       # …Saturday service instead
+    "XTRA,20240609,1",      # a service only calendar_dates knows
+    "WK,bad-date,1",
+]
+
+
+def _tiny_feed(make_gtfs, monkeypatch, **overrides):
+    monkeypatch.setattr(gtfs_data, "STATIC_GTFS_DIR", make_gtfs(**overrides))
+    return gtfs_data.load_static_data()
+
+
+def test_service_calendar_matches_get_active_service_ids(make_gtfs, monkeypatch):
+    calendar = TINY_FEED["calendar.txt"][:1] + [
+        "WK,1,1,1,1,1,0,0,20240520,20240614",
+        "SAT,0,0,0,0,0,1,0,20240601,20240630",
+        "ODD,0,0,0,0,0,0,1,20240230,20240616",      # no such date, yet still a bound
+        "BAD,1,1,1,1,1,1,1,2024-05-01,20240630",    # never runs
+    ]
+    _, _, _, calendar_df, calendar_dates_df, _ = _tiny_feed(
+        make_gtfs, monkeypatch, **{"calendar.txt": calendar, "calendar_dates.txt": CALENDAR_DATES}
+    )
+    # a window of 2024-06-03 .. 2024-06-20; the days around it take the fallback
+    monkeypatch.setattr(gtfs_data, "SERVICE_CALENDAR_PAST_DAYS", 7)
+    monkeypatch.setattr(gtfs_data, "SERVICE_CALENDAR_FUTURE_DAYS", 10)
+    service_calendar = gtfs_data.build_service_calendar(calendar_df, calendar_dates_df, today=date(2024, 6, 10))
+    assert service_calendar.active.shape == (5, 18)
+
+    day = date(2024, 5, 10)
+    while day <= date(2024, 7, 10):
+        expected = gtfs_data.get_active_service_ids(calendar_df, calendar_dates_df, day)
+        assert service_calendar.active_ids(day) == expected, day
+        day += timedelta(days=1)
+    assert gtfs_data.get_active_service_ids(calendar_df, calendar_dates_df, date(2024, 6, 4)) == {"SAT"}
+    assert service_calendar.active_ids(date(2024, 6, 9)) == {"XTRA", "ODD"}
+
+
+def test_service_calendar_window_is_bounded(make_gtfs, monkeypatch):
+    calendar = TINY_FEED["calendar.txt"][:1] + ["FOREVER,1,1,1,1,1,1,1,20200101,99991231"]
+    _, _, _, calendar_df, calendar_dates_df, _ = _tiny_feed(make_gtfs, monkeypatch, **{"calendar.txt": calendar})
+    service_calendar = gtfs_data.build_service_calendar(calendar_df, calendar_dates_df, today=date(2024, 6, 10))
+    window = gtfs_data.SERVICE_CALENDAR_PAST_DAYS + gtfs_data.SERVICE_CALENDAR_FUTURE_DAYS + 1
+    assert service_calendar.active.shape == (1, window)
+    # far outside the window the source tables still answer
+    assert service_calendar.active_ids(date(2031, 1, 1)) == {"FOREVER"}
+    assert service_calendar.active_ids(date(2019, 12, 31)) == set()
+
+
+def test_day_index_carries_over_trips_past_midnight(make_gtfs, monkeypatch):
+    schedule, _, _, calendar_df, calendar_dates_df, trip_service_map = _tiny_feed(make_gtfs, monkeypatch)
+    service_calendar = gtfs_data.build_service_calendar(calendar_df, calendar_dates_df)
+    row_service_idx = service_calendar.service_index(schedule["trip_id"].map(trip_service_map))
+
+    # Tuesday: its own WK trips, plus Monday's T2 arriving at 25:10 → 01:10
+    mask, flat = gtfs_data.build_day_index(schedule, row_service_idx, service_calendar, date(2024, 6, 4))
+    index = flat.as_dict()
+    assert sorted(schedule.loc[mask, "trip_id"].astype(str)) == ["T1", "T1", "T2", "T2"]
+    assert index[("S2", "R2")].tolist() == [70 * 60, (24 * 60 + 70) * 60]
+    assert index[("S1", "R1")].tolist() == [8 * 3600]
+
+    # Sunday: nothing runs, and Saturday's service ends before midnight
+    mask, flat = gtfs_data.build_day_index(schedule, row_service_idx, service_calendar, date(2024, 6, 9))
+    assert not mask.any() and flat.as_dict() == {}
+
+
+def test_time_helpers():
+    assert gtfs_data.gtfs_time_to_seconds("25:10:05") == 90605
+    assert gtfs_data.gtfs_time_to_seconds("soon") is None
+    assert gtfs_data.fmt_time(0) == "12:00 AM"
+    assert gtfs_data.fmt_time(13 * 3600 + 5 * 60) == "1:05 PM"
+    assert gtfs_data.fmt_time(25 * 3600 + 60) == "1:01 AM"
+    assert gtfs_data.service_time_to_datetime(NOW.date(), 90600) == datetime(2024, 6, 5, 1, 10)
+
+
+def test_fmt_times_matches_fmt_time():
+    seconds = np.array([0, 59, 3600, 12 * 3600, 13 * 3600 + 5 * 60, 25 * 3600 + 61])
+    assert gtfs_data.fmt_times(seconds).tolist() == [gtfs_data.fmt_time(s) for s in seconds]
+
+
+def test_schedule_index_holds_unique_sorted_seconds_per_stop_and_route():
+    schedule = pd.DataFrame({
+        "stop_id": ["S1", "S1", "S1", "S2"],
+        "route_id": ["R1", "R1", "R1", "R1"],
+        "arrival_sec": np.array([29400, 28800, 29400, 90000], dtype=np.int32),
+    })
+    index = gtfs_data.build_schedule_index(schedule)
+    assert {k: v.tolist() for k, v in index.items()} == {
+        ("S1", "R1"): [8 * 3600, 8 * 3600 + 600],
+        ("S2", "R1"): [25 * 3600],
+    }
+
+
+def test_schedule_context_anchors_on_the_next_slot(frozen_now):
+    index = {("S1", "R1"): pd.Series([28800, 29400, 30000]).to_numpy()}
+    scheduled, context, delta = gtfs_data.get_stop_schedule_context(
+        "S1", "R1", datetime(2024, 6, 4, 8, 12), index
+    )
+    assert scheduled == 29400
+    assert context == {"past": "8:00 AM", "current": "8:10 AM", "next": "8:20 AM"}
+    assert delta == 120
+
+
+def test_schedule_context_guards(frozen_now):
+    index = {("S1", "R1"): pd.Series([3600, 28800 + 600]).to_numpy()}
+    context = gtfs_data.get_stop_schedule_context
+    # an ETA two hours off the anchor slot is off schedule
+    assert context("S1", "R1", datetime(2024, 6, 4, 10, 10), index)[2] == float("inf")
+    # every slot long past: the last one is current, but gives no delta
+    late = {("S1", "R1"): pd.Series([3600]).to_numpy()}
+    assert context("S1", "R1", datetime(2024, 6, 4, 8, 6), late)[2] == 0
+    assert context("S9", "R1", NOW, index) == (
+        None, {"past": None, "current": None, "next": None}, 0
+    )
+
+
+def _decode_polyline(encoded, precision=5):
+    values, value, shift = [], 0, 0
+    for char in encoded:
+        chunk = ord(char) - 63
+        value |= (chunk & 0x1f) << shift
+        shift += 5
+        if chunk < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value, shift = 0, 0
+    coords = np.cumsum(np.reshape(values, (-1, 2)), axis=0)
+    return (coords / 10 ** precision).tolist()
+
+
+def test_encode_polyline_matches_the_reference_encoding():
+    # the worked example of Google's polyline algorithm documentation
+    points = [[38.5, -120.2], [40.7, -120.95], [43.252, -126.453]]
+    assert gtfs_data.encode_polyline(points) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+    assert gtfs_data.encode_polyline([]) == ""
+
+
+def test_encode_polyline_round_trips():
+    rng = np.random.default_rng(3)
+    points = np.column_stack([rng.uniform(-89, 89, 200), rng.uniform(-179, 179, 200)]).round(5)
+    assert np.allclose(_decode_polyline(gtfs_data.encode_polyline(points.tolist())), points, atol=1e-9)
+
+
+def test_shapes_for_display_encodes_the_simplified_points():
+    shape = {
+        "shape_id": "SH1", "route_id": "R1",
+        "points": [[42.0, -71.0], [42.00001, -71.0005], [42.0, -71.001]],
+    }
+    plain = gtfs_data.shapes_for_display([shape], zoom=12)
+    encoded = gtfs_data.shapes_for_display([shape], zoom=12, encoding="polyline")
+    assert "points" not in encoded[0] and encoded[0]["route_id"] == "R1"
+    assert _decode_polyline(encoded[0]["polyline"]) == plain[0]["points"]
+    assert len(plain[0]["points"]) < len(shape["points"])
+
+
+def test_load_shapes_orders_points_by_sequence(make_gtfs):
+    feed_dir = make_gtfs(**{
+        "trips.txt": ["trip_id,route_id,service_id,shape_id", "T1,R1,WK,SH1", "T2,R2,WK,SH2", "T3,R1,SAT,SH1"],
+        "shapes.txt": [
+            "shape_id,shape_pt_lat,shape_pt_lon,shape_pt_sequence",
+            "SH1,42.3820,-71.1250,2",
+            "SH2,42.1000,-71.2000,1",
+            "SH1,42.3760,-71.1160,1",
+        ],
+    })
+    assert gtfs_data.load_shapes(feed_dir) == [
+        {"shape_id": "SH1", "route_name": "Alpha", "color": "#FF0000",
+         "points": [[42.376, -71.116], [42.382, -71.125]]},
+        {"shape_id": "SH2", "route_name": "Bravo", "color": "#00FF00", "points": [[42.1, -71.2]]},
+    ]
+
+
+def _line(lat, lon_from, lon_to, n=20):
+    return [[lat, lon] for lon in np.linspace(lon_from, lon_to, n).round(6).tolist()]
+
+
+def test_dedupe_route_shapes_keeps_only_geometry_that_adds_something():
+    main_line = _line(42.3700, -71.1300, -71.1000)
+    shapes = [
+        {"shape_id": "A", "points": main_line},
+        {"shape_id": "A.1", "points": main_line},                                 # exact duplicate
+        {"shape_id": "A.2", "points": _line(42.37005, -71.1250, -71.1100)},       # ~6 m off, contained
+        {"shape_id": "B", "points": _line(42.3720, -71.1300, -71.1000)},          # ~220 m away: a branch
+        {"shape_id": "R2", "points": main_line},                                  # same streets, other route
+        {"shape_id": "X", "points": main_line},                                   # no route
+    ]
+    routes = {"A": "R1", "A.1": "R1", "A.2": "R1", "B": "R1", "R2": "R2"}
+    kept = gtfs_data.dedupe_route_shapes(shapes, routes, {"A": 1, "A.1": 5, "A.2": 9, "B": 1})
+    assert sorted(shape["shape_id"] for shape in kept) == ["A.1", "B", "R2", "X"]
+
+
+def test_dedupe_route_shapes_prefers_the_longer_of_equally_used_shapes():
+    shapes = [
+        {"shape_id": "short", "points": _line(42.3700, -71.1200, -71.1100)},
+        {"shape_id": "long", "points": _line(42.3700, -71.1300, -71.1000)},
+    ]
+    kept = gtfs_data.dedupe_route_shapes(shapes, {"short": "R1", "long": "R1"}, {})
+    assert [shape["shape_id"] for shape in kept] == ["long"]
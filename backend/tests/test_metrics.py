@@ -0,0 +1,60 @@
+from fastapi.testclient import TestClient
+
+import gtfs_data
+import main
+import metrics
+import static_bundle
+from metrics import Counter, Gauge, Histogram
+
+
+def test_histogram_buckets_are_cumulative():
+    latency = Histogram("stage_seconds", "Stage latency.", ("stage",), buckets=(0.01, 0.1))
+    for value in (0.005, 0.05, 0.05, 3.0):
+        latency.observe(value, stage="build")
+    assert latency.count(stage="build") == 4
+    assert latency.render()[2:] == [
+        'stage_seconds_bucket{stage="build",le="0.01"} 1',
+        'stage_seconds_bucket{stage="build",le="0.1"} 3',
+        'stage_seconds_bucket{stage="build",le="+Inf"} 4',
+        'stage_seconds_sum{stage="build"} 3.105',
+        'stage_seconds_count{stage="build"} 4',
+    ]
+
+
+def test_counter_and_gauge_samples():
+    requests = Counter("requests_total", "Requests.", ("route",))
+    requests.inc(route='/a"b')
+    requests.inc(2, route='/a"b')
+    assert requests.render() == [
+        "# HELP requests_total Requests.", "# TYPE requests_total counter",
+        'requests_total{route="/a\\"b"} 3',
+    ]
+
+    live = {"value": None}
+    version = Gauge("bundle_version", "Version.", callback=lambda: live["value"])
+    assert version.render()[2:] == []          # None: no sample
+    live["value"] = 7
+    assert version.render()[2:] == ["bundle_version 7"]
+    broken = Gauge("broken", "Raises.", callback=lambda: 1 / 0)
+    assert broken.render()[2:] == []
+
+
+def test_requests_are_labelled_by_route_template():
+    client = TestClient(main.app)            # no startup: nothing is loaded or polled
+    before = metrics.http_requests.value(method="GET", route="/api/health", status=200)
+    assert client.get("/api/health").status_code == 200
+    assert metrics.http_requests.value(method="GET", route="/api/health", status=200) == before + 1
+
+    scraped = client.get("/metrics")
+    assert scraped.headers["content-type"] == metrics.CONTENT_TYPE
+    assert 'passiogo_http_requests_total{method="GET",route="/api/health",status="200"}' in scraped.text
+    assert "passiogo_metrics_observe_cost_seconds " in scraped.text
+
+
+def test_peak_rss_gauge_reports_zero_but_not_unavailable(monkeypatch):
+    monkeypatch.setattr(gtfs_data, "peak_rss_mb", lambda: 0.0)
+    assert static_bundle._peak_rss_bytes() == 0
+    monkeypatch.setattr(gtfs_data, "peak_rss_mb", lambda: None)
+    assert static_bundle._peak_rss_bytes() is None
+    monkeypatch.setattr(gtfs_data, "peak_rss_mb", lambda: 1.5)
+    assert static_bundle._peak_rss_bytes() == 1.5 * 1024 * 1024
@@ -0,0 +1,75 @@
+import gzip
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import precompressed
+import static_bundle
+from precompressed import EncodedPayload, precompressed_response
+
+PAYLOAD = {"stops": [{"stop_id": "S1", "name": "Science Center"}] * 50}
+
+
+def test_encoding_follows_accept_encoding(monkeypatch):
+    monkeypatch.setattr(precompressed, "brotli", None)
+    encoded = EncodedPayload(PAYLOAD)
+    assert encoded.br is None
+
+    gzipped = precompressed_response(encoded, "gzip, deflate, br")
+    assert gzipped.headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(gzipped.body)) == PAYLOAD
+    assert gzipped.headers["ETag"] == f'"{encoded.etag}-gzip"'
+    assert gzipped.headers["Vary"] == "Accept-Encoding"
+
+    for refused in (None, "gzip;q=0", "identity"):
+        plain = precompressed_response(encoded, refused)
+        assert "Content-Encoding" not in plain.headers
+        assert json.loads(plain.body) == PAYLOAD
+        assert plain.headers["ETag"] == f'"{encoded.etag}"'
+
+
+def test_brotli_is_preferred_when_available():
+    pytest.importorskip("brotli")
+    encoded = EncodedPayload(PAYLOAD)
+    response = precompressed_response(encoded, "gzip, br;q=0.5")
+    assert response.headers["Content-Encoding"] == "br"
+    assert len(encoded.br) < len(encoded.gzip) < len(encoded.identity)
+
+
+def test_if_none_match_any_variant_is_not_modified():
+    encoded = EncodedPayload(PAYLOAD)
+    for tag in (f'"{encoded.etag}"', f'W/"{encoded.etag}-gzip"', f'"other", "{encoded.etag}-br"', "*"):
+        response = precompressed_response(encoded, "gzip", tag)
+        assert response.status_code == 304 and response.body == b""
+    assert precompressed_response(encoded, "gzip", '"stale"').status_code == 200
+
+    changed = EncodedPayload({"stops": []})
+    assert changed.etag != encoded.etag
+    assert precompressed_response(changed, "gzip", f'"{encoded.etag}-gzip"').status_code == 200
+
+
+class _Bundle:
+    """Just what /api/stops needs from a StaticBundle."""
+
+    def __init__(self, stops):
+        self.encoded_stops = EncodedPayload({"stops": stops})
+
+    def stops_response(self):
+        return self.encoded_stops
+
+
+def test_stops_endpoint_revalidates_per_bundle(monkeypatch):
+    client = TestClient(main.app)            # no startup: nothing is loaded or polled
+    monkeypatch.setattr(static_bundle, "_bundle", _Bundle([{"stop_id": "S1"}]))
+
+    first = client.get("/api/stops", headers={"Accept-Encoding": "gzip"})
+    assert first.status_code == 200 and first.json() == {"stops": [{"stop_id": "S1"}]}
+    etag = first.headers["ETag"]
+    assert client.get("/api/stops", headers={"Accept-Encoding": "gzip", "If-None-Match": etag}).status_code == 304
+
+    # a reload swaps in new content, so the old validator no longer matches
+    monkeypatch.setattr(static_bundle, "_bundle", _Bundle([{"stop_id": "S2"}]))
+    second = client.get("/api/stops", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert second.status_code == 200 and second.headers["ETag"] != etag
@@ -0,0 +1,114 @@
+import threading
+import time
+
+import pytest
+
+import realtime
+from feed_tables import TripUpdates, VehiclePositions
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Counts upstream fetches; `gate` holds them until set."""
+    state = {"fetches": 0, "gate": threading.Event()}
+    state["gate"].set()
+
+    state["trip_updates"] = None          # fixed table; a fresh one per fetch when None
+
+    def fetch():
+        state["gate"].wait(5)
+        state["fetches"] += 1
+        trip_updates = state["trip_updates"] or TripUpdates.from_json(
+            {"header": {"timestamp": state["fetches"]}, "entity": []}
+        )
+        return trip_updates, VehiclePositions.from_json({"entity": []})
+
+    monkeypatch.setattr(realtime, "fetch_feeds", fetch)
+    monkeypatch.setattr(realtime, "_snapshot", None)
+    monkeypatch.setattr(realtime, "_listeners", [])
+    return state
+
+
+def test_refresh_publishes_a_new_version(upstream):
+    first = realtime.refresh_snapshot()
+    second = realtime.refresh_snapshot()
+    assert (first.version, second.version) == (1, 2)
+    assert second.trip_updates.timestamp == 2
+    assert realtime.current_snapshot() is second
+
+
+def test_listeners_see_each_snapshot_and_failures_are_contained(upstream):
+    seen = []
+    realtime.add_snapshot_listener(lambda snapshot: 1 / 0)
+    realtime.add_snapshot_listener(seen.append)
+    snapshot = realtime.refresh_snapshot()
+    assert seen == [snapshot]
+
+
+def test_fresh_snapshot_is_served_without_fetching(upstream):
+    snapshot = realtime.get_snapshot()
+    assert realtime.get_snapshot() is snapshot
+    assert upstream["fetches"] == 1
+
+
+def test_concurrent_callers_share_one_fetch(upstream):
+    upstream["gate"].clear()
+    results = []
+    callers = [threading.Thread(target=lambda: results.append(realtime.get_snapshot())) for _ in range(8)]
+    for caller in callers:
+        caller.start()
+    time.sleep(0.1)
+    upstream["gate"].set()
+    for caller in callers:
+        caller.join(5)
+
+    assert upstream["fetches"] == 1
+    assert len({id(snapshot) for snapshot in results}) == 1
+
+
+def test_stale_snapshot_is_served_while_refetched(upstream, monkeypatch):
+    snapshot = realtime.get_snapshot()
+    monkeypatch.setattr(realtime, "POLL_INTERVAL_SEC", 0.01)
+    time.sleep(0.05)
+    assert realtime.get_snapshot() is snapshot          # no wait on the upstream
+    for _ in range(100):
+        if realtime.current_snapshot().version > snapshot.version:
+            break
+        time.sleep(0.01)
+    assert realtime.current_snapshot().version == snapshot.version + 1
+
+
+TRIP_UPDATES = TripUpdates.from_json({"entity": [
+    {"trip_update": {
+        "trip": {"trip_id": "T1"}, "vehicle": {"label": "101"},
+        "stop_time_update": [
+            {"stop_id": "S1", "arrival": {"time": 1700000060}},
+            {"stop_id": "S2"},
+            {"stop_id": "S1", "arrival": {"time": 1700000900}},     # repeated stop: first one wins
+            {"stop_id": "S3", "arrival": {"time": 1700000300}},
+        ],
+    }},
+    {"trip_update": {
+        "trip": {"trip_id": "T2"},
+        "stop_time_update": [{"stop_id": "S3", "arrival": {"time": 1699999000}}],
+    }},
+    {"vehicle": {"vehicle": {"id": "V1"}}},
+]})
+
+
+def test_stop_arrivals_index_keeps_first_update_per_trip_and_stop():
+    assert realtime.build_stop_arrivals_index(TRIP_UPDATES, {"T1": "R1"}.get).as_dict() == {
+        "S1": [("T1", "R1", 1700000060, "101")],
+        "S3": [("T1", "R1", 1700000300, "101"), ("T2", "", 1699999000, "Unknown")],
+    }
+    assert len(realtime.build_stop_arrivals_index(None)) == 0
+
+
+def test_snapshot_carries_its_stop_index(upstream, monkeypatch):
+    upstream["trip_updates"] = TRIP_UPDATES
+    monkeypatch.setattr(realtime, "_resolve_route", {"T1": "R1"}.get)
+    snapshot = realtime.refresh_snapshot()
+    assert snapshot.stop_arrivals.as_dict()["S1"] == [("T1", "R1", 1700000060, "101")]
+
+    # a 304 hands back the same table object, so its index is reused as is
+    assert realtime.refresh_snapshot().stop_arrivals is snapshot.stop_arrivals
@@ -0,0 +1,89 @@
+import gzip
+import hashlib
+import json
+import time
+
+import httpx
+import pytest
+
+import clock
+from gtfs_rt_replay import Recording, ReplayServer
+from upstream import UpstreamClient
+
+
+@pytest.fixture
+def recording(tmp_path):
+    """Two tripUpdates frames 60s apart and one vehiclePositions frame."""
+    frames = [
+        ("tripUpdates", 1000.0, {"entity": [], "n": 1}),
+        ("vehiclePositions", 1000.0, {"entity": []}),
+        ("tripUpdates", 1060.0, {"entity": [], "n": 2}),
+    ]
+    with open(tmp_path / "frames.jsonl", "w") as index:
+        for n, (feed, t, payload) in enumerate(frames):
+            name = f"{feed}/{n}.gz"
+            (tmp_path / feed).mkdir(exist_ok=True)
+            body = json.dumps(payload).encode()
+            (tmp_path / name).write_bytes(gzip.compress(body))
+            digest = hashlib.sha256(body).hexdigest()
+            index.write(json.dumps({"t": t, "feed": feed, "file": name, "sha256": digest}) + "\n")
+    return Recording(str(tmp_path))
+
+
+@pytest.fixture
+def restore_clock():
+    yield
+    clock.reset_clock()
+
+
+def test_recording_picks_the_latest_frame_at_or_before(recording):
+    assert (recording.first_t, recording.last_t) == (1000.0, 1060.0)
+    assert recording.frame_at("tripUpdates", 999.0)["file"] == "tripUpdates/0.gz"
+    assert recording.frame_at("tripUpdates", 1059.9)["file"] == "tripUpdates/0.gz"
+    assert recording.frame_at("tripUpdates", 5000.0)["file"] == "tripUpdates/2.gz"
+    assert recording.frame_at("serviceAlerts", 1000.0) is None
+    assert json.loads(recording.body("tripUpdates/2.gz"))["n"] == 2
+
+
+def test_bodies_are_cached_per_recording_and_bounded(recording, monkeypatch):
+    other = Recording(recording.rec_dir)
+    monkeypatch.setattr(Recording, "BODY_CACHE_FRAMES", 2)
+    for name in ("tripUpdates/0.gz", "vehiclePositions/1.gz", "tripUpdates/2.gz"):
+        recording.body(name)
+    assert list(recording._bodies) == ["vehiclePositions/1.gz", "tripUpdates/2.gz"]
+    assert other._bodies == {}
+    assert recording.body("tripUpdates/2.gz") is recording.body("tripUpdates/2.gz")
+
+
+def test_replay_serves_frames_against_its_clock(recording):
+    server = ReplayServer(recording, speed=0, port=0).start()
+    client = UpstreamClient()
+    try:
+        url = f"{server.url}/tripUpdates.json"
+        first = client.run(client.fetch_feed(url))
+        assert first.payload["n"] == 1
+        # same frame: the conditional GET gets a 304
+        assert client.run(client.fetch_feed(url)).not_modified
+
+        server._start_t = 1060.0
+        assert client.run(client.fetch_feed(url)).payload["n"] == 2
+        assert httpx.get(f"{server.url}/serviceAlerts.json").status_code == 404
+        assert httpx.get(f"{server.url}/clock").json()["now"] == 1060.0
+    finally:
+        client.close()
+        server.server.shutdown()
+
+
+def test_clock_runs_virtual_time_at_a_speed(restore_clock):
+    assert not clock.is_virtual()
+    assert abs(clock.time() - time.time()) < 1
+
+    clock.set_clock(1_700_000_000, speed=0)
+    assert clock.is_virtual() and clock.time() == 1_700_000_000
+    assert clock.today() == clock.now().date()
+
+    clock.set_clock(1_700_000_000, speed=1000)
+    time.sleep(0.01)
+    assert clock.time() >= 1_700_000_000 + 10
+    clock.reset_clock()
+    assert not clock.is_virtual()
@@ -0,0 +1,45 @@
+from types import SimpleNamespace
+
+import response_cache as rc
+from response_cache import ResponseCache
+
+
+def _versions(snapshot=1, bundle=1):
+    return SimpleNamespace(version=snapshot), SimpleNamespace(version=bundle)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(maxsize=2)
+    snapshot, bundle = _versions()
+    calls = []
+
+    def compute(params):
+        calls.append(params)
+        return params
+
+    def get(params):
+        return cache.get_or_compute("/api/stop", params, snapshot, bundle, lambda: compute(params))
+
+    evicted = rc._evictions.value()
+    get("a"), get("b"), get("a")          # "a" becomes the most recent
+    get("c")                              # evicts "b"
+    assert len(cache) == 2
+    assert rc._evictions.value() == evicted + 1
+
+    get("a"), get("c")
+    assert calls == ["a", "b", "c"]
+    get("b")
+    assert calls == ["a", "b", "c", "b"]
+
+
+def test_new_snapshot_or_bundle_misses():
+    cache = ResponseCache(maxsize=8)
+    hits = rc._lookups.value(endpoint="/api/vehicles", result="hit")
+    answers = iter(range(10))
+
+    def get(snapshot, bundle):
+        return cache.get_or_compute("/api/vehicles", (), *_versions(snapshot, bundle), lambda: next(answers))
+
+    assert [get(1, 1), get(1, 1), get(2, 1), get(2, 2), get(1, 1)] == [0, 0, 1, 2, 0]
+    assert rc._lookups.value(endpoint="/api/vehicles", result="hit") == hits + 2
+    assert cache.hit_ratios()[("/api/vehicles",)] > 0
@@ -0,0 +1,119 @@
+import os
+from datetime import date
+
+import numpy as np
+import pytest
+
+import realtime
+import shared_state
+import static_bundle
+from feed_cache import load_compiled_feed
+from feed_tables import TripUpdates, VehiclePositions
+
+DAY = date(2024, 6, 3)          # a Monday: WK runs
+SHAPED_FEED = {
+    "trips.txt": ["trip_id,route_id,service_id,shape_id", "T1,R1,WK,SH1", "T2,R2,WK,", "T3,R1,SAT,SH1"],
+    "shapes.txt": [
+        "shape_id,shape_pt_lat,shape_pt_lon,shape_pt_sequence",
+        "SH1,42.3760,-71.1160,1",
+        "SH1,42.3820,-71.1250,2",
+    ],
+}
+
+
+@pytest.fixture
+def shared_dir(tmp_path, monkeypatch):
+    directory = tmp_path / "shared"
+    directory.mkdir()
+    monkeypatch.setattr(shared_state, "SHARED_DIR", str(directory))
+    monkeypatch.setattr(shared_state, "SHARED_DAY_WAIT_SEC", 0)
+    monkeypatch.setattr(shared_state, "_published_parts", {})
+    monkeypatch.setattr(shared_state, "_published_pointer", None)
+    monkeypatch.setattr(shared_state, "_followed_parts", {})
+    monkeypatch.setattr(shared_state, "_seen_snapshot", None)
+    monkeypatch.setattr(static_bundle, "_day_builder", shared_state._shared_day)
+    monkeypatch.setattr(realtime, "_snapshot", None)
+    monkeypatch.setattr(realtime, "_listeners", [])
+    return directory
+
+
+def _as_role(monkeypatch, role):
+    monkeypatch.setattr(shared_state, "_role", role)
+
+
+def test_static_feed_and_days_are_shared_as_arrays(make_gtfs, shared_dir, monkeypatch):
+    feed = load_compiled_feed(make_gtfs(**SHAPED_FEED), use_cache=False)
+    _as_role(monkeypatch, "leader")
+    published = shared_state.publish_feed(feed, 1, "tiny")
+    leader = static_bundle.StaticBundle(published, 1, "tiny")
+    leader_mask, leader_index = leader.prepare_day(DAY)
+
+    static_dir = shared_dir / f"static-{feed['content_hash'][:16]}"
+    assert (static_dir / "trips" / "trip_ids.npy").exists()
+    assert (static_dir / f"day-{DAY.isoformat()}" / "times.npy").exists()
+
+    _as_role(monkeypatch, "follower")
+    follower = static_bundle.StaticBundle(shared_state._read_feed(str(static_dir)), 1, "tiny")
+    assert dict(follower.trip_route_map) == dict(feed["trip_route_map"])
+    assert dict(follower.trip_service_map) == dict(feed["trip_service_map"])
+    assert not follower.trips.trip_ids.flags.writeable          # mapped, not copied
+
+    mask, index = follower.prepare_day(DAY)
+    assert not index.times.flags.writeable
+    assert mask.tolist() == leader_mask.tolist()
+    assert {k: v.tolist() for k, v in index.as_dict().items()} == {
+        k: v.tolist() for k, v in leader_index.as_dict().items()
+    }
+    # a day the leader has not published is built privately
+    other_mask, _ = follower.prepare_day(date(2024, 6, 8))
+    assert other_mask.flags.writeable
+
+
+def test_snapshot_tables_are_shared_as_arrays(shared_dir, monkeypatch):
+    trip_updates = TripUpdates.from_json({"header": {"timestamp": 100}, "entity": [
+        {"trip_update": {
+            "trip": {"trip_id": "T1"}, "vehicle": {"label": "7"},
+            "stop_time_update": [{"stop_id": "S1", "arrival": {"time": 160}}],
+        }},
+    ]})
+    vehicle_positions = VehiclePositions.from_json({"entity": [
+        {"vehicle": {"vehicle": {"id": "V1"}, "position": {"latitude": 42.0, "longitude": -71.0}}},
+    ]})
+    stop_arrivals = trip_updates.stop_arrivals({"T1": "R1"}.get)
+
+    _as_role(monkeypatch, "leader")
+    snapshot = realtime.RealtimeSnapshot(
+        version=3, fetched_at=200.0, trip_updates=trip_updates,
+        vehicle_positions=vehicle_positions, stop_arrivals=stop_arrivals,
+        trip_updates_at=200.0, vehicle_positions_at=190.0,
+    )
+    shared_state._publish_snapshot(snapshot)
+
+    _as_role(monkeypatch, "follower")
+    shared_state._follow_snapshot()
+    adopted = realtime.current_snapshot()
+    assert (adopted.version, adopted.fetched_at) == (3, 200.0)
+    assert (adopted.trip_updates_at, adopted.vehicle_positions_at) == (200.0, 190.0)
+    assert adopted.trip_updates.timestamp == 100
+    assert adopted.trip_updates.trip_ids.tolist() == ["T1"]
+    assert adopted.vehicle_positions.identities().tolist() == ["V1"]
+    assert adopted.stop_arrivals.as_dict() == {"S1": [("T1", "R1", 160, "7")]}
+    assert not adopted.trip_updates.arrival_ts.flags.writeable
+
+    # unchanged tables keep their directory; only the previous snapshot's stay around
+    _as_role(monkeypatch, "leader")
+    for version in (4, 5):
+        shared_state._publish_snapshot(realtime.RealtimeSnapshot(
+            version=version, fetched_at=300.0, trip_updates=trip_updates,
+            vehicle_positions=VehiclePositions.from_json({"entity": []}), stop_arrivals=stop_arrivals,
+        ))
+    assert sorted(os.listdir(shared_dir / "realtime")) == [
+        "stop_arrivals-3", "trip_updates-3", "vehicle_positions-4", "vehicle_positions-5",
+    ]
+
+    _as_role(monkeypatch, "follower")
+    shared_state._follow_snapshot()
+    assert realtime.current_snapshot().version == 5
+    assert realtime.current_snapshot().trip_updates is adopted.trip_updates
+    assert len(realtime.current_snapshot().vehicle_positions) == 0
+    assert np.isnan(adopted.vehicle_positions.bearing).all()
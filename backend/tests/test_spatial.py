@@ -0,0 +1,76 @@
+import time
+
+import numpy as np
+import pytest
+
+from spatial import GridIndex, parse_bbox
+
+
+def _brute_nearest(lats, lons, index, lat, lon, n):
+    distances = index._distances_m(np.arange(len(lats)), lat, lon)
+    order = np.argsort(distances, kind="stable")[:n]
+    return order.tolist()
+
+
+@pytest.fixture(scope="module")
+def city():
+    rng = np.random.default_rng(5)
+    lats = rng.uniform(42.2, 42.5, 5000)
+    lons = rng.uniform(-71.3, -70.9, 5000)
+    return lats, lons, GridIndex(lats, lons)
+
+
+def test_parse_bbox_reorders_to_south_west_north_east():
+    assert parse_bbox("-71.1,42.3,-71.0,42.4") == (42.3, -71.1, 42.4, -71.0)
+
+
+@pytest.mark.parametrize("value", [
+    "1,2,3",
+    "a,b,c,d",
+    "-71.0,42.3,-71.1,42.4",        # west > east
+    "-71.1,42.4,-71.0,42.3",        # south > north
+    "nan,42.3,-71.0,42.4",
+    "-71.1,-inf,-71.0,42.4",
+    "-71.1,42.3,inf,42.4",
+])
+def test_parse_bbox_rejects(value):
+    with pytest.raises(ValueError):
+        parse_bbox(value)
+
+
+def test_within_matches_brute_force(city):
+    lats, lons, index = city
+    south, west, north, east = 42.30, -71.12, 42.36, -71.05
+    expected = np.flatnonzero((lats >= south) & (lats <= north) & (lons >= west) & (lons <= east))
+    assert index.within(south, west, north, east).tolist() == expected.tolist()
+    assert len(index.within(0.0, 0.0, 1.0, 1.0)) == 0
+    assert index.within(-90, -180, 90, 180).tolist() == list(range(len(lats)))
+
+
+@pytest.mark.parametrize("lat, lon", [(42.35, -71.06), (42.21, -71.29), (42.6, -71.1)])
+def test_nearest_matches_brute_force(city, lat, lon):
+    lats, lons, index = city
+    got = index.nearest(lat, lon, n=10)
+    assert [p for p, _ in got] == _brute_nearest(lats, lons, index, lat, lon, 10)
+    assert [d for _, d in got] == sorted(d for _, d in got)
+
+
+def test_nearest_respects_max_distance(city):
+    _, _, index = city
+    got = index.nearest(42.35, -71.06, n=100, max_distance_m=300)
+    assert got and all(d <= 300 for _, d in got)
+
+
+@pytest.mark.parametrize("lat, lon", [(50.0, -71.1), (0.0, 0.0), (-89.0, 179.0)])
+def test_nearest_far_outside_the_data_is_fast(city, lat, lon):
+    lats, lons, index = city
+    started = time.perf_counter()
+    got = index.nearest(lat, lon, n=3)
+    assert time.perf_counter() - started < 0.5
+    assert [p for p, _ in got] == _brute_nearest(lats, lons, index, lat, lon, 3)
+
+
+def test_empty_index():
+    index = GridIndex([], [])
+    assert index.nearest(42.0, -71.0) == []
+    assert len(index.within(-90, -180, 90, 180)) == 0
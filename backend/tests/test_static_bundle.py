@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+import feed_cache
+import main
+import static_bundle
+from conftest import TINY_FEED
+
+TRIPS = ["trip_id,route_id,service_id,shape_id", "T1,R1,WK,SH1", "T2,R2,WK,", "T3,R1,SAT,SH1"]
+SHAPES = [
+    "shape_id,shape_pt_lat,shape_pt_lon,shape_pt_sequence",
+    "SH1,42.3760,-71.1160,1",
+    "SH1,42.3820,-71.1250,2",
+]
+
+
+@pytest.fixture
+def feed(make_gtfs, tmp_path, monkeypatch):
+    """The tiny feed on disk, with a private compiled-feed cache and no live bundle."""
+    monkeypatch.setattr(feed_cache, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(static_bundle, "_bundle", None)
+    monkeypatch.setattr(static_bundle, "_swap_listeners", [])
+    return make_gtfs(**{"trips.txt": TRIPS, "shapes.txt": SHAPES})
+
+
+def _zip_with_extra_stop_time(feed_dir, tmp_path):
+    """The same feed zipped inside a top-level folder, with one more stop time."""
+    path = tmp_path / "next.zip"
+    with zipfile.ZipFile(path, "w") as archive:
+        for name in os.listdir(feed_dir):
+            if name.endswith(".txt") and name != "stop_times.txt":
+                archive.write(os.path.join(feed_dir, name), f"feed/{name}")
+        archive.writestr("feed/stop_times.txt", "\n".join(TINY_FEED["stop_times.txt"] + ["T3,S2,10:30:00,2"]) + "\n")
+    return str(path)
+
+
+def test_reload_swaps_in_a_new_bundle(feed, tmp_path):
+    swapped = []
+    static_bundle.add_swap_listener(swapped.append)
+    static_bundle.swap_bundle(static_bundle.load_bundle(feed))
+    serving = static_bundle.current_bundle()
+
+    static_bundle.reload_static(_zip_with_extra_stop_time(feed, tmp_path))
+    live = static_bundle.current_bundle()
+
+    assert (serving.version, live.version) == (1, 2)
+    assert live.content_hash != serving.content_hash
+    assert len(live.schedule) == len(serving.schedule) + 1
+    assert swapped == [serving, live]
+    # a request holding the previous bundle still sees its data unchanged
+    assert len(serving.schedule) == len(TINY_FEED["stop_times.txt"]) - 1
+    assert not static_bundle.reload_state["loading"] and static_bundle.reload_state["error"] is None
+
+
+def test_failed_reload_keeps_the_live_bundle(feed, tmp_path):
+    static_bundle.swap_bundle(static_bundle.load_bundle(feed))
+    live = static_bundle.current_bundle()
+    broken = tmp_path / "broken.zip"
+    with zipfile.ZipFile(broken, "w") as archive:
+        archive.writestr("readme.txt", "no feed here")
+
+    with pytest.raises(FileNotFoundError):
+        static_bundle.reload_static(str(broken))
+    assert static_bundle.current_bundle() is live
+    assert static_bundle.reload_state["error"].startswith("FileNotFoundError")
+    assert not static_bundle.reload_state["loading"]
+
+
+def test_only_one_background_reload_runs_at_a_time(feed, monkeypatch):
+    load_bundle = static_bundle.load_bundle
+    static_bundle.swap_bundle(load_bundle(feed))
+    release = threading.Event()
+    loads = []
+
+    def slow_load(source):
+        loads.append(source)
+        release.wait(5)
+        return load_bundle(source)
+
+    monkeypatch.setattr(static_bundle, "load_bundle", slow_load)
+    with ThreadPoolExecutor(8) as pool:
+        started = list(pool.map(lambda _: static_bundle.reload_static_in_background(feed), range(8)))
+    assert started.count(True) == 1 and static_bundle.reload_state["loading"]
+
+    release.set()
+    for _ in range(500):
+        if not static_bundle.reload_state["loading"]:
+            break
+        time.sleep(0.01)
+    assert loads == [feed] and static_bundle.current_bundle().version == 2
+    assert static_bundle.reload_static_in_background(feed)      # free again
+    assert static_bundle._reload_lock.acquire(timeout=5)
+    static_bundle._reload_lock.release()
+
+
+def test_reload_endpoint_requires_the_token(feed, monkeypatch):
+    started = []
+    monkeypatch.setattr(main, "reload_static_in_background", lambda path: started.append(path) or True)
+    client = TestClient(main.app)            # no startup: nothing is loaded or polled
+
+    monkeypatch.setattr(main, "STATIC_RELOAD_TOKEN", None)
+    assert client.post("/api/admin/reload-static", headers={"X-Reload-Token": ""}).status_code == 403
+
+    monkeypatch.setattr(main, "STATIC_RELOAD_TOKEN", "s3cret")
+    assert client.post("/api/admin/reload-static").status_code == 403
+    assert client.post("/api/admin/reload-static", headers={"X-Reload-Token": "guess"}).status_code == 403
+    missing = client.post("/api/admin/reload-static?path=/no/such/feed", headers={"X-Reload-Token": "s3cret"})
+    assert missing.status_code == 400
+    assert started == []
+
+    response = client.post(f"/api/admin/reload-static?path={feed}", headers={"X-Reload-Token": "s3cret"})
+    assert response.status_code == 200 and response.json()["started"] is True
+    assert started == [feed]
+
+
+def test_bundle_goes_live_with_today_and_tomorrow_prepared(feed):
+    bundle = static_bundle.load_bundle(feed)
+    today = datetime.now().date()
+    assert set(bundle._days) == {today, today + timedelta(days=1)}
+    assert bundle.schedule_index_today().keys() == bundle.prepare_day(today)[1].as_dict().keys()
+    assert bundle.schedule_index_today() is bundle.schedule_index_today()      # built once per day
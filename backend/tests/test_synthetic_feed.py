@@ -0,0 +1,44 @@
+import os
+import sys
+from datetime import datetime
+
+import gtfs_data
+import realtime
+from feed_tables import TripUpdates
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "benchmarks"))
+
+from synthetic_feed import RealtimeGenerator, ensure_static, generate_static  # noqa: E402
+
+NOW = datetime(2024, 6, 4, 9, 30)        # a Tuesday: weekday service
+
+
+def test_generated_feed_loads_and_realtime_matches_it(tmp_path):
+    feed_dir = str(tmp_path / "feed")
+    rows = generate_static(feed_dir, stops=40, routes=3, trips=60, stops_per_trip=6, today=NOW.date())
+
+    schedule, trip_route_map, stops, calendar_df, calendar_dates_df, trip_service_map = (
+        gtfs_data.load_static_data(feed_dir)
+    )
+    assert len(schedule) == rows and len(trip_route_map) == 60
+    assert len(stops) == 40
+    assert gtfs_data.load_shapes(feed_dir)
+    assert gtfs_data.get_active_service_ids(calendar_df, calendar_dates_df, NOW.date())
+
+    trip_updates, vehicle_positions = RealtimeGenerator(feed_dir, vehicles=5).payloads(NOW)
+    assert len(trip_updates["entity"]) == len(vehicle_positions["entity"]) == 5
+    trip_ids = {e["trip_update"]["trip"]["trip_id"] for e in trip_updates["entity"]}
+    assert trip_ids <= set(trip_route_map)
+    assert {trip_service_map[t] for t in trip_ids} == {"WKDY"}
+
+    index = realtime.build_stop_arrivals_index(TripUpdates.from_json(trip_updates))
+    assert set(index.stop_ids.tolist()) <= {stop["stop_id"] for stop in stops}
+
+
+def test_ensure_static_reuses_a_matching_feed(tmp_path):
+    feed_dir = str(tmp_path / "feed")
+    params = dict(stops=20, routes=2, trips=10, stops_per_trip=4)
+    rows = ensure_static(feed_dir, **params)
+    stamp = os.path.getmtime(os.path.join(feed_dir, "stop_times.txt"))
+    assert ensure_static(feed_dir, **params) == rows
+    assert os.path.getmtime(os.path.join(feed_dir, "stop_times.txt")) == stamp
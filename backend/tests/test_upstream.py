@@ -0,0 +1,117 @@
+import json
+
+import httpx
+import pytest
+
+from feed_tables import decode_trip_updates
+from upstream import CircuitBreaker, UpstreamClient, decode_json
+
+URL = "http://feeds.test/tripUpdates.json"
+
+
+class FakeUpstream:
+    """MockTransport handler answering from a queue of (status | exception) steps."""
+
+    def __init__(self, *steps):
+        self.steps = list(steps)
+        self.requests = []
+
+    def __call__(self, request):
+        self.requests.append(request)
+        step = self.steps.pop(0)
+        if isinstance(step, Exception):
+            raise step
+        if step == 200:
+            body = json.dumps({"entity": [], "n": len(self.requests)}).encode()
+            return httpx.Response(200, content=body, headers={"ETag": '"v1"'})
+        return httpx.Response(step)
+
+
+@pytest.fixture
+def make_client():
+    clients = []
+
+    def make(upstream):
+        client = UpstreamClient(transport=httpx.MockTransport(upstream))
+        clients.append(client)
+        return client
+
+    yield make
+    for client in clients:
+        client.close()
+
+
+def test_not_modified_reuses_the_cached_payload(make_client):
+    upstream = FakeUpstream(200, 304)
+    client = make_client(upstream)
+
+    first = client.run(client.fetch_feed(URL))
+    second = client.run(client.fetch_feed(URL))
+
+    assert first.status_code == 200 and first.payload["n"] == 1
+    assert second.not_modified and second.payload is first.payload
+    assert "if-none-match" not in upstream.requests[0].headers
+    assert upstream.requests[1].headers["If-None-Match"] == '"v1"'
+
+
+def test_failures_return_no_payload(make_client):
+    client = make_client(FakeUpstream(httpx.ReadTimeout("slow"), 503))
+    assert client.run(client.fetch_feed(URL)).error.startswith("ReadTimeout")
+    failed = client.run(client.fetch_feed(URL))
+    assert failed.payload is None and failed.status_code == 503
+
+
+def test_failures_open_the_circuit_and_a_half_open_probe_closes_it(make_client):
+    upstream = FakeUpstream(httpx.ReadTimeout("slow"), 503, 503, 200)
+    client = make_client(upstream)
+    breaker = client.breakers[URL] = CircuitBreaker(failures=2, base_sec=30, max_sec=60)
+
+    assert client.run(client.fetch_feed(URL)).error.startswith("ReadTimeout")
+    assert client.run(client.fetch_feed(URL)).status_code == 503
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # while open, nothing goes out
+    refused = client.run(client.fetch_feed(URL))
+    assert refused.payload is None and "circuit open" in refused.error
+    assert len(upstream.requests) == 2
+
+    # backoff over: one probe; it fails, so the circuit reopens
+    breaker.open_until = 0.0
+    assert client.run(client.fetch_feed(URL)).status_code == 503
+    assert breaker.state == CircuitBreaker.OPEN and breaker.reopens == 2
+
+    breaker.open_until = 0.0
+    recovered = client.run(client.fetch_feed(URL))
+    assert recovered.payload is not None
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.consecutive_failures == 0
+
+
+def test_fetch_many_keeps_request_order(make_client):
+    client = make_client(lambda request: httpx.Response(503 if request.url.query else 200, json={}))
+    good, bad = client.run(client.fetch_many([(URL, decode_json), (URL + "?v", decode_json)]))
+    assert good.payload is not None and bad.error == "HTTP 503"
+
+
+def test_unreadable_body_is_a_failure(make_client):
+    client = make_client(lambda request: httpx.Response(200, content=b"<html>"))
+    result = client.run(client.fetch_feed(URL))
+    assert result.payload is None and result.status_code == 200
+    assert result.error.startswith("invalid feed")
+
+
+def test_json_that_is_not_a_feed_is_a_failure(make_client):
+    client = make_client(lambda request: httpx.Response(200, json={"entity": [1, 2]}))
+    result = client.run(client.fetch_feed(URL, decode_trip_updates))
+    assert result.payload is None and result.error.startswith("invalid feed: malformed feed")
+    assert client.breakers[URL].consecutive_failures == 1
+
+
+def test_fetch_many_keeps_the_good_feed_when_a_decoder_breaks(make_client):
+    def broken(body, content_type=None):
+        raise RuntimeError("decoder bug")
+
+    client = make_client(lambda request: httpx.Response(200, json={"entity": []}))
+    good, bad = client.run(client.fetch_many([(URL, decode_trip_updates), (URL + "?v", broken)]))
+    assert good.payload is not None
+    assert bad.payload is None and bad.error == "RuntimeError: decoder bug"
+    assert client.breakers[URL + "?v"].consecutive_failures == 1
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from feed_tables import VehiclePositions
+from vehicle_history import VehicleHistory
+
+
+def _feed(fixes, header_ts=None):
+    """VehiclePositions of (vehicle_id, lat, lon, ts) fixes."""
+    return VehiclePositions.from_json({
+        "header": {"timestamp": header_ts},
+        "entity": [
+            {"vehicle": {
+                "vehicle": {"id": vehicle_id},
+                "position": {"latitude": lat, "longitude": lon},
+                "timestamp": ts,
+            }}
+            for vehicle_id, lat, lon, ts in fixes
+        ],
+    })
+
+
+def test_ring_keeps_the_newest_points_in_order():
+    history = VehicleHistory(points=3, vehicles=4)
+    for step in range(5):
+        history.record(_feed([("V1", 42.0 + step * 0.001, -71.0, 1000 + step * 10)]))
+
+    lat, _, ts = history.trail("V1")
+    assert ts.tolist() == [1020, 1030, 1040]
+    assert lat.tolist() == pytest.approx([42.002, 42.003, 42.004])
+
+
+def test_stale_and_unusable_fixes_are_skipped():
+    history = VehicleHistory(points=4, vehicles=4)
+    history.record(_feed([("V1", 42.0, -71.0, 1000)]))
+    history.record(_feed([("V1", 42.1, -71.0, 1000), ("V1", 42.2, -71.0, 990)]))   # not newer
+    history.record(_feed([("", 42.0, -71.0, 1010)]))                                 # no identity
+    history.record(_feed([("V2", 42.0, -71.0, 0)]), fetched_at=0)                    # no time at all
+    assert history.trail("V1")[2].tolist() == [1000]
+    assert len(history) == 1
+
+    # a fix without its own timestamp takes the header's
+    history.record(_feed([("V1", 42.0, -71.0, 0)], header_ts=1050))
+    assert history.trail("V1")[2].tolist() == [1000, 1050]
+
+
+def test_least_recently_reported_vehicle_is_evicted():
+    history = VehicleHistory(points=2, vehicles=2)
+    history.record(_feed([("V1", 42.0, -71.0, 1000), ("V2", 42.0, -71.0, 1000)]))
+    history.record(_feed([("V2", 42.0, -71.0, 1010)]))
+    history.record(_feed([("V3", 42.0, -71.0, 1020)]))
+
+    assert history.trail("V1") is None
+    assert history.trail("V3")[2].tolist() == [1020]
+    assert history.trail("V2")[2].tolist() == [1000, 1010]
+    assert len(history) == 2
+
+
+def test_motion_from_the_last_two_fixes():
+    history = VehicleHistory(points=4, vehicles=4)
+    history.record(_feed([("V1", 42.0, -71.0, 1000), ("V2", 42.0, -71.0, 1000)]))
+    # V1 moves ~111 m due north in 10 s; V2 stands still
+    history.record(_feed([("V1", 42.001, -71.0, 1010), ("V2", 42.0, -71.0, 1010)]))
+
+    motion = {v["vehicle_id"]: v for v in history.motion_payload()["vehicles"]}
+    assert motion["V1"]["speed_mps"] == pytest.approx(11.1, abs=0.05)
+    assert motion["V1"]["heading"] == pytest.approx(0.0, abs=0.1)
+    assert motion["V2"]["speed_mps"] == 0 and motion["V2"]["heading"] is None
+
+    trail = history.trail_payload("V1")
+    assert [p["speed_mps"] for p in trail["points"]] == [None, motion["V1"]["speed_mps"]]
+    assert np.isclose(trail["speed_mps"], motion["V1"]["speed_mps"])
@@ -0,0 +1,69 @@
+import asyncio
+import json
+
+from vehicle_stream import VehicleStream, vehicle_key
+
+
+def _frame_data(frame):
+    lines = frame.decode().splitlines()
+    return json.loads(next(line for line in lines if line.startswith("data: "))[len("data: "):])
+
+
+def _frame_event(frame):
+    return frame.decode().splitlines()[0][len("event: "):]
+
+
+def _vehicle(vehicle_id="", trip_id="", label="Unknown", lat=42.0):
+    return {"vehicle_id": vehicle_id, "trip_id": trip_id, "bus_number": label, "lat": lat, "position_timestamp": 1}
+
+
+def test_vehicle_key_falls_back_to_trip_then_label():
+    assert vehicle_key(_vehicle("V1", "T1", "101")) == "V1"
+    assert vehicle_key(_vehicle("", "T1", "101")) == "T1"
+    assert vehicle_key(_vehicle("", "", "101")) == "label:101"
+    assert vehicle_key(_vehicle()) is None
+
+
+def test_delta_only_carries_changed_vehicles():
+    stream = VehicleStream()
+    stream.publish(1, {"vehicles": [_vehicle("A"), _vehicle("B")]})
+    stream.publish(2, {"vehicles": [_vehicle("A"), _vehicle("B", lat=42.1), _vehicle("C")]})
+    delta = _frame_data(stream._delta_frame)
+    assert [v["vehicle_id"] for v in delta["upsert"]] == ["B", "C"]
+    assert delta["removed"] == [] and delta["base_version"] == 1
+
+    stream.publish(3, {"vehicles": [_vehicle("A")]})
+    assert sorted(_frame_data(stream._delta_frame)["removed"]) == ["B", "C"]
+
+
+def test_keyless_vehicles_do_not_collide():
+    stream = VehicleStream()
+    stream.publish(1, {"vehicles": [_vehicle(lat=1.0), _vehicle(lat=2.0), _vehicle(label="7")]})
+    stream.publish(2, {"vehicles": [_vehicle(lat=2.0), _vehicle(lat=1.0), _vehicle(label="7")]})
+    delta = _frame_data(stream._delta_frame)
+    assert delta["upsert"] == [] and delta["removed"] == []
+    assert [v["bus_number"] for v in _frame_data(stream._full_frame)["vehicles"]] == ["7"]
+
+
+def test_subscriber_gets_a_snapshot_then_deltas():
+    stream = VehicleStream()
+    stream.publish(1, {"vehicles": [_vehicle("A")]})
+
+    async def run():
+        frames = stream.subscribe()
+        first = await frames.__anext__()
+        pending = asyncio.ensure_future(frames.__anext__())
+        await asyncio.sleep(0)
+        stream.publish(2, {"vehicles": [_vehicle("A", lat=43.0)]})
+        second = await asyncio.wait_for(pending, 5)
+        # two versions behind: the delta no longer applies, so the full frame is resent
+        stream.publish(3, {"vehicles": []})
+        stream.publish(4, {"vehicles": [_vehicle("B")]})
+        third = await asyncio.wait_for(frames.__anext__(), 5)
+        await frames.aclose()
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+    assert _frame_event(first) == "snapshot" and _frame_data(first)["version"] == 1
+    assert _frame_event(second) == "delta" and _frame_data(second)["upsert"][0]["lat"] == 43.0
+    assert _frame_event(third) == "snapshot" and _frame_data(third)["version"] == 4
@@ -0,0 +1,284 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+
+import httpx
+
+from metrics import gauge, upstream_latency, upstream_requests
+
+# Strict limits so a slow upstream can never hold a poll (or a request that
+# joins one) for long.
+CONNECT_TIMEOUT_SEC = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT_SEC", "2"))
+READ_TIMEOUT_SEC    = float(os.environ.get("UPSTREAM_READ_TIMEOUT_SEC", "5"))
+MAX_CONNECTIONS     = int(os.environ.get("UPSTREAM_MAX_CONNECTIONS", "8"))
+
+# Circuit breaker: after BREAKER_FAILURES consecutive failures a feed is
+# left alone for BACKOFF_BASE_SEC, doubling on every failed retry up to
+# BACKOFF_MAX_SEC, so an upstream incident costs no requests at all.
+BREAKER_FAILURES = int(os.environ.get("UPSTREAM_BREAKER_FAILURES", "3"))
+BACKOFF_BASE_SEC = float(os.environ.get("UPSTREAM_BACKOFF_BASE_SEC", "5"))
+BACKOFF_MAX_SEC  = float(os.environ.get("UPSTREAM_BACKOFF_MAX_SEC", "300"))
+
+
+def feed_name(url):
+    """Short metric label for a feed URL (…/tripUpdates.json -> tripUpdates)."""
+    return url.rstrip("/").rsplit("/", 1)[-1].split(".", 1)[0] or url
+
+
+def decode_json(body, content_type=None):
+    """Default decoder: the body as JSON."""
+    return json.loads(body)
+
+
+class FeedResult:
+    """
+    Outcome of one conditional GET.
+
+      payload      – decoded feed (the cached object itself on a 304), or None
+      status_code  – HTTP status, or None if the request never completed
+      not_modified – True when the upstream answered 304
+      error        – short description when payload is None
+    """
+    __slots__ = ("payload", "status_code", "not_modified", "error")
+
+    def __init__(self, payload=None, status_code=None, not_modified=False, error=None):
+        self.payload = payload
+        self.status_code = status_code
+        self.not_modified = not_modified
+        self.error = error
+
+
+class CircuitBreaker:
+    """
+    Per-feed failure tracking.
+
+      closed    – requests go through; failures are counted
+      open      – BREAKER_FAILURES in a row: requests are refused until the
+                  backoff (base × 2^(reopens), capped, ±10% jitter) elapses
+      half_open – the backoff elapsed: one trial request decides between
+                  closed (success) and open again with a doubled backoff
+    """
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+    def __init__(self, failures=BREAKER_FAILURES, base_sec=BACKOFF_BASE_SEC, max_sec=BACKOFF_MAX_SEC):
+        self.failures = failures
+        self.base_sec = base_sec
+        self.max_sec = max_sec
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.reopens = 0
+        self.open_until = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """True when a request may go out now (at most one trial while half-open)."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() >= self.open_until:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self.reopens = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failures:
+                backoff = min(self.base_sec * 2 ** self.reopens, self.max_sec)
+                self.open_until = time.monotonic() + backoff * random.uniform(0.9, 1.1)
+                self.reopens += 1
+                self.state = self.OPEN
+
+    def retry_in_sec(self):
+        return max(0.0, self.open_until - time.monotonic()) if self.state == self.OPEN else 0.0
+
+
+class UpstreamClient:
+    """
+    Pooled async HTTP client for the GTFS-RT feeds, JSON or protobuf.
+
+    One httpx.AsyncClient (keep-alive connection pool, connect/read timeouts)
+    lives on a private event loop thread, so both async callers and the sync
+    poller share the same connections and TLS sessions.  Each URL remembers
+    its last ETag / Last-Modified and decoded payload; when the upstream
+    answers 304 the previous payload object is returned without re-parsing.
+    Each fetch names its decoder, `decode(body, content_type)`, which raises
+    ValueError for an unreadable body (see feed_tables for the GTFS-RT ones).
+    """
+
+    def __init__(self, connect_timeout=CONNECT_TIMEOUT_SEC, read_timeout=READ_TIMEOUT_SEC,
+                 max_connections=MAX_CONNECTIONS, transport=None):
+        self._transport = transport     # httpx transport override (tests use MockTransport)
+        self._timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self._limits = httpx.Limits(
+            max_connections=max_connections, max_keepalive_connections=max_connections
+        )
+        self._client = None
+        self._loop = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._validators = {}   # url -> (etag, last_modified, payload)
+        self.breakers = {}      # url -> CircuitBreaker
+
+    # ── event loop plumbing ────────────────────────────────────────────────
+
+    def _ensure_loop(self):
+        with self._start_lock:
+            if self._loop is not None:
+                return self._loop
+            ready = threading.Event()
+
+            def run():
+                self._loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(self._loop)
+                self._client = httpx.AsyncClient(
+                    timeout=self._timeout, limits=self._limits, transport=self._transport
+                )
+                ready.set()
+                self._loop.run_forever()
+
+            self._thread = threading.Thread(target=run, name="upstream-io", daemon=True)
+            self._thread.start()
+            ready.wait()
+            return self._loop
+
+    def run(self, coro):
+        """Run `coro` on the client's loop from any thread and wait for it."""
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+    def close(self):
+        if self._loop is None:
+            return
+        self.run(self._client.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self._loop = self._client = self._thread = None
+
+    # ── fetching ───────────────────────────────────────────────────────────
+
+    def breaker(self, url):
+        breaker = self.breakers.get(url)
+        if breaker is None:
+            breaker = self.breakers.setdefault(url, CircuitBreaker())
+        return breaker
+
+    async def fetch_feed(self, url, decode=decode_json):
+        """
+        Conditional GET of `url`, decoded with `decode`; must run on the
+        client's loop (see run). While the feed's circuit is open this
+        returns a failed FeedResult straight away, without touching the
+        network.
+        """
+        feed = feed_name(url)
+        breaker = self.breaker(url)
+        if not breaker.allow():
+            upstream_requests.inc(feed=feed, outcome="short_circuit")
+            return FeedResult(error=f"circuit open, retrying in {breaker.retry_in_sec():.0f}s")
+
+        started = time.perf_counter()
+        try:
+            result = await self._fetch_feed(url, decode)
+        except Exception as e:
+            # a failure nobody expected still counts against this feed only
+            result = FeedResult(error=f"{type(e).__name__}: {e}")
+        upstream_latency.observe(time.perf_counter() - started, feed=feed)
+        if result.payload is not None:
+            breaker.record_success()
+        else:
+            breaker.record_failure()
+        if result.not_modified:
+            outcome = "not_modified"
+        elif result.payload is not None:
+            outcome = "ok"
+        elif result.status_code == 200:
+            outcome = "invalid"
+        elif result.status_code is not None:
+            outcome = "http_error"
+        else:
+            outcome = "error"
+        upstream_requests.inc(feed=feed, outcome=outcome)
+        return result
+
+    async def _fetch_feed(self, url, decode):
+        etag, last_modified, cached = self._validators.get(url, (None, None, None))
+        headers = {}
+        if cached is not None:
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        try:
+            response = await self._client.get(url, headers=headers)
+        except httpx.HTTPError as e:
+            return FeedResult(error=f"{type(e).__name__}: {e}")
+
+        if response.status_code == 304 and cached is not None:
+            return FeedResult(cached, 304, not_modified=True)
+        if response.status_code != 200:
+            return FeedResult(status_code=response.status_code, error=f"HTTP {response.status_code}")
+
+        try:
+            payload = decode(response.content, response.headers.get("Content-Type"))
+        except ValueError as e:
+            return FeedResult(status_code=200, error=f"invalid feed: {e}")
+
+        self._validators[url] = (
+            response.headers.get("ETag"), response.headers.get("Last-Modified"), payload
+        )
+        return FeedResult(payload, 200)
+
+    async def fetch_many(self, feeds):
+        """
+        Fetch several (url, decode) feeds concurrently; returns FeedResults
+        in order.  fetch_feed never raises, so one broken feed cannot cost
+        the others their results.
+        """
+        return await asyncio.gather(*(self.fetch_feed(url, decode) for url, decode in feeds))
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Process-wide UpstreamClient, created on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = UpstreamClient()
+        return _client
+
+
+def circuit_states():
+    """{feed name: circuit state} for every feed fetched so far."""
+    client = _client
+    if client is None:
+        return {}
+    return {feed_name(url): breaker.state for url, breaker in list(client.breakers.items())}
+
+
+_STATE_VALUES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+
+gauge(
+    "passiogo_upstream_circuit_state", "Feed circuit breaker state (0 closed, 1 half-open, 2 open).",
+    ("feed",), callback=lambda: {(feed,): _STATE_VALUES[state] for feed, state in circuit_states().items()},
+)
+
+
+def close_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = None
@@ -0,0 +1,210 @@
+import os
+import threading
+
+import numpy as np
+
+from metrics import gauge, stage_latency
+
+# Positions kept per vehicle (the oldest is overwritten first).
+VEHICLE_HISTORY_POINTS = int(os.environ.get("VEHICLE_HISTORY_POINTS", "32"))
+# Vehicles tracked at once; the least recently reported one makes room for a new one.
+VEHICLE_HISTORY_VEHICLES = int(os.environ.get("VEHICLE_HISTORY_VEHICLES", "4096"))
+# Below this distance (metres) between two fixes a vehicle counts as standing
+# still, and no heading is derived from GPS jitter.
+MIN_HEADING_DISTANCE_M = 3.0
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def segment_motion(lat1, lon1, ts1, lat2, lon2, ts2):
+    """
+    Speed (m/s) and initial bearing (degrees, 0 = north) of the moves from
+    (lat1, lon1) at ts1 to (lat2, lon2) at ts2, over arrays.  Speed is NaN
+    when no time passed, heading NaN when the vehicle barely moved.
+    """
+    p1, p2 = np.radians(lat1), np.radians(lat2)
+    dlat, dlon = p2 - p1, np.radians(np.asarray(lon2) - np.asarray(lon1))
+    a = np.sin(dlat / 2) ** 2 + np.cos(p1) * np.cos(p2) * np.sin(dlon / 2) ** 2
+    distance = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+    dt = np.asarray(ts2, dtype=np.float64) - np.asarray(ts1, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        speed = np.where(dt > 0, distance / dt, np.nan)
+    heading = np.degrees(np.arctan2(
+        np.sin(dlon) * np.cos(p2),
+        np.cos(p1) * np.sin(p2) - np.sin(p1) * np.cos(p2) * np.cos(dlon),
+    )) % 360
+    heading = np.where(distance >= MIN_HEADING_DISTANCE_M, heading, np.nan)
+    return speed, heading
+
+
+def _or_none(values, digits):
+    """Array → list of rounded floats with NaN as None, for JSON."""
+    return [None if v != v else round(v, digits) for v in values.tolist()]
+
+
+class VehicleHistory:
+    """
+    Recent positions of every vehicle, in fixed-size arrays.
+
+    Each tracked vehicle owns one row of `points` slots in lat / lon /
+    timestamp arrays, used as a ring: the newest fix overwrites the oldest.
+    Rows are recycled from the least recently reported vehicle once all
+    `vehicles` rows are taken, so memory is fixed at construction no matter
+    how long the process runs or how many vehicles come and go.
+
+    A fix is only recorded when its timestamp is newer than the vehicle's
+    last one, so an unchanged (or re-served stale) feed adds nothing.
+    """
+
+    def __init__(self, points=VEHICLE_HISTORY_POINTS, vehicles=VEHICLE_HISTORY_VEHICLES):
+        self.points = points
+        self.capacity = vehicles
+        self._lock = threading.Lock()
+        self._lat = np.full((vehicles, points), np.nan)
+        self._lon = np.full((vehicles, points), np.nan)
+        self._ts = np.zeros((vehicles, points), dtype=np.int64)
+        self._head = np.zeros(vehicles, dtype=np.int64)     # next slot to write
+        self._count = np.zeros(vehicles, dtype=np.int64)    # fixes held, <= points
+        self._last_ts = np.zeros(vehicles, dtype=np.int64)  # newest fix, 0 when unused
+        self._ids = np.full(vehicles, None, dtype=object)   # row -> vehicle id
+        self._rows = {}                                     # vehicle id -> row
+
+    def __len__(self):
+        return len(self._rows)
+
+    @property
+    def nbytes(self):
+        arrays = (self._lat, self._lon, self._ts, self._head, self._count, self._last_ts, self._ids)
+        return sum(a.nbytes for a in arrays)
+
+    def record_snapshot(self, snapshot):
+        """Snapshot listener: add the vehicle positions of `snapshot`."""
+        with stage_latency.time(stage="vehicle_history"):
+            self.record(snapshot.vehicle_positions, snapshot.vehicle_positions_at)
+
+    def record(self, vehicle_positions, fetched_at=None):
+        """
+        Add one VehiclePositions feed.  Fixes without their own timestamp
+        take the header's, else `fetched_at`.
+        """
+        if vehicle_positions is None or not len(vehicle_positions):
+            return
+        header_ts = int(vehicle_positions.timestamp or fetched_at or 0)
+        ids = vehicle_positions.identities()
+        ts = np.where(vehicle_positions.position_ts > 0, vehicle_positions.position_ts, header_ts)
+        usable = (ids != "") & (ts > 0) & ~np.isnan(vehicle_positions.lat) & ~np.isnan(vehicle_positions.lon)
+        keep = np.flatnonzero(usable)
+        # one fix per vehicle id: the last entity wins
+        _, from_end = np.unique(ids[keep][::-1], return_index=True)
+        keep = np.sort(keep[len(keep) - 1 - from_end])[: self.capacity]
+        if not len(keep):
+            return
+
+        lat, lon, ts = vehicle_positions.lat[keep], vehicle_positions.lon[keep], ts[keep]
+        ids = ids[keep].tolist()
+        with self._lock:
+            rows = self._rows_for(ids)
+            fresh = ts > self._last_ts[rows]
+            rows, lat, lon, ts = rows[fresh], lat[fresh], lon[fresh], ts[fresh]
+            slots = self._head[rows]
+            self._lat[rows, slots] = lat
+            self._lon[rows, slots] = lon
+            self._ts[rows, slots] = ts
+            self._head[rows] = (slots + 1) % self.points
+            self._count[rows] = np.minimum(self._count[rows] + 1, self.points)
+            self._last_ts[rows] = ts
+
+    def _rows_for(self, ids):
+        """Row of each vehicle id, claiming free or least recently reported rows for new ones."""
+        get = self._rows.get
+        rows = np.fromiter((get(i, -1) for i in ids), dtype=np.int64, count=len(ids))
+        new = np.flatnonzero(rows < 0)
+        if not len(new):
+            return rows
+
+        free = np.flatnonzero(np.equal(self._ids, None))
+        if len(free) < len(new):
+            # evict the longest silent vehicles not reported in this batch
+            taken = np.ones(self.capacity, dtype=bool)
+            taken[free] = False
+            taken[rows[rows >= 0]] = False
+            candidates = np.flatnonzero(taken)
+            oldest = candidates[np.argsort(self._last_ts[candidates], kind="stable")]
+            free = np.concatenate([free, oldest[: len(new) - len(free)]])
+
+        for i, row in zip(new.tolist(), free[: len(new)].tolist()):
+            previous = self._ids[row]
+            if previous is not None:
+                del self._rows[previous]
+            self._ids[row] = ids[i]
+            self._rows[ids[i]] = row
+            self._head[row] = self._count[row] = self._last_ts[row] = 0
+            rows[i] = row
+        return rows
+
+    def trail(self, vehicle_id):
+        """(lat, lon, ts) arrays of `vehicle_id`'s fixes, oldest first, or None if untracked."""
+        with self._lock:
+            row = self._rows.get(vehicle_id)
+            if row is None:
+                return None
+            count = self._count[row]
+            order = (self._head[row] - count + np.arange(count)) % self.points
+            return self._lat[row, order], self._lon[row, order], self._ts[row, order]
+
+    def latest_motion(self):
+        """
+        (vehicle ids, timestamps, speed m/s, heading) from the last two fixes
+        of every vehicle that has at least two, computed in one pass.
+        """
+        with self._lock:
+            rows = np.flatnonzero(self._count >= 2)
+            last = (self._head[rows] - 1) % self.points
+            previous = (self._head[rows] - 2) % self.points
+            ids = self._ids[rows].tolist()
+            lat1, lon1, ts1 = self._lat[rows, previous], self._lon[rows, previous], self._ts[rows, previous]
+            lat2, lon2, ts2 = self._lat[rows, last], self._lon[rows, last], self._ts[rows, last]
+        speed, heading = segment_motion(lat1, lon1, ts1, lat2, lon2, ts2)
+        return ids, ts2, speed, heading
+
+    def trail_payload(self, vehicle_id):
+        """/api/vehicles/{vehicle_id}/trail response, or None if the vehicle is untracked."""
+        trail = self.trail(vehicle_id)
+        if trail is None:
+            return None
+        lat, lon, ts = trail
+        speed, heading = segment_motion(lat[:-1], lon[:-1], ts[:-1], lat[1:], lon[1:], ts[1:])
+        # per point: the move that led to it (none for the oldest)
+        speed = _or_none(np.concatenate([[np.nan], speed]), 2)
+        heading = _or_none(np.concatenate([[np.nan], heading]), 1)
+        points = [
+            {"lat": la, "lon": lo, "timestamp": t, "speed_mps": s, "heading": h}
+            for la, lo, t, s, h in zip(lat.tolist(), lon.tolist(), ts.tolist(), speed, heading)
+        ]
+        return {
+            "vehicle_id": vehicle_id,
+            "speed_mps": points[-1]["speed_mps"],
+            "heading": points[-1]["heading"],
+            "points": points,
+        }
+
+    def motion_payload(self):
+        """/api/vehicles/motion response: derived speed and heading of every tracked vehicle."""
+        ids, ts, speed, heading = self.latest_motion()
+        return {"vehicles": [
+            {"vehicle_id": i, "timestamp": t, "speed_mps": s, "heading": h}
+            for i, t, s, h in zip(ids, ts.tolist(), _or_none(speed, 2), _or_none(heading, 1))
+        ]}
+
+
+vehicle_history = VehicleHistory()
+
+gauge(
+    "passiogo_vehicle_history_vehicles", "Vehicles with recorded position history.",
+    callback=lambda: len(vehicle_history),
+)
+gauge(
+    "passiogo_vehicle_history_bytes", "Memory held by the position history arrays (fixed).",
+    callback=lambda: vehicle_history.nbytes,
+)
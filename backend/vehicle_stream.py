@@ -0,0 +1,127 @@
+import asyncio
+import json
+import threading
+
+from metrics import stage_latency
+
+# Seconds between SSE comment lines on an idle stream, so proxies keep it open.
+KEEPALIVE_SEC = 15
+
+# Fields that do not count as a change on their own.
+_IGNORED_FIELDS = ("position_timestamp",)
+
+
+def vehicle_key(vehicle):
+    """
+    Stable identity for a vehicle across snapshots: its vehicle_id, else its
+    trip_id, else its label; None when it has none of them.
+    """
+    label = vehicle.get("bus_number")
+    return (
+        vehicle.get("vehicle_id") or vehicle.get("trip_id")
+        or (f"label:{label}" if label and label != "Unknown" else None)
+    )
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+
+def _fingerprint(vehicle):
+    return tuple(v for k, v in vehicle.items() if k not in _IGNORED_FIELDS)
+
+
+class VehicleStream:
+    """
+    Server-sent-event fan-out of /api/vehicles payloads.
+
+    publish() is called once per realtime snapshot (from the poller thread).
+    It diffs the new vehicle list against the previous one and encodes two
+    frames a single time:
+
+      snapshot – the full payload, sent to new subscribers and to any
+                 subscriber that missed a version
+      delta    – {"upsert": [changed or new vehicles], "removed": [keys]}
+
+    Every subscriber then receives the same pre-encoded bytes, so the cost
+    per snapshot scales with the number of changed vehicles, not with
+    subscribers × fleet size.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._full_frame = None
+        self._delta_frame = None
+        self._delta_base = None          # version the delta applies on top of
+        self._fingerprints = {}          # vehicle key -> fingerprint
+        self._waiters = set()            # (loop, asyncio.Event)
+
+    @property
+    def version(self):
+        return self._version
+
+    def publish(self, version, payload):
+        with stage_latency.time(stage="stream_publish"):
+            self._publish(version, payload)
+
+    def _publish(self, version, payload):
+        # vehicles without any identity cannot be diffed; they are left out
+        vehicles = [v for v in payload.get("vehicles", []) if vehicle_key(v) is not None]
+        fingerprints = {vehicle_key(v): _fingerprint(v) for v in vehicles}
+
+        with self._lock:
+            previous = self._fingerprints
+            upsert = [v for v in vehicles if previous.get(vehicle_key(v)) != fingerprints[vehicle_key(v)]]
+            removed = [k for k in previous if k not in fingerprints]
+
+            self._delta_base = self._version
+            self._delta_frame = _sse("delta", {
+                "version": version,
+                "base_version": self._version,
+                "timestamp": payload.get("timestamp"),
+                "upsert": upsert,
+                "removed": removed,
+            })
+            self._full_frame = _sse("snapshot", dict(payload, vehicles=vehicles, version=version))
+            self._fingerprints = fingerprints
+            self._version = version
+            waiters, self._waiters = self._waiters, set()
+
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    async def _wait_for_change(self, seen_version):
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        with self._lock:
+            if self._version != seen_version:
+                return
+            self._waiters.add((loop, event))
+        try:
+            await asyncio.wait_for(event.wait(), KEEPALIVE_SEC)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._waiters.discard((loop, event))
+
+    async def subscribe(self):
+        """Async generator of SSE frames for one client."""
+        seen = None
+        while True:
+            with self._lock:
+                version = self._version
+                if version is None or version == seen:
+                    frame = None
+                elif seen is not None and self._delta_base == seen:
+                    frame = self._delta_frame
+                else:
+                    frame = self._full_frame
+
+            if frame is not None:
+                seen = version
+                yield frame
+            elif version is not None:
+                # nothing new within KEEPALIVE_SEC
+                yield b": keepalive\n\n"
+
+            await self._wait_for_change(seen)
@@ -0,0 +1,401 @@
+"""
+Offline benchmark suite for the backend.
+
+Generates (or reuses) a synthetic feed, serves matching GTFS-RT JSON from a
+local HTTP server, and times the static loaders, the schedule helpers and
+every /api endpoint.  Results are written as JSON so two runs can be
+compared:
+
+    python run_benchmarks.py --preset metro --out results/metro-$(git rev-parse --short HEAD).json
+    python run_benchmarks.py --preset metro --compare results/metro-old.json
+
+With --replay the endpoints are driven by a recorded GTFS-RT session
+(backend/gtfs_rt_replay.py) instead of synthetic realtime data, with the
+backend clock following the replay; pair it with --feed-dir pointing at the
+static feed the recording belongs to.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(HERE, "..", "backend")
+sys.path.insert(0, HERE)
+sys.path.insert(0, BACKEND_DIR)
+
+from synthetic_feed import PRESETS, RealtimeGenerator, ensure_static  # noqa: E402
+
+
+def summarize(samples, items_per_sample=1):
+    """Latency percentiles (ms) and throughput for a list of durations in seconds."""
+    samples = np.asarray(samples, dtype=float)
+    total = float(samples.sum())
+    return {
+        "n": int(len(samples)),
+        "total_sec": round(total, 6),
+        "ops_per_sec": round(len(samples) * items_per_sample / total, 2) if total > 0 else None,
+        "mean_ms": round(float(samples.mean()) * 1000, 4),
+        "p50_ms": round(float(np.percentile(samples, 50)) * 1000, 4),
+        "p99_ms": round(float(np.percentile(samples, 99)) * 1000, 4),
+        "max_ms": round(float(samples.max()) * 1000, 4),
+    }
+
+
+def timed(fn, repeat, warmup=0):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+@contextlib.contextmanager
+def quiet():
+    """Swallow the backend's console logging while measuring."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+class _RealtimeServer:
+    """tripUpdates.json / vehiclePositions.json from a RealtimeGenerator on 127.0.0.1."""
+
+    def __init__(self, generator):
+        self.generator = generator
+        self._lock = threading.Lock()
+        self._cache = (None, None)       # (second, (trip updates bytes, vehicle positions bytes))
+        outer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                trip_updates, vehicle_positions = outer.bodies()
+                if "tripUpdates" in self.path:
+                    body = trip_updates
+                elif "vehiclePositions" in self.path:
+                    body = vehicle_positions
+                else:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, name="bench-realtime", daemon=True).start()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def bodies(self):
+        second = int(time.time())
+        with self._lock:
+            if self._cache[0] != second:
+                trip_updates, vehicle_positions = self.generator.payloads()
+                self._cache = (second, (json.dumps(trip_updates).encode(), json.dumps(vehicle_positions).encode()))
+            return self._cache[1]
+
+    def stop(self):
+        self.server.shutdown()
+
+
+def bench_static(feed_dir, repeat):
+    import gtfs_data
+    from feed_cache import load_compiled_feed
+
+    results = {}
+    with quiet():
+        results["load_static_data"] = summarize(timed(lambda: gtfs_data.load_static_data(feed_dir), repeat))
+        results["load_shapes"] = summarize(timed(lambda: gtfs_data.load_shapes(feed_dir), repeat))
+        load_compiled_feed(feed_dir)    # writes the artifact
+        results["load_compiled_feed_cached"] = summarize(timed(lambda: load_compiled_feed(feed_dir), repeat))
+    results["load_static_data"]["peak_rss_mb"] = gtfs_data.last_load_stats.get("peak_rss_mb")
+    results["load_static_data"]["schedule_mb"] = round(gtfs_data.last_load_stats.get("schedule_mb", 0), 2)
+    return results
+
+
+def bench_schedule(feed_dir, calls, seed):
+    import gtfs_data
+    from static_bundle import row_service_index
+
+    rng = random.Random(seed)
+    with quiet():
+        schedule_df, _, _, calendar_df, calendar_dates_df, trip_service_map = gtfs_data.load_static_data(feed_dir)
+    results = {}
+
+    today = datetime.now().date()
+    dates = [today + timedelta(days=rng.randint(-20, 300)) for _ in range(calls)]
+    it = iter(dates)
+    results["get_active_service_ids"] = summarize(
+        timed(lambda: gtfs_data.get_active_service_ids(calendar_df, calendar_dates_df, next(it)), calls)
+    )
+
+    calendar = gtfs_data.build_service_calendar(calendar_df, calendar_dates_df)
+    row_service_idx = row_service_index(calendar, schedule_df, trip_service_map.trips)
+    results["build_day_index"] = summarize(
+        timed(lambda: gtfs_data.build_day_index(schedule_df, row_service_idx, calendar, today), 3)
+    )
+    _, flat = gtfs_data.build_day_index(schedule_df, row_service_idx, calendar, today)
+    index = flat.as_dict()
+
+    keys = list(index)
+    now = datetime.now()
+    lookups = [
+        (*rng.choice(keys), now + timedelta(seconds=rng.randint(-600, 1800)))
+        for _ in range(calls)
+    ]
+    it = iter(lookups)
+
+    def lookup():
+        stop_id, route_id, eta = next(it)
+        gtfs_data.get_stop_schedule_context(stop_id, route_id, eta, index, schedule_df)
+
+    results["get_stop_schedule_context"] = summarize(timed(lookup, calls))
+    results["get_stop_schedule_context"]["index_keys"] = len(keys)
+
+    # the same lookups as one vectorised batch (adherence.match_schedule)
+    from adherence import match_schedule
+
+    stop_ids, route_ids, etas = zip(*lookups)
+    eta_ts = [int(eta.timestamp()) for eta in etas]
+    results["match_schedule"] = summarize(
+        timed(lambda: match_schedule(flat, stop_ids, route_ids, eta_ts, now), 5, warmup=1), calls
+    )
+    results["match_schedule"]["batch_size"] = calls
+    return results
+
+
+def _decode_peak_bytes(decode, body):
+    tracemalloc.start()
+    try:
+        decode(body)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_formats(generator, repeat):
+    """
+    JSON vs binary GTFS-RT: body size, time and peak memory to decode each
+    feed into the tables the backend keeps (feed_tables).
+    """
+    from feed_tables import decode_trip_updates, decode_vehicle_positions
+    from gtfs_rt_pb import encode_feed, protobuf_available
+
+    if not protobuf_available():
+        return {"skipped": "gtfs-realtime-bindings is not installed"}
+
+    results = {}
+    feeds = zip(("tripUpdates", "vehiclePositions"), generator.payloads(), (decode_trip_updates, decode_vehicle_positions))
+    for feed, payload, decode_table in feeds:
+        json_body = json.dumps(payload).encode()
+        pb_body = encode_feed(payload)
+        for fmt, body, content_type in (
+            ("json", json_body, "application/json"), ("protobuf", pb_body, "application/x-protobuf")
+        ):
+            def decode(body, content_type=content_type, decode_table=decode_table):
+                return decode_table(body, content_type)
+
+            stats = summarize(timed(lambda: decode(body), repeat, warmup=1))
+            stats["body_bytes"] = len(body)
+            stats["peak_decode_bytes"] = _decode_peak_bytes(decode, body)
+            results[f"{feed}:{fmt}"] = stats
+    return results
+
+
+def _replay_server(replay_dir, speed):
+    from gtfs_rt_replay import Recording, ReplayServer
+
+    recording = Recording(replay_dir)
+    server = ReplayServer(recording, speed, port=0).start()
+    frame = recording.frame_at("tripUpdates", recording.first_t)
+    trip_updates = json.loads(recording.body(frame["file"])) if frame else {"entity": []}
+    return server, server.url, trip_updates
+
+
+def bench_endpoints(feed_dir, generator, requests, seed, replay_dir=None, replay_speed=1.0):
+    import clock
+    import realtime
+
+    if replay_dir:
+        server, base_url, trip_updates = _replay_server(replay_dir, replay_speed)
+        clock.CLOCK_URL = f"{base_url}/clock"
+    else:
+        server = _RealtimeServer(generator)
+        base_url = server.base_url
+        trip_updates, _ = generator.payloads()
+    realtime.REALTIME_URL = f"{base_url}/tripUpdates.json"
+    realtime.VEHICLE_POSITIONS_URL = f"{base_url}/vehiclePositions.json"
+
+    import gtfs_data
+    gtfs_data.STATIC_GTFS_DIR = feed_dir
+    from fastapi.testclient import TestClient
+    import main
+
+    stop_ids = sorted({
+        u["stop_id"] for e in trip_updates["entity"] if "trip_update" in e
+        for u in e["trip_update"].get("stop_time_update", [])
+    }) or ["none"]
+    rng = random.Random(seed)
+
+    endpoints = {
+        "/api/health": lambda: "/api/health",
+        "/api/stops": lambda: "/api/stops",
+        "/api/shapes": lambda: "/api/shapes",
+        "/api/shapes?zoom=12&encoding=polyline": lambda: "/api/shapes?zoom=12&encoding=polyline",
+        "/api/stop/{stop_id}": lambda: f"/api/stop/{rng.choice(stop_ids)}",
+        "/api/arrivals?stop_ids=all": lambda: "/api/arrivals?stop_ids=all",
+        "/api/active-routes": lambda: "/api/active-routes",
+        "/api/on-time": lambda: "/api/on-time",
+        "/api/stops/nearest": lambda: f"/api/stops/nearest?lat={rng.uniform(42.2, 42.5):.5f}&lon={rng.uniform(-71.3, -70.9):.5f}&n=10",
+        "/api/stops?bbox": lambda: "/api/stops?bbox=-71.12,42.33,-71.08,42.36",
+        "/api/vehicles?bbox": lambda: "/api/vehicles?bbox=-71.12,42.33,-71.08,42.36",
+        "/api/vehicles": lambda: "/api/vehicles",
+        "/api/admin/static-status": lambda: "/api/admin/static-status",
+        "/metrics": lambda: "/metrics",
+    }
+
+    results = {}
+    try:
+        with quiet(), TestClient(main.app) as client:
+            headers = {"Accept-Encoding": "gzip, br"}
+            for name, path_for in endpoints.items():
+                statuses = set()
+
+                def call():
+                    response = client.get(path_for(), headers=headers)
+                    statuses.add(response.status_code)
+
+                results[name] = summarize(timed(call, requests, warmup=min(5, requests)))
+                results[name]["statuses"] = sorted(statuses)
+    finally:
+        server.stop()
+    return results
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], cwd=HERE, capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(current, baseline):
+    """Prints p50 / p99 / throughput ratios (current / baseline) per benchmark."""
+    print(f"\n{'benchmark':<55} {'p50':>9} {'p99':>9} {'ops/s':>9}")
+    for section, entries in current["results"].items():
+        for name, stats in entries.items():
+            old = baseline.get("results", {}).get(section, {}).get(name)
+            if not old:
+                continue
+
+            def ratio(key):
+                return f"{stats[key] / old[key]:.2f}x" if old.get(key) and stats.get(key) else "-"
+
+            print(f"{section + ':' + name:<55} {ratio('p50_ms'):>9} {ratio('p99_ms'):>9} {ratio('ops_per_sec'):>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="small")
+    parser.add_argument("--feed-dir", help="where the synthetic feed is kept (default: a temp dir per preset)")
+    parser.add_argument("--vehicles", type=int, help="vehicles in the realtime feed")
+    parser.add_argument("--load-repeat", type=int, default=3, help="runs of each static loader")
+    parser.add_argument("--calls", type=int, default=5000, help="calls of each schedule helper")
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--only", nargs="+", choices=("static", "schedule", "endpoints", "formats"))
+    parser.add_argument("--replay", help="recording directory to replay instead of synthetic realtime data")
+    parser.add_argument("--replay-speed", type=float, default=1.0)
+    parser.add_argument("--poll-interval", type=float, help="REALTIME_POLL_INTERVAL_SEC for the endpoint run")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--out", help="write results JSON here (default: stdout)")
+    parser.add_argument("--compare", help="results JSON from an earlier run to compare against")
+    args = parser.parse_args()
+
+    stops, routes, trips, per_trip, vehicles = PRESETS[args.preset]
+    feed_dir = args.feed_dir or os.path.join(tempfile.gettempdir(), f"passiogo-bench-{args.preset}")
+    if args.poll_interval is not None:
+        os.environ["REALTIME_POLL_INTERVAL_SEC"] = str(args.poll_interval)
+    # keep the compiled-feed cache away from backend/.gtfs_cache
+    os.environ.setdefault("GTFS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "passiogo-bench-cache"))
+    params = dict(stops=stops, routes=routes, trips=trips, stops_per_trip=per_trip, seed=args.seed)
+
+    started = time.perf_counter()
+    stop_times = ensure_static(feed_dir, **params)
+    print(f"feed: {feed_dir} ({stop_times} stop_times, ready in {time.perf_counter() - started:.1f}s)", file=sys.stderr)
+
+    sections = args.only or ("static", "schedule", "endpoints", "formats")
+    results = {}
+    if "static" in sections:
+        print("timing static loaders...", file=sys.stderr)
+        results["static"] = bench_static(feed_dir, args.load_repeat)
+    if "schedule" in sections:
+        print("timing schedule helpers...", file=sys.stderr)
+        results["schedule"] = bench_schedule(feed_dir, args.calls, args.seed)
+    generator = None
+    if "endpoints" in sections and not args.replay or "formats" in sections:
+        generator = RealtimeGenerator(feed_dir, vehicles=args.vehicles or vehicles, seed=args.seed)
+    if "formats" in sections:
+        print("timing JSON vs protobuf decoding...", file=sys.stderr)
+        results["formats"] = bench_formats(generator, max(3, args.requests // 4))
+    if "endpoints" in sections:
+        print("timing endpoints...", file=sys.stderr)
+        results["endpoints"] = bench_endpoints(
+            feed_dir, generator, args.requests, args.seed, args.replay, args.replay_speed
+        )
+
+    report = {
+        "meta": {
+            "revision": _git_revision(),
+            "run_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "preset": args.preset,
+            "feed": dict(params, stop_times=stop_times, vehicles=args.vehicles or vehicles),
+            "replay": args.replay,
+            "poll_interval_sec": args.poll_interval,
+        },
+        "results": results,
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+        print(f"wrote {args.out}", file=sys.stderr)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+"""
+Synthetic static GTFS + matching GTFS-RT JSON, for benchmarks.
+
+Stops sit on a jittered grid; every route walks the grid in a mostly
+straight line and is run in both directions under three services
+(weekday / Saturday / Sunday).  Sizes scale independently, so the same
+generator produces the toy feed and a metro-sized one:
+
+    python synthetic_feed.py OUT_DIR --preset metro
+    python synthetic_feed.py OUT_DIR --stops 10000 --trips 100000 --stops-per-trip 30
+"""
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+PRESETS = {
+    #         stops   routes  trips   stops/trip  vehicles
+    "small": (500,    20,     2000,   20,         50),
+    "medium": (3000,  120,    20000,  25,         300),
+    "metro": (10000,  400,    100000, 30,         1500),
+}
+
+SERVICES = ("WKDY", "SAT", "SUN")
+_SERVICE_WEIGHTS = (0.7, 0.15, 0.15)
+
+# Area the grid covers (roughly greater Boston).
+_LAT0, _LAT1 = 42.20, 42.50
+_LON0, _LON1 = -71.30, -70.90
+
+MANIFEST = "synthetic.json"
+
+
+def _time_labels(max_sec):
+    """HH:MM:SS for every second up to `max_sec` (GTFS hours may pass 24)."""
+    return np.array(
+        [f"{s // 3600:02d}:{s % 3600 // 60:02d}:{s % 60:02d}" for s in range(max_sec + 1)], dtype=object
+    )
+
+
+def _route_walk(rng, side, length):
+    """Grid cells visited by one route: mostly straight, turning now and then."""
+    moves = np.array([(0, 1), (1, 0), (0, -1), (-1, 0)])
+    pos = rng.integers(0, side, size=2)
+    heading = rng.integers(0, 4)
+    cells = [tuple(pos)]
+    seen = {tuple(pos)}
+    attempts = 0
+    while len(cells) < length and attempts < length * 20:
+        attempts += 1
+        if rng.random() < 0.2:
+            heading = (heading + rng.choice((-1, 1))) % 4
+        nxt = np.clip(pos + moves[heading], 0, side - 1)
+        if tuple(nxt) == tuple(pos):            # ran into the edge
+            heading = (heading + 2) % 4
+            continue
+        pos = nxt
+        if tuple(pos) not in seen:
+            seen.add(tuple(pos))
+            cells.append(tuple(pos))
+    return cells
+
+
+def generate_static(out_dir, stops=500, routes=20, trips=2000, stops_per_trip=20, seed=7, today=None):
+    """
+    Writes agency/routes/stops/trips/stop_times/calendar/calendar_dates/shapes
+    .txt into `out_dir` and a manifest with the parameters.  Returns the
+    number of stop_times rows.
+    """
+    rng = np.random.default_rng(seed)
+    today = today or datetime.now().date()
+    os.makedirs(out_dir, exist_ok=True)
+
+    def write(name, df):
+        df.to_csv(os.path.join(out_dir, name), index=False)
+
+    # ── stops on a jittered grid ───────────────────────────────────────────
+    side = int(np.ceil(np.sqrt(stops)))
+    grid = np.arange(side * side)[:stops]
+    rows, cols = grid // side, grid % side
+    cell_lat = (_LAT1 - _LAT0) / side
+    cell_lon = (_LON1 - _LON0) / side
+    stop_lat = _LAT0 + (rows + 0.5 + rng.uniform(-0.3, 0.3, stops)) * cell_lat
+    stop_lon = _LON0 + (cols + 0.5 + rng.uniform(-0.3, 0.3, stops)) * cell_lon
+    stop_ids = np.array([f"S{i}" for i in range(stops)], dtype=object)
+    write("stops.txt", pd.DataFrame({
+        "stop_id": stop_ids,
+        "stop_code": "",
+        "stop_name": [f"Stop {i} (Platform {'AB'[i % 2]})" for i in range(stops)],
+        "stop_desc": "",
+        "stop_lat": stop_lat.round(6),
+        "stop_lon": stop_lon.round(6),
+        "location_type": 0,
+        "parent_station": "",
+    }))
+
+    # ── routes, their stop patterns and shapes ─────────────────────────────
+    patterns = []
+    for _ in range(routes):
+        cells = [r * side + c for r, c in _route_walk(rng, side, stops_per_trip)]
+        cells = [c for c in cells if c < stops] or [0]
+        patterns.append(np.array(cells))
+
+    route_ids = [str(1000 + r) for r in range(routes)]
+    write("agency.txt", pd.DataFrame({
+        "agency_id": ["1"], "agency_name": ["Synthetic Transit"], "agency_url": ["https://example.com"],
+        "agency_timezone": ["America/New_York"],
+    }))
+    write("routes.txt", pd.DataFrame({
+        "route_id": route_ids,
+        "agency_id": "1",
+        "route_short_name": [f"R{r}" for r in range(routes)],
+        "route_long_name": [f"Synthetic Route {r}" for r in range(routes)],
+        "route_type": 3,
+        "route_color": [f"{rng.integers(0, 1 << 24):06X}" for _ in range(routes)],
+        "route_text_color": "FFFFFF",
+    }))
+
+    shape_frames = []
+    for r, pattern in enumerate(patterns):
+        pts = np.column_stack([stop_lat[pattern], stop_lon[pattern]])
+        if len(pts) > 1:
+            # a midpoint per segment, nudged off the straight line
+            mids = (pts[:-1] + pts[1:]) / 2 + rng.normal(0, 0.0002, (len(pts) - 1, 2))
+            dense = np.empty((len(pts) + len(mids), 2))
+            dense[0::2], dense[1::2] = pts, mids
+        else:
+            dense = pts
+        for direction, line in ((0, dense), (1, dense[::-1])):
+            shape_frames.append(pd.DataFrame({
+                "shape_id": f"SH{r}_{direction}",
+                "shape_pt_lat": line[:, 0].round(6),
+                "shape_pt_lon": line[:, 1].round(6),
+                "shape_pt_sequence": np.arange(1, len(line) + 1),
+            }))
+    write("shapes.txt", pd.concat(shape_frames, ignore_index=True))
+
+    # ── trips ──────────────────────────────────────────────────────────────
+    trip_idx = np.arange(trips)
+    trip_route = trip_idx % routes
+    trip_dir = (trip_idx // routes) % 2
+    trip_service = rng.choice(len(SERVICES), size=trips, p=_SERVICE_WEIGHTS)
+    trip_ids = np.array([f"T{i}" for i in range(trips)], dtype=object)
+    write("trips.txt", pd.DataFrame({
+        "route_id": np.array(route_ids, dtype=object)[trip_route],
+        "service_id": np.array(SERVICES, dtype=object)[trip_service],
+        "trip_id": trip_ids,
+        "direction_id": trip_dir,
+        "shape_id": [f"SH{r}_{d}" for r, d in zip(trip_route, trip_dir)],
+    }))
+
+    # ── stop_times: one block per trip, built column-wise ──────────────────
+    lengths = np.array([len(patterns[r]) for r in trip_route])
+    total = int(lengths.sum())
+    row_trip = np.repeat(trip_idx, lengths)
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    seq = np.arange(total) - np.repeat(offsets, lengths)              # 0-based position in trip
+
+    # stop of each row: patterns laid out as [route0 dir0, route0 dir1, route1 dir0, ...]
+    flat = np.concatenate([np.concatenate([p, p[::-1]]) for p in patterns])
+    pattern_len = np.array([len(p) for p in patterns])
+    route_start = np.concatenate([[0], np.cumsum(2 * pattern_len)[:-1]])
+    trip_start = route_start[trip_route] + trip_dir * pattern_len[trip_route]
+    row_stop = flat[np.repeat(trip_start, lengths) + seq]
+
+    start_sec = rng.integers(5 * 3600, 25 * 3600, size=trips)          # some run past midnight
+    hops = rng.integers(60, 240, size=total)
+    hops[offsets] = 0
+    arrival = np.repeat(start_sec, lengths) + np.cumsum(hops) - np.repeat(np.cumsum(hops)[offsets], lengths)
+    labels = _time_labels(int(arrival.max()))[arrival]
+    write("stop_times.txt", pd.DataFrame({
+        "trip_id": trip_ids[row_trip],
+        "arrival_time": labels,
+        "departure_time": labels,
+        "stop_id": stop_ids[row_stop],
+        "stop_sequence": seq + 1,
+    }))
+
+    # ── calendar ───────────────────────────────────────────────────────────
+    start = (today - timedelta(days=30)).strftime("%Y%m%d")
+    end = (today + timedelta(days=365)).strftime("%Y%m%d")
+    write("calendar.txt", pd.DataFrame({
+        "service_id": SERVICES,
+        "monday": [1, 0, 0], "tuesday": [1, 0, 0], "wednesday": [1, 0, 0], "thursday": [1, 0, 0],
+        "friday": [1, 0, 0], "saturday": [0, 1, 0], "sunday": [0, 0, 1],
+        "start_date": start, "end_date": end,
+    }))
+    holiday = (today + timedelta(days=10)).strftime("%Y%m%d")
+    write("calendar_dates.txt", pd.DataFrame({
+        "service_id": ["WKDY", "SUN"], "date": [holiday, holiday], "exception_type": [2, 1],
+    }))
+
+    with open(os.path.join(out_dir, MANIFEST), "w") as f:
+        json.dump({
+            "stops": stops, "routes": routes, "trips": trips, "stops_per_trip": stops_per_trip,
+            "seed": seed, "generated_for": today.isoformat(), "stop_times": total,
+        }, f, indent=2)
+    return total
+
+
+def ensure_static(out_dir, **params):
+    """
+    generate_static unless `out_dir` already holds a feed with these
+    parameters for today.  A directory holding a feed that was not
+    generated here (no manifest) is used as it is and never overwritten.
+    """
+    path = os.path.join(out_dir, MANIFEST)
+    wanted = dict(params, generated_for=datetime.now().date().isoformat())
+    stop_times = os.path.join(out_dir, "stop_times.txt")
+    if not os.path.exists(path) and os.path.exists(stop_times):
+        with open(stop_times, "rb") as f:
+            return sum(1 for _ in f) - 1
+    if os.path.exists(path):
+        with open(path) as f:
+            manifest = json.load(f)
+        if all(manifest.get(k) == v for k, v in wanted.items()):
+            return manifest["stop_times"]
+    return generate_static(out_dir, **params)
+
+
+class RealtimeGenerator:
+    """
+    tripUpdates / vehiclePositions JSON for the synthetic feed in `feed_dir`.
+
+    `vehicles` trips running at the moment of each call get a predicted
+    arrival (schedule ± a per-trip delay) for their remaining stops and a
+    position at their next stop.  When fewer trips are running (at night),
+    the ones starting next are used.
+    """
+
+    def __init__(self, feed_dir, vehicles=50, seed=11):
+        self.vehicles = vehicles
+        self._rng = np.random.default_rng(seed)
+        trips = pd.read_csv(os.path.join(feed_dir, "trips.txt"), usecols=["trip_id", "route_id", "service_id"], dtype=str)
+        stop_times = pd.read_csv(
+            os.path.join(feed_dir, "stop_times.txt"), usecols=["trip_id", "stop_id", "arrival_time"],
+            dtype={"trip_id": "category", "stop_id": str, "arrival_time": "category"},
+        )
+        stops = pd.read_csv(os.path.join(feed_dir, "stops.txt"), usecols=["stop_id", "stop_lat", "stop_lon"], dtype={"stop_id": str})
+
+        codes, uniques = pd.factorize(stop_times["arrival_time"])
+        parsed = np.array([int(h) * 3600 + int(m) * 60 + int(s) for h, m, s in (t.split(":") for t in uniques)])
+        self._arrival = parsed[codes]
+        self._trip_codes = stop_times["trip_id"].cat.codes.to_numpy()
+        self._trip_names = stop_times["trip_id"].cat.categories.astype(str).to_numpy()
+        self._stop_ids = stop_times["stop_id"].to_numpy()
+        # rows are grouped per trip: [start, end) of each trip code
+        order = np.argsort(self._trip_codes, kind="stable")
+        self._order = order
+        sorted_codes = self._trip_codes[order]
+        self._bounds = np.searchsorted(sorted_codes, np.arange(len(self._trip_names) + 1))
+        first = self._arrival[order][self._bounds[:-1]]
+        last = self._arrival[order][np.maximum(self._bounds[1:] - 1, 0)]
+        self._first, self._last = first, last
+
+        info = trips.set_index("trip_id")
+        self._route = info["route_id"].reindex(self._trip_names).fillna("").to_numpy()
+        self._service = info["service_id"].reindex(self._trip_names).fillna("").to_numpy()
+        coords = stops.set_index("stop_id")
+        self._lat = coords["stop_lat"].to_dict()
+        self._lon = coords["stop_lon"].to_dict()
+        self._delays = self._rng.integers(-180, 600, size=len(self._trip_names))
+
+    def _running(self, now):
+        midnight = datetime.combine(now.date(), datetime.min.time())
+        weekday = now.weekday()
+        service = "WKDY" if weekday < 5 else ("SAT" if weekday == 5 else "SUN")
+        now_sec = (now - midnight).total_seconds()
+        active = self._service == service
+        running = np.flatnonzero(active & (self._first <= now_sec) & (self._last >= now_sec))
+        if len(running) < self.vehicles:
+            upcoming = np.flatnonzero(active & (self._first > now_sec))
+            upcoming = upcoming[np.argsort(self._first[upcoming])][: self.vehicles - len(running)]
+            running = np.concatenate([running, upcoming])
+        return running[: self.vehicles], midnight
+
+    def payloads(self, now=None):
+        """(tripUpdates, vehiclePositions) as parsed-JSON dicts for `now`."""
+        now = now or datetime.now()
+        now_ts = int(now.timestamp())
+        running, midnight = self._running(now)
+        midnight_ts = int(midnight.timestamp())
+
+        trip_entities, vehicle_entities = [], []
+        for n, code in enumerate(running):
+            rows = self._order[self._bounds[code]:self._bounds[code + 1]]
+            predicted = midnight_ts + self._arrival[rows] + int(self._delays[code])
+            upcoming = np.flatnonzero(predicted >= now_ts)
+            if len(upcoming) == 0:
+                upcoming = np.arange(len(rows))[-1:]
+            trip_id = str(self._trip_names[code])
+            route_id = str(self._route[code])
+            vehicle = {"id": f"V{code}", "label": str(1000 + code)}
+            trip_entities.append({"id": str(n), "trip_update": {
+                "trip": {"trip_id": trip_id, "route_id": route_id},
+                "vehicle": vehicle,
+                "stop_time_update": [
+                    {"stop_id": self._stop_ids[rows[i]], "arrival": {"time": int(predicted[i])}}
+                    for i in upcoming
+                ],
+            }})
+            next_stop = self._stop_ids[rows[upcoming[0]]]
+            vehicle_entities.append({"id": str(n), "vehicle": {
+                "trip": {"trip_id": trip_id, "route_id": route_id},
+                "vehicle": vehicle,
+                "position": {
+                    "latitude": float(self._lat.get(next_stop, 0.0)) + float(self._rng.normal(0, 1e-4)),
+                    "longitude": float(self._lon.get(next_stop, 0.0)) + float(self._rng.normal(0, 1e-4)),
+                    "bearing": float(self._rng.integers(0, 360)),
+                    "speed": float(self._rng.uniform(0, 15)),
+                },
+                "timestamp": now_ts,
+            }})
+
+        header = {"gtfs_realtime_version": "2.0", "timestamp": now_ts}
+        return {"header": header, "entity": trip_entities}, {"header": header, "entity": vehicle_entities}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("out_dir")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="small")
+    parser.add_argument("--stops", type=int)
+    parser.add_argument("--routes", type=int)
+    parser.add_argument("--trips", type=int)
+    parser.add_argument("--stops-per-trip", type=int)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    stops, routes, trips, per_trip, _ = PRESETS[args.preset]
+    started = time.perf_counter()
+    rows = generate_static(
+        args.out_dir,
+        stops=args.stops or stops, routes=args.routes or routes, trips=args.trips or trips,
+        stops_per_trip=args.stops_per_trip or per_trip, seed=args.seed,
+    )
+    print(f"wrote {rows} stop_times to {args.out_dir} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -33,6 +33,7 @@ function App() {
 
   useEffect(() => {
     let cancelled = false;
+    let pollId = null;
 
     const fetchVehicles = () => {
       fetch("http://localhost:8000/api/vehicles")
@@ -47,11 +48,50 @@ function App() {
         });
     };
 
-    fetchVehicles();
-    const id = setInterval(fetchVehicles, 6000);
+    const startPolling = () => {
+      if (pollId) return;
+      fetchVehicles();
+      pollId = setInterval(fetchVehicles, 6000);
+    };
+
+    if (typeof EventSource === "undefined") {
+      startPolling();
+      return () => {
+        cancelled = true;
+        clearInterval(pollId);
+      };
+    }
+
+    // Push stream: one full snapshot on connect, then per-vehicle deltas.
+    // same identity as vehicle_key() in backend/vehicle_stream.py
+    const vehicleKey = (v) =>
+      v.vehicle_id || v.trip_id || (v.bus_number && v.bus_number !== "Unknown" ? `label:${v.bus_number}` : undefined);
+    const byKey = new Map();
+    const source = new EventSource("http://localhost:8000/api/vehicles/stream");
+
+    source.addEventListener("snapshot", (event) => {
+      const data = JSON.parse(event.data);
+      byKey.clear();
+      for (const v of data.vehicles || []) byKey.set(vehicleKey(v), v);
+      if (!cancelled) setVehicles([...byKey.values()]);
+    });
+
+    source.addEventListener("delta", (event) => {
+      const data = JSON.parse(event.data);
+      for (const key of data.removed || []) byKey.delete(key);
+      for (const v of data.upsert || []) byKey.set(vehicleKey(v), v);
+      if (!cancelled) setVehicles([...byKey.values()]);
+    });
+
+    source.onerror = () => {
+      // EventSource reconnects on its own; fall back to polling if it gives up.
+      if (source.readyState === EventSource.CLOSED) startPolling();
+    };
+
     return () => {
       cancelled = true;
-      clearInterval(id);
+      source.close();
+      clearInterval(pollId);
     };
   }, []);
 